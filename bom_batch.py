@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Headless batch run (بدون Streamlit)
+# - run_analysis: نفس تحليل زر "تشغيل التحليل" كدالة قابلة للاستيراد
+# - توزيع الـ Parents على ProcessPoolExecutor عشان نستخدم كل الـ cores
+# - CLI: python bom_batch.py workbook.xlsx -o report.xlsx
+# - --snapshot: إعادة استخدام نتايج الـ Parents اللي ما اتغيرتش من آخر snapshot + شيت Change_Report
+# ==============================================================================
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import pandas as pd
+
+from bom_engine import (EXPLODE_MODES, analyze_parent_long, build_desc_lookup, build_engine, build_mrp_dict,
+                        component_mask, explode_engine, parent_wide)
+from bom_export import EXPORT_FORMATS, ReportWriter, format_from_path
+from bom_index import build_children_index
+from bom_ingest import file_kind, load_inputs
+from bom_profile import memory_tracing, new_profile, profile_json, profile_stage, track_parents
+from bom_qty import QTY_VARIANCE_COLUMNS, part_qty_variance, rank_qty_variance
+from bom_results import build_result_store, summary_row
+from bom_similarity import SIBLING_COLUMNS, near_duplicates, nearest_siblings
+from bom_snapshot import (SNAPSHOT_DIR, change_report, fingerprint_map, latest_snapshot, load_snapshot,
+                          parent_fingerprints, restore_part, save_snapshot, snapshot_changes, snapshot_key)
+
+# عدد الـ Parents في كل task للـ worker (أقل overhead في الـ pickling)
+CHUNK_SIZE = 64
+
+# حالة الـ worker: بتتبعت مرة واحدة لكل process عن طريق الـ initializer
+_WORKER = {}
+
+
+def parent_summary_row(part):
+    """
+    سطر الملخص لـ Parent واحد (نفس أعمدة Summary_Report) من نتيجة analyze_parent_long.
+    """
+    return summary_row(part["parent"], len(part["child_names"]), part["counts"])
+
+
+def prepare_analysis(bom_df, father_df, mrp_df, cols, selected_order_types=None, selected_mrp_controllers=None,
+                     explode=None, profile=None, children_index=None, engine=None):
+    """
+    تجهيز كل اللي التحليل محتاجه مرة واحدة: MRP + الوصف + المحرك + ماسك الفلاتر + فهرس الأبناء.
+    explode: None = مستوى واحد (المكونات المباشرة)، "all" / "leaves" = تفجير BOM متعدد المستويات
+    profile: لو اتبعت، مراحل التجميع بتتسجل فيه (شوف bom_profile)
+    children_index: فهرس parent -> children جاهز (لو اتبني وقت التحميل)، وإلا بيتبني هنا
+    engine: محرك جاهز (مثلًا من نسخة منشورة، شوف bom_publish) بدل build_engine
+    """
+    if children_index is None:
+        with profile_stage(profile, "children index", rows=0 if father_df is None else len(father_df)):
+            children_index = build_children_index(father_df, cols["parent_col"], cols["child_col"])
+    if engine is None:
+        with profile_stage(profile, "lookups (MRP + desc)", rows=0 if mrp_df is None else len(mrp_df)):
+            mrp_dict = build_mrp_dict(mrp_df, cols["mrp_component_col"])
+            desc_lookup = build_desc_lookup(
+                bom_df, mrp_df, cols["mrp_component_col"], cols["desc_col_bom"], cols["desc_col_mrp"],
+                cols["component_col"]
+            )
+        with profile_stage(profile, "grouping (BOM matrix)", rows=len(bom_df)):
+            engine = build_engine(
+                bom_df, cols["code_col"], cols["component_col"], cols["qty_col"],
+                father_df=father_df, child_col=cols["child_col"],
+                mrp_dict=mrp_dict, desc_lookup=desc_lookup,
+                mrp_controller_col=cols["mrp_controller_col"], mrp_order_type_col=cols["mrp_order_type_col"],
+            )
+    if explode:
+        with profile_stage(profile, f"explode ({explode})") as record:
+            engine = explode_engine(engine, explode)
+            record["rows"] = int(engine["matrix"].nnz)
+    return {
+        "engine": engine,
+        "comp_mask": component_mask(engine, selected_order_types, selected_mrp_controllers),
+        "children_index": children_index,
+    }
+
+
+def analyze_parents(context, parents):
+    """
+    تحليل مجموعة Parents بالترتيب. بترجع list من نتائج analyze_parent_long
+    (صيغة long خفيفة، فالرجوع من الـ workers أرخص بكتير من الجداول العريضة).
+    """
+    children_index = context["children_index"]
+    results = []
+    for parent in parents:
+        start = time.perf_counter()
+        parent = str(parent).strip()
+        # lookup في الفهرس بدل scan لشيت father لكل Parent
+        children = list(children_index.get(parent, []))
+        part = analyze_parent_long(context["engine"], parent, children, context["comp_mask"])
+        # وقت الـ Parent ده (بيتقاس جوه الـ worker) عشان أبطأ الـ Parents في الـ diagnostics
+        part["seconds"] = time.perf_counter() - start
+        results.append(part)
+    return results
+
+
+def _init_worker(context):
+    _WORKER["context"] = context
+
+
+def _analyze_chunk(parents):
+    return analyze_parents(_WORKER["context"], parents)
+
+
+def iter_parent_results(context, parents, workers=None):
+    """
+    نتائج الـ Parents بنفس ترتيب الإدخال.
+    workers=1 => نفس الـ process، غير كده => ProcessPoolExecutor (الافتراضي كل الـ cores).
+    """
+    parents = list(parents)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(parents) <= CHUNK_SIZE:
+        yield from analyze_parents(context, parents)
+        return
+    chunks = [parents[i:i + CHUNK_SIZE] for i in range(0, len(parents), CHUNK_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(context,)) as pool:
+        for chunk_results in pool.map(_analyze_chunk, chunks):
+            yield from chunk_results
+
+
+def iter_snapshot_results(context, parents, previous=None, fingerprints=None, workers=None, stats=None):
+    """
+    زي iter_parent_results بس في وضع الـ snapshot: الـ Parent اللي الـ fingerprint بتاعه زي الـ snapshot
+    القديم بيترجع منه، والباقي بس هو اللي بيتحلل (على الـ workers). الترتيب زي الإدخال.
+    stats (dict) لو اتبعت بيتملي بعدد الـ Parents اللي اترجعت / اتحللت.
+    """
+    parents = [str(p).strip() for p in parents]
+    fingerprints = fingerprints if fingerprints is not None else parent_fingerprints(context, parents)
+    old = fingerprint_map(previous) if previous is not None else {}
+    reused = {p for p in parents if old.get(p) == fingerprints[p]}
+    changed = iter_parent_results(context, [p for p in parents if p not in reused], workers)
+    if stats is not None:
+        stats.update(parents=len(parents), reused=len(reused), recomputed=len(parents) - len(reused))
+    for parent in parents:
+        yield restore_part(previous, context["engine"], parent) if parent in reused else next(changed)
+
+
+def _input_source(path, sheet, files):
+    # (الملف، الشيت) لـ load_inputs: الإكسل محتاج اسم شيت، وCSV / Parquet الملف كله جدول واحد
+    if path is None or (file_kind(path) == "xlsx" and (sheet is None or sheet == "None")):
+        return None
+    files[path] = path
+    return path, sheet if file_kind(path) == "xlsx" else None
+
+
+def run_analysis(workbook_path, bom_sheet="Bom", father_sheet="father code", mrp_sheet="MRP Controller",
+                 parents=None, selected_order_types=None, selected_mrp_controllers=None,
+                 output_path=None, output_format=None, workers=None, keep_results=True, explode=None,
+                 profile=None, snapshot_dir=None, snapshot_info=None, father_path=None, mrp_path=None):
+    """
+    تشغيل التحليل كامل من ملف إكسل (بدون واجهة).
+    - workbook_path ممكن يكون CSV / Parquet للـ BOM بس، وfather_path / mrp_path ملفات منفصلة
+      (xlsx بالشيتات father_sheet / mrp_sheet، أو CSV / Parquet). الملفات بتتقري من الديسك على chunks.
+    - parents=None => كل الـ Parents الموجودين في شيت father
+    - output_path => لو اتحدد، كل شيت Parent بيتكتب أول ما يخلص (xlsx / csv.zip / parquet.zip)
+    - keep_results=False => ما نحتفظش بجداول الـ Parents في الذاكرة (للتشغيل الليلي الكبير)
+    - explode="all" / "leaves" => تفجير BOM متعدد المستويات قبل التحليل
+    - profile => تسجيل الوقت والذاكرة وعدد السطور لكل مرحلة + أبطأ الـ Parents (شوف bom_profile)
+    - snapshot_dir => وضع الـ snapshot: نتايج الـ Parents اللي مدخلاتها ما اتغيرتش بترجع من آخر snapshot
+      (بنفس explode)، وsnapshot جديد بيتحفظ، وشيت Change_Report بيتكتب لو فيه snapshot قديم.
+      snapshot_info (dict) لو اتبعت بيتملي بـ path / previous / stats / changes / report.
+    بترجع (summary_df, results) حيث results هو الـ store بصيغة long (شوف bom_results)
+    أو None لو keep_results=False.
+    """
+    files = {}
+    in_workbook = workbook_path if file_kind(workbook_path) == "xlsx" else None
+    sources = (
+        _input_source(workbook_path, bom_sheet, files),
+        _input_source(father_path or in_workbook, father_sheet, files),
+        _input_source(mrp_path or in_workbook, mrp_sheet, files),
+    )
+    bom_df, father_df, mrp_df, cols = load_inputs(files, *sources, profile=profile)
+
+    if parents is None:
+        parents = sorted(father_df[cols["parent_col"]].dropna().unique()) if father_df is not None else []
+    context = prepare_analysis(bom_df, father_df, mrp_df, cols, selected_order_types, selected_mrp_controllers,
+                               explode, profile=profile)
+
+    previous = fingerprints = None
+    stats = {}
+    if snapshot_dir:
+        # المقارنة بآخر snapshot بنفس التفجير والفلاتر والشيتات بس (شوف snapshot_key)
+        key = snapshot_key(explode, selected_order_types, selected_mrp_controllers,
+                           [source[1] if source else None for source in sources])
+        with profile_stage(profile, "fingerprints", rows=len(parents)):
+            fingerprints = parent_fingerprints(context, parents)
+        previous_path = latest_snapshot(snapshot_dir, key=key)
+        previous = load_snapshot(previous_path) if previous_path else None
+        results = iter_snapshot_results(context, parents, previous, fingerprints, workers, stats)
+    else:
+        results = iter_parent_results(context, parents, workers)
+
+    writer = ReportWriter(output_path, output_format or format_from_path(output_path)) if output_path else None
+    engine = context["engine"]
+    summary_list, parts = [], []
+    sibling_frames, qty_frames, parents_of = [], [], {}
+    with writer or nullcontext():
+        # التحليل والكتابة بيتعملوا مع بعض (streaming)، فالمرحلة دي بتشمل كتابة شيتات الـ Parents
+        with profile_stage(profile, "per-parent analysis + sheets", rows=len(parents)):
+            for part in track_parents(profile, results):
+                if writer is not None and len(part["components"]):
+                    writer.write_sheet(part["parent"], parent_wide(engine, part))
+                    sibling_frames.append(nearest_siblings(engine, part["parent"], part["child_names"], context["comp_mask"]))
+                    qty_frames.append(part_qty_variance(engine, part))
+                    for child in part["child_names"]:
+                        parents_of.setdefault(child, []).append(part["parent"])
+                if keep_results or snapshot_dir:
+                    parts.append(part)
+                summary_list.append(parent_summary_row(part))
+        with profile_stage(profile, "summary", rows=len(summary_list)):
+            summary_df = pd.DataFrame(summary_list)
+        if writer is not None:
+            with profile_stage(profile, "report sheets (summary + qty variance + similarity)") as record:
+                writer.write_sheet("Summary_Report", summary_df)
+                qty_frames = [f for f in qty_frames if not f.empty]
+                writer.write_sheet("Qty_Variance", rank_qty_variance(pd.concat(qty_frames, ignore_index=True))
+                                   if qty_frames else pd.DataFrame(columns=QTY_VARIANCE_COLUMNS))
+                sibling_frames = [f for f in sibling_frames if not f.empty]
+                writer.write_sheet("Child_Similarity", pd.concat(sibling_frames, ignore_index=True)
+                                   if sibling_frames else pd.DataFrame(columns=SIBLING_COLUMNS))
+                writer.write_sheet("Near_Duplicate_Children",
+                                   near_duplicates(engine, list(parents_of), context["comp_mask"], parents_of))
+                record["rows"] = len(writer.sheet_names)
+        if snapshot_dir:
+            with profile_stage(profile, "snapshot (save + changes)", rows=len(parts)):
+                current = save_snapshot(engine, parts, fingerprints, snapshot_dir, {
+                    "workbook": os.path.basename(workbook_path), "explode": explode,
+                    "order_types": selected_order_types, "mrp_controllers": selected_mrp_controllers,
+                }, key=key)
+                report = change_report(previous, current) if previous is not None else None
+                if writer is not None and report is not None:
+                    writer.write_sheet("Change_Report", report)
+            if snapshot_info is not None:
+                snapshot_info.update(
+                    path=current["path"], previous=previous["path"] if previous is not None else None, stats=stats,
+                    changes=snapshot_changes(previous, current) if previous is not None else None, report=report,
+                )
+    if not keep_results:
+        return summary_df, None
+    with profile_stage(profile, "result store", rows=len(parts)):
+        store = build_result_store(engine, parts, context["comp_mask"])
+    return summary_df, store
+
+
+def _split_list(value):
+    # "A,B , C" => ['A', 'B', 'C'] ، والقيمة الفاضية => None (يعني مفيش فلترة)
+    if not value:
+        return None
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MRP BOM Analysis - batch run بدون واجهة")
+    parser.add_argument("workbook", help="مسار ملف الإكسل (أو ملف CSV / Parquet للـ BOM)")
+    parser.add_argument("-o", "--output", default="MRP_BOM_Report.xlsx", help="مسار تقرير الإخراج")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default=None,
+                        help="صيغة التقرير (الافتراضي: حسب امتداد --output)")
+    parser.add_argument("--bom-sheet", default="Bom")
+    parser.add_argument("--father-sheet", default="father code")
+    parser.add_argument("--mrp-sheet", default="MRP Controller", help='"None" لتجاهل شيت MRP')
+    parser.add_argument("--father-file", help="ملف father منفصل (CSV / Parquet، أو xlsx بـ --father-sheet)")
+    parser.add_argument("--mrp-file", help="ملف MRP منفصل (CSV / Parquet، أو xlsx بـ --mrp-sheet)")
+    parser.add_argument("--parents", help="Parents مفصولين بفاصلة (الافتراضي: الكل)")
+    parser.add_argument("--order-types", help="فلتر Order Type (مفصولين بفاصلة)")
+    parser.add_argument("--mrp-controllers", help="فلتر MRP Controller (مفصولين بفاصلة)")
+    parser.add_argument("--explode", choices=list(EXPLODE_MODES), default=None,
+                        help="تفجير BOM متعدد المستويات: all = كل المستويات، leaves = المواد الخام بس")
+    parser.add_argument("--profile-json", help="كتابة الوقت/الذاكرة لكل مرحلة في ملف JSON")
+    parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_DIR, default=None, metavar="DIR",
+                        help="وضع الـ snapshot: إعادة استخدام الـ Parents اللي ما اتغيرتش من آخر snapshot في DIR "
+                             f"(الافتراضي: {SNAPSHOT_DIR}) + شيت Change_Report")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="عدد الـ processes (الافتراضي: كل الـ cores)")
+    args = parser.parse_args(argv)
+
+    profile = new_profile(workbook=args.workbook, output=args.output) if args.profile_json else None
+    snapshot_info = {}
+    with memory_tracing() if profile is not None else nullcontext():
+        summary_df, _ = run_analysis(
+            args.workbook, args.bom_sheet, args.father_sheet, args.mrp_sheet,
+            parents=_split_list(args.parents),
+            selected_order_types=_split_list(args.order_types),
+            selected_mrp_controllers=_split_list(args.mrp_controllers),
+            output_path=args.output, output_format=args.format, workers=args.workers, keep_results=False,
+            explode=args.explode, profile=profile, snapshot_dir=args.snapshot, snapshot_info=snapshot_info,
+            father_path=args.father_file, mrp_path=args.mrp_file,
+        )
+    print(f"✅ {len(summary_df)} Parents -> {args.output}")
+    if snapshot_info:
+        stats, changes = snapshot_info["stats"], snapshot_info["changes"]
+        print(f"📸 snapshot -> {snapshot_info['path']} "
+              f"({stats['reused']} Parent من الـ snapshot القديم، {stats['recomputed']} اتحللوا)")
+        if changes is not None:
+            print(f"   changed: {len(changes['changed'])}, added: {len(changes['added'])}, "
+                  f"removed: {len(changes['removed'])}, unchanged: {changes['unchanged']}")
+    if profile is not None:
+        with open(args.profile_json, "w", encoding="utf-8") as f:
+            f.write(profile_json(profile))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
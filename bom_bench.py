@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Synthetic workbook generator + stage benchmark suite
+# - توليد ملف إكسل صناعي (Bom / father code / MRP Controller) بأحجام قابلة للتحكم
+# - قياس الوقت وذروة الذاكرة لكل مرحلة: read / normalize / grouping / analysis / summary / export
+# - المقارنة بـ baseline محفوظ والخروج بكود 1 لو أي مرحلة اتأخرت عنه
+#   python bom_bench.py run --scales small medium
+#   python bom_bench.py run --save-baseline
+#   python bom_bench.py generate big.xlsx --parents 2000 --children 25 --components 80
+# ==============================================================================
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from bom_batch import iter_parent_results, prepare_analysis
+from bom_export import export_store, remove_report
+from bom_ingest import detect_father_columns, detect_mrp_columns, normalize_sheet
+from bom_results import build_result_store, low_shared, store_summary, top_deviation
+
+# مكان الـ baseline الافتراضي (جنب الملف)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bom_bench_baseline.json")
+
+# أحجام جاهزة: parents / children لكل Parent / components لكل BOM / نسبة الكميات الموجبة
+# large متظبط على ~840 ألف سطر Bom عشان يفضل تحت حد الشيت في الإكسل (EXCEL_MAX_ROWS)
+SCALES = {
+    "small": {"parents": 50, "children": 8, "components": 30, "qty_density": 0.8},
+    "medium": {"parents": 300, "children": 15, "components": 60, "qty_density": 0.8},
+    "large": {"parents": 1000, "children": 20, "components": 60, "qty_density": 0.8},
+}
+
+# أقصى عدد سطور في شيت إكسل واحد (بالهيدر)
+EXCEL_MAX_ROWS = 1048576
+
+STAGES = ["read", "normalize", "grouping", "analysis", "summary", "export"]
+
+# أسماء الشيتات زي الملف الحقيقي
+SHEETS = ("Bom", "father code", "MRP Controller")
+
+
+def make_workbook(parents=50, children=8, components=30, qty_density=0.8, coverage=0.6,
+                  extra_components=3, controllers=5, order_types=("F", "E", "X"), seed=0):
+    """
+    ملف إكسل صناعي (bytes) بنفس شكل الملف الحقيقي:
+    - Bom: لكل Parent عدد components مكوّن من pool مشترك، ولكل ابن نسبة coverage منهم
+      + extra_components مكونات خاصة بيه. qty_density = نسبة السطور اللي كميتها أكبر من صفر
+    - father code: Parent / Material
+    - MRP Controller: Component / MRP Controller / Order Type / Description
+    """
+    rng = np.random.default_rng(seed)
+    pool = np.array([f"C{j:06d}" for j in range(max(components * 4, 100))], dtype=object)
+    codes, comps = [], []
+    father_parent, father_child = [], []
+    for p in range(parents):
+        parent = f"P{p:06d}"
+        parent_comps = rng.choice(pool, components, replace=False)
+        codes.append(np.full(components, parent, dtype=object))
+        comps.append(parent_comps)
+        for k in range(children):
+            child = f"{parent}-K{k:03d}"
+            father_parent.append(parent)
+            father_child.append(child)
+            used = parent_comps[rng.random(components) < coverage]
+            own = rng.choice(pool, extra_components, replace=False)
+            child_comps = pd.unique(np.concatenate([used, own]))
+            codes.append(np.full(len(child_comps), child, dtype=object))
+            comps.append(child_comps)
+    codes = np.concatenate(codes)
+    comps = np.concatenate(comps)
+    qty = rng.integers(1, 10, len(codes)).astype(float)
+    qty[rng.random(len(codes)) >= qty_density] = 0.0
+
+    bom = pd.DataFrame({"Code": codes, "Component": comps, "Qty": qty,
+                        "Component Description": [f"Desc {c}" for c in comps]})
+    father = pd.DataFrame({"Parent": father_parent, "Material": father_child})
+    mrp = pd.DataFrame({
+        "Component": pool,
+        "MRP Controller": rng.choice([f"M{i:02d}" for i in range(controllers)], len(pool)),
+        "Order Type": rng.choice(list(order_types), len(pool)),
+        "Description": [f"Desc {c}" for c in pool],
+    })
+    if len(bom) >= EXCEL_MAX_ROWS:
+        raise ValueError(f"شيت Bom فيه {len(bom):,} سطر وده أكبر من حد الإكسل ({EXCEL_MAX_ROWS - 1:,}): "
+                         "قلّل parents / children / components")
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        for name, df in zip(SHEETS, (bom, father, mrp)):
+            df.to_excel(writer, sheet_name=name, index=False)
+    return buffer.getvalue()
+
+
+def _stage_functions(data):
+    """
+    المراحل بالترتيب؛ كل مرحلة بتاخد ناتج اللي قبلها (state) وبترجع الناتج بتاعها.
+    """
+    def read(_):
+        return pd.read_excel(BytesIO(data), sheet_name=list(SHEETS))
+
+    def normalize(raw):
+        bom_df, cols = normalize_sheet(raw[SHEETS[0]].copy(), "bom")
+        father_df, father_cols = normalize_sheet(raw[SHEETS[1]].copy(), "father")
+        mrp_df, mrp_cols = normalize_sheet(raw[SHEETS[2]].copy(), "mrp")
+        cols = dict(cols, **(father_cols or detect_father_columns(None)), **(mrp_cols or detect_mrp_columns(None)))
+        return bom_df, father_df, mrp_df, cols
+
+    def grouping(frames):
+        bom_df, father_df, mrp_df, cols = frames
+        parents = sorted(father_df[cols["parent_col"]].dropna().unique())
+        return prepare_analysis(bom_df, father_df, mrp_df, cols), parents
+
+    def analysis(prepared):
+        context, parents = prepared
+        return build_result_store(context["engine"], iter_parent_results(context, parents, workers=1))
+
+    def summary(store):
+        summary_df = store_summary(store)
+        top_deviation(store, 10)
+        low_shared(store)
+        return store, summary_df
+
+    def export(summarized):
+        store, summary_df = summarized
+        remove_report(export_store(store, summary_df, "xlsx"))
+
+    return [("read", read), ("normalize", normalize), ("grouping", grouping),
+            ("analysis", analysis), ("summary", summary), ("export", export)]
+
+
+def run_stages(data, repeat=3, memory=True):
+    """
+    تشغيل المراحل على ملف واحد:
+    - seconds: أقل وقت في repeat مرات (أقل تأثر بالضوضاء)
+    - peak_mb: ذروة الذاكرة المحجوزة جوه المرحلة (tracemalloc) في تشغيل منفصل
+    """
+    results = {stage: {"seconds": float("inf")} for stage in STAGES}
+    for _ in range(repeat):
+        state = None
+        for stage, func in _stage_functions(data):
+            gc.collect()
+            start = time.perf_counter()
+            state = func(state)
+            results[stage]["seconds"] = min(results[stage]["seconds"], time.perf_counter() - start)
+
+    if memory:
+        # tracemalloc بيبطّأ التنفيذ، فبيتقاس في تشغيل لوحده
+        state = None
+        for stage, func in _stage_functions(data):
+            gc.collect()
+            tracemalloc.start()
+            state = func(state)
+            results[stage]["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+    return {stage: {k: round(v, 4) for k, v in values.items()} for stage, values in results.items()}
+
+
+def compare_to_baseline(results, baseline, time_tolerance=0.25, memory_tolerance=0.10,
+                        min_seconds=0.05, min_mb=1.0):
+    """
+    مقارنة النتائج بالـ baseline: بترجع list من الرسائل لكل مرحلة زادت عن المسموح.
+    min_seconds / min_mb: فرق أقل من كده بيتعتبر ضوضاء (للمراحل السريعة والصغيرة جدًا).
+    """
+    failures = []
+    for scale, stages in results.items():
+        for stage, values in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if not base:
+                continue
+            seconds, base_seconds = values["seconds"], base["seconds"]
+            if seconds > base_seconds * (1 + time_tolerance) and seconds - base_seconds > min_seconds:
+                failures.append(f"{scale}/{stage}: {seconds:.3f}s > baseline {base_seconds:.3f}s")
+            if "peak_mb" not in values or "peak_mb" not in base:
+                continue
+            peak, base_peak = values["peak_mb"], base["peak_mb"]
+            if peak > base_peak * (1 + memory_tolerance) and peak - base_peak > min_mb:
+                failures.append(f"{scale}/{stage}: {peak:.1f}MB > baseline {base_peak:.1f}MB")
+    return failures
+
+
+def _print_table(scale, stages):
+    print(f"\n== {scale} ==")
+    print(f"{'stage':<10}{'seconds':>10}{'peak MB':>10}")
+    for stage, values in stages.items():
+        peak = values.get("peak_mb")
+        print(f"{stage:<10}{values['seconds']:>10.3f}{'' if peak is None else f'{peak:.1f}':>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MRP BOM Analysis - benchmark لكل مرحلة")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="قياس المراحل على أحجام جاهزة ومقارنتها بالـ baseline")
+    run.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--no-memory", action="store_true", help="من غير قياس الذاكرة (أسرع)")
+    run.add_argument("--baseline", default=BASELINE_PATH)
+    run.add_argument("--save-baseline", action="store_true", help="حفظ النتايج كـ baseline جديد")
+    run.add_argument("--time-tolerance", type=float, default=0.25, help="الزيادة المسموحة في الوقت (0.25 = 25%%)")
+    run.add_argument("--memory-tolerance", type=float, default=0.10, help="الزيادة المسموحة في الذاكرة")
+    run.add_argument("--json", help="كتابة النتايج في ملف JSON")
+
+    gen = sub.add_parser("generate", help="توليد ملف إكسل صناعي")
+    gen.add_argument("output")
+    gen.add_argument("--parents", type=int, default=50)
+    gen.add_argument("--children", type=int, default=8)
+    gen.add_argument("--components", type=int, default=30)
+    gen.add_argument("--qty-density", type=float, default=0.8)
+    gen.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        try:
+            data = make_workbook(args.parents, args.children, args.components, args.qty_density, seed=args.seed)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        with open(args.output, "wb") as f:
+            f.write(data)
+        print(f"✅ {args.output} ({len(data) / 2 ** 20:.1f} MB)")
+        return 0
+
+    results = {}
+    for scale in args.scales:
+        results[scale] = run_stages(make_workbook(**SCALES[scale]), args.repeat, memory=not args.no_memory)
+        _print_table(scale, results[scale])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\n✅ baseline -> {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\n⚠️ مفيش baseline؛ شغّل بـ --save-baseline الأول")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = compare_to_baseline(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if failures:
+        print("\n❌ regressions:")
+        for failure in failures:
+            print("  " + failure)
+        return 1
+    print("\n✅ no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Shared on-disk result store (SQLite)
+# - نتيجة كل تشغيل (ملف + شيتات + فلاتر) بتتكتب مرة واحدة في SQLite محلي
+#   وأي جلسة تانية بنفس المفتاح بتقرا منها بدل ما تعيد التحليل أو تحتفظ بنسخة في الذاكرة
+# - العرض بيقرا صفحات (sort / filter / limit / offset) من الداتابيز مش جداول كاملة
+# - الفلاتر (Parents / Order Type / MRP) = "view" صغير على التشغيل الكامل: ملخص + أرقام صفوف المكونات بس
+# ==============================================================================
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from bom_ingest import CACHE_DIR
+from bom_qty import QTY_COLUMNS
+from bom_results import SUMMARY_COLUMNS, store_component_view, store_qty_stats, store_summary
+
+# مكان الداتابيز (ممكن يتغير من متغير البيئة BOM_DB_PATH)
+DB_PATH = os.environ.get("BOM_DB_PATH", os.path.join(CACHE_DIR, "results.sqlite"))
+
+# الداتابيزات اللي اتجهزت (WAL + migration + schema) في الـ process ده
+_READY = set()
+_READY_LOCK = threading.Lock()
+
+# عدد التشغيلات الكاملة والـ views اللي بنحتفظ بيها (الأقدم استخدامًا بيتمسح)
+KEEP_RUNS = 20
+KEEP_VIEWS = 200
+# تشغيل اتفتح في آخر ACTIVE_SECONDS = جلسة لسه شغالة عليه، فمش بيتمسح حتى لو العدد زاد
+ACTIVE_SECONDS = 3600
+
+# أعمدة الجداول (الترتيب هو ترتيب العرض)
+COMPONENT_COLUMNS = [
+    "Parent", "Component", "Component Description", "Total_Children", "Num_Children_with_Component",
+    "Usage_%", "Deviation", "MRP_Controller", "Order_Type", *QTY_COLUMNS, "Qty_Outlier_Children",
+]
+# أعمدة بتتحسب وقت القراءة للصفحة بس (مش متخزنة): أسماء الأبناء الشاذين من خلايا المكوّن
+_COMPUTED = {
+    "Qty_Outlier_Children": "(SELECT COALESCE(group_concat(c.\"Child\", ', '), '') FROM cells c"
+                            " WHERE c.run_id = components.run_id AND c.comp_row = components.row_no"
+                            " AND c.qty_outlier = 1)",
+}
+TABLE_COLUMNS = {
+    "summary": SUMMARY_COLUMNS,
+    "components": COMPONENT_COLUMNS,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, settings TEXT, has_qty INTEGER, created REAL, last_access REAL,
+    base TEXT, filtered INTEGER
+);
+CREATE TABLE IF NOT EXISTS summary (
+    run_id TEXT, row_no INTEGER, "Parent_Code" TEXT, "Num_Children" INTEGER, "Total_Components" INTEGER,
+    "Shared_Components" INTEGER, "Shared_Components_%" REAL
+);
+CREATE TABLE IF NOT EXISTS components (
+    run_id TEXT, row_no INTEGER, "Parent" TEXT, "Component" TEXT, "Component Description",
+    "Total_Children" INTEGER, "Num_Children_with_Component" INTEGER, "Usage_%" REAL, "Deviation" INTEGER,
+    "MRP_Controller", "Order_Type", "Qty_Min" REAL, "Qty_Max" REAL, "Qty_Mean" REAL, "Qty_Std" REAL,
+    "Qty_CV" REAL, "Qty_Distinct" INTEGER, "Qty_Outliers" INTEGER
+);
+CREATE TABLE IF NOT EXISTS children (
+    run_id TEXT, "Parent" TEXT, child_pos INTEGER, "Child" TEXT
+);
+CREATE TABLE IF NOT EXISTS cells (
+    run_id TEXT, comp_row INTEGER, "Child" TEXT, qty REAL, qty_outlier INTEGER
+);
+CREATE TABLE IF NOT EXISTS view_rows (
+    view_id TEXT, pos INTEGER, comp_row INTEGER
+);
+CREATE INDEX IF NOT EXISTS summary_run ON summary (run_id, row_no);
+CREATE INDEX IF NOT EXISTS components_parent ON components (run_id, "Parent", "Deviation");
+CREATE INDEX IF NOT EXISTS components_deviation ON components (run_id, "Deviation");
+CREATE INDEX IF NOT EXISTS components_usage ON components (run_id, "Usage_%");
+CREATE INDEX IF NOT EXISTS components_qty_cv ON components (run_id, "Qty_CV");
+CREATE INDEX IF NOT EXISTS children_parent ON children (run_id, "Parent", child_pos);
+CREATE INDEX IF NOT EXISTS cells_comp ON cells (run_id, comp_row);
+CREATE INDEX IF NOT EXISTS view_rows_comp ON view_rows (view_id, comp_row);
+CREATE INDEX IF NOT EXISTS runs_base ON runs (base);
+"""
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _expr(name):
+    # عمود متخزن أو subquery للأعمدة المحسوبة
+    return _COMPUTED.get(name, _quote(name))
+
+
+def connect(db_path=None):
+    """
+    اتصال بالداتابيز. أول اتصال لكل مسار في الـ process بيجهزها (بيعملها لو مش موجودة،
+    WAL عشان القراءة من جلسات كتير مع كتابة واحدة، ومسح الكاش القديم + الجداول)؛ بعد كده اتصال بس.
+    """
+    db_path = os.path.abspath(db_path or DB_PATH)
+    if db_path not in _READY:
+        with _READY_LOCK:
+            if db_path not in _READY:
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+                with closing(sqlite3.connect(db_path, timeout=60)) as conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    _drop_outdated(conn)
+                    conn.executescript(_SCHEMA)
+                _READY.add(db_path)
+    return sqlite3.connect(db_path, timeout=60)
+
+
+def _drop_outdated(conn):
+    # داتابيز من نسخة أقدم (أعمدة components / cells / runs مختلفة) = كاش قديم، بيتمسح ويتعمل من جديد
+    existing = [row[1] for row in conn.execute("PRAGMA table_info(components)")]
+    cells = [row[1] for row in conn.execute("PRAGMA table_info(cells)")]
+    runs = [row[1] for row in conn.execute("PRAGMA table_info(runs)")]
+    stored = ["run_id", "row_no", *(c for c in COMPONENT_COLUMNS if c not in _COMPUTED)]
+    if (existing and existing != stored) or (cells and "qty_outlier" not in cells) or (runs and "filtered" not in runs):
+        conn.executescript("DROP TABLE IF EXISTS runs; DROP TABLE IF EXISTS summary; DROP TABLE IF EXISTS components;"
+                           " DROP TABLE IF EXISTS children; DROP TABLE IF EXISTS cells; DROP TABLE IF EXISTS view_rows;")
+
+
+def run_key(*parts):
+    """
+    مفتاح التشغيل: hash للملف + الشيتات + طريقة التفجير + الفلاتر.
+    """
+    return hashlib.sha1(json.dumps(parts, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def has_run(run_id, db_path=None):
+    with closing(connect(db_path)) as conn:
+        return conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is not None
+
+
+def touch_run(run_id, db_path=None):
+    """
+    تسجيل إن التشغيل (والتشغيل الكامل اللي تحته لو ده view) لسه مستخدم دلوقتي، عشان prune_runs ما يمسحوش.
+    بترجع False لو التشغيل مش موجود (اتمسح) => لازم يتكتب تاني.
+    """
+    now = time.time()
+    with closing(connect(db_path)) as conn, conn:
+        row = conn.execute("SELECT base FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute("UPDATE runs SET last_access = ? WHERE run_id IN (?, ?)", (now, run_id, row[0] or run_id))
+    return True
+
+
+def _records(df):
+    # NaN => NULL، والأرقام => أنواع Python عشان sqlite3
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def save_run(run_id, store, settings=None, db_path=None, keep=KEEP_RUNS):
+    """
+    كتابة نتيجة تشغيل كامل (store) مرة واحدة:
+    summary + components (سطر لكل Parent x Component + إحصائيات الكمية) + children
+    + cells (الكميات الموجودة بس + علامة الشاذ؛ أسماء الشواذ بتتجمع وقت قراءة الصفحة).
+    سطر runs بيتكتب في نفس الـ transaction، فأي جلسة بتشوف التشغيل كامل أو مش بتشوفه خالص.
+    لو التشغيل موجود قبل كده (جلسة تانية كتبته) مفيش حاجة بتتكتب.
+    الفلاتر بعد كده بتتكتب views صغيرة عليه (save_view).
+    """
+    summary = store_summary(store)
+    components = store_component_view(store, qty=True)
+    stored = [c for c in COMPONENT_COLUMNS if c not in _COMPUTED]
+    _, cell_outlier = store_qty_stats(store)
+    child_codes = store["children"]["child"].to_numpy()
+    child_parents = store["names"][store["children"]["parent"].to_numpy()]
+    cells = store["cells"]
+
+    # مكان كل ابن جوه الـ Parent بتاعه (بالترتيب)
+    child_pos = np.zeros(len(child_codes), dtype=np.int64)
+    for c0, c1, k0, k1, x0, x1 in store["index"].values():
+        child_pos[k0:k1] = np.arange(k1 - k0)
+
+    with closing(connect(db_path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+            conn.rollback()
+            return False
+        conn.executemany(
+            "INSERT INTO summary VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((run_id, i) + row for i, row in enumerate(_records(summary[SUMMARY_COLUMNS]))),
+        )
+        conn.executemany(
+            f"INSERT INTO components VALUES ({', '.join('?' * (len(stored) + 2))})",
+            ((run_id, i) + row for i, row in enumerate(_records(components[stored]))),
+        )
+        conn.executemany(
+            "INSERT INTO children VALUES (?, ?, ?, ?)",
+            zip([run_id] * len(child_codes), child_parents.tolist(), child_pos.tolist(),
+                store["names"][child_codes].tolist()),
+        )
+        conn.executemany(
+            "INSERT INTO cells VALUES (?, ?, ?, ?, ?)",
+            zip([run_id] * len(cells), cells["comp_row"].tolist(),
+                store["names"][child_codes[cells["child_row"].to_numpy()]].tolist(),
+                cells["qty"].astype(np.float64).tolist(), cell_outlier.astype(np.int64).tolist()),
+        )
+        now = time.time()
+        conn.execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?, ?, NULL, 0)",
+            (run_id, json.dumps(settings or {}, default=str, ensure_ascii=False),
+             int(store["engine"]["has_qty"]), now, now),
+        )
+        conn.commit()
+        prune_runs(conn, keep)
+    return True
+
+
+def save_view(run_id, base_id, store, settings=None, db_path=None, keep=KEEP_VIEWS):
+    """
+    كتابة نتيجة الفلاتر كـ view على تشغيل كامل محفوظ (base_id): الملخص بعد الفلاتر
+    + أرقام صفوف المكونات اللي عدّت الفلاتر في base بالترتيب (view_rows)، من غير نسخ المكونات والخلايا.
+    store = filter_store على نفس الـ store اللي اتكتب في base (فيه source_rows).
+    Usage_% و Deviation وإحصائيات الكمية لكل مكوّن مش بتتأثر بالفلاتر، فبتتقري من base زي ما هي.
+    لو base مش موجود (اتمسح) بترجع False ومفيش حاجة بتتكتب.
+    """
+    summary = store_summary(store)
+    rows = store["source_rows"]
+    with closing(connect(db_path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        base = conn.execute("SELECT has_qty FROM runs WHERE run_id = ? AND base IS NULL", (base_id,)).fetchone()
+        if base is None or conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+            conn.rollback()
+            return False
+        # من غير فلترة فعلية (كل صفوف base بنفس الترتيب) مفيش view_rows خالص
+        base_rows = conn.execute("SELECT COUNT(*) FROM components WHERE run_id = ?", (base_id,)).fetchone()[0]
+        filtered = not (len(rows) == base_rows and np.array_equal(rows, np.arange(base_rows)))
+        conn.executemany(
+            "INSERT INTO summary VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((run_id, i) + row for i, row in enumerate(_records(summary[SUMMARY_COLUMNS]))),
+        )
+        if filtered:
+            conn.executemany("INSERT INTO view_rows VALUES (?, ?, ?)",
+                             zip([run_id] * len(rows), range(len(rows)), rows.tolist()))
+        now = time.time()
+        conn.execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, json.dumps(settings or {}, default=str, ensure_ascii=False), base[0], now, now,
+             base_id, int(filtered)),
+        )
+        conn.commit()
+        prune_runs(conn, keep_views=keep)
+    return True
+
+
+def prune_runs(conn, keep=KEEP_RUNS, keep_views=KEEP_VIEWS):
+    """
+    مسح التشغيلات الكاملة الأقدم استخدامًا (last_access) لو عددها زاد عن keep، والـ views لو زادت عن keep_views.
+    أي تشغيل اتفتح في آخر ACTIVE_SECONDS (جلسة لسه بتعرضه، شوف touch_run) مش بيتمسح،
+    والـ views اللي التشغيل الكامل بتاعها اتمسح بتتمسح معاه.
+    """
+    active = time.time() - ACTIVE_SECONDS
+    query = ("SELECT run_id FROM (SELECT run_id, last_access FROM runs WHERE base IS {} NULL"
+             " ORDER BY last_access DESC LIMIT -1 OFFSET ?) WHERE last_access < ?")
+    old = [r[0] for r in conn.execute(query.format(""), (keep, active))]
+    with conn:
+        for table in ("summary", "components", "children", "cells", "runs"):
+            conn.executemany(f"DELETE FROM {table} WHERE run_id = ?", [(r,) for r in old])
+    old_views = {r[0] for r in conn.execute(query.format("NOT"), (keep_views, active))}
+    old_views.update(r[0] for r in conn.execute(
+        "SELECT run_id FROM runs WHERE base IS NOT NULL AND base NOT IN (SELECT run_id FROM runs WHERE base IS NULL)"
+    ))
+    with conn:
+        conn.executemany("DELETE FROM view_rows WHERE view_id = ?", [(r,) for r in old_views])
+        for table in ("summary", "runs"):
+            conn.executemany(f"DELETE FROM {table} WHERE run_id = ?", [(r,) for r in old_views])
+
+
+def _source(conn, run_id):
+    # المكونات / الأبناء / الخلايا بتاعة view بتتقري من التشغيل الكامل (base)؛
+    # بترجع (run_id بتاع base، هل فيه view_rows)
+    row = conn.execute("SELECT base, filtered FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+    if row is None or row[0] is None:
+        return run_id, False
+    return row[0], bool(row[1])
+
+
+def _where(run_id, table, filters=None, search=None):
+    # filters: {عمود: قيمة} أو {عمود: (op, قيمة)} ، search: (عمود، نص) => LIKE
+    columns = TABLE_COLUMNS[table]
+    clauses, params = ["run_id = ?"], [run_id]
+    for col, cond in (filters or {}).items():
+        if col not in columns:
+            raise ValueError(f"عمود غير معروف: {col}")
+        op, value = cond if isinstance(cond, tuple) else ("=", cond)
+        if op not in ("=", "<", "<=", ">", ">=", "!="):
+            raise ValueError(f"عملية غير معروفة: {op}")
+        clauses.append(f"{_expr(col)} {op} ?")
+        params.append(value)
+    if search and search[1]:
+        if search[0] not in columns:
+            raise ValueError(f"عمود غير معروف: {search[0]}")
+        clauses.append(f"{_expr(search[0])} LIKE ?")
+        params.append(f"%{search[1]}%")
+    return " AND ".join(clauses), params
+
+
+def query_page(run_id, table, sort_by=None, ascending=True, filters=None, search=None,
+               limit=50, offset=0, db_path=None):
+    """
+    صفحة واحدة من جدول (summary / components) بعد الفلترة والترتيب في الداتابيز.
+    sort_by: عمود أو list أعمدة (بنفس ascending لكلهم أو list بنفس الطول).
+    الترتيب بيكمّل بترتيب الصفوف عشان النتيجة ثابتة (زي stable sort).
+    لو run_id = view، المكونات بتتقري من التشغيل الكامل (row_no = رقم الصف هناك) بصفوف الـ view بس.
+    بترجع (df, إجمالي عدد السطور المطابقة).
+    """
+    columns = TABLE_COLUMNS[table]
+    with closing(connect(db_path)) as conn:
+        source, filtered = _source(conn, run_id) if table == "components" else (run_id, False)
+        where, params = _where(source, table, filters, search)
+        tiebreak = "row_no"
+        if filtered:
+            # صفوف الـ view بس وبترتيبها (زي filter_store)
+            table = "components JOIN view_rows v ON v.view_id = ? AND v.comp_row = components.row_no"
+            params = [run_id] + params
+            tiebreak = "v.pos"
+        order = tiebreak
+        if sort_by:
+            sort_cols = [sort_by] if isinstance(sort_by, str) else list(sort_by)
+            directions = ascending if isinstance(ascending, (list, tuple)) else [ascending] * len(sort_cols)
+            for col in sort_cols:
+                if col not in columns:
+                    raise ValueError(f"عمود غير معروف: {col}")
+            order = ", ".join(f"{_expr(col)} {'ASC' if asc else 'DESC'}" for col, asc in zip(sort_cols, directions))
+            order += ", " + tiebreak
+        select = ", ".join(["row_no"] + [f"{_expr(c)} AS {_quote(c)}" if c in _COMPUTED else _quote(c)
+                                         for c in columns])
+        total = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+        df = pd.read_sql_query(
+            f"SELECT {select} FROM {table} WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+            conn, params=params + [int(limit), int(offset)],
+        )
+    return df, total
+
+
+def summary_totals(run_id, db_path=None):
+    """
+    مؤشرات الملخص من الداتابيز مباشرة: العدد + مجموع الأعمدة الرقمية + متوسط النسب.
+    """
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(
+            'SELECT COUNT(*), SUM("Num_Children"), SUM("Total_Components"), SUM("Shared_Components"), '
+            'AVG("Shared_Components_%") FROM summary WHERE run_id = ?', (run_id,)
+        ).fetchone()
+    return {
+        "Parents": row[0],
+        "Num_Children": row[1] or 0,
+        "Total_Components": row[2] or 0,
+        "Shared_Components": row[3] or 0,
+        "Shared_Components_%": row[4] or 0.0,
+    }
+
+
+def run_parents(run_id, db_path=None):
+    """
+    الـ Parents اللي ليهم مكونات في التشغيل ده (بالترتيب).
+    """
+    with closing(connect(db_path)) as conn:
+        source, filtered = _source(conn, run_id)
+        if filtered:
+            rows = conn.execute(
+                'SELECT "Parent" FROM components JOIN view_rows v ON v.view_id = ? AND v.comp_row = components.row_no'
+                ' WHERE run_id = ? GROUP BY "Parent" ORDER BY MIN(v.pos)', (run_id, source)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT "Parent" FROM components WHERE run_id = ? GROUP BY "Parent" ORDER BY MIN(row_no)', (source,)
+            ).fetchall()
+    return [r[0] for r in rows]
+
+
+def parent_page(run_id, parent, sort_by="Deviation", ascending=False, limit=10, offset=0, db_path=None):
+    """
+    صفحة من جدول الـ Parent العريض (عمود لكل ابن) من الداتابيز:
+    المكونات بتتقري صفحة واحدة، وخلايا الكميات للمكونات دي بس.
+    """
+    page, total = query_page(run_id, "components", sort_by, ascending, {"Parent": parent},
+                             limit=limit, offset=offset, db_path=db_path)
+    with closing(connect(db_path)) as conn:
+        has_qty = conn.execute("SELECT has_qty FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        run_id, _ = _source(conn, run_id)
+        children = [r[0] for r in conn.execute(
+            'SELECT "Child" FROM children WHERE run_id = ? AND "Parent" = ? ORDER BY child_pos', (run_id, parent)
+        )]
+        rows = page["row_no"].tolist()
+        cells = pd.read_sql_query(
+            f"SELECT comp_row, \"Child\", qty FROM cells WHERE run_id = ? AND comp_row IN ({','.join('?' * len(rows))})",
+            conn, params=[run_id] + rows,
+        ) if rows else pd.DataFrame(columns=["comp_row", "Child", "qty"])
+
+    wide = page.drop(columns=["Parent"]).set_index("row_no")
+    qty = cells.pivot_table(index="comp_row", columns="Child", values="qty", aggfunc="last")
+    qty = qty.reindex(index=wide.index, columns=children).fillna(0)
+    if has_qty is not None and not has_qty[0]:
+        qty = qty.astype(np.int64)
+    return pd.concat([wide, qty], axis=1).reset_index(drop=True), total
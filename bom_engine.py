@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Vectorized analysis engine (sparse child x component matrix)
+# - كل المواد (Parents / Children / Components) بتتحول لأكواد أرقام
+# - الـ BOM بيتخزن كمصفوفة sparse: صف = مادة ليها BOM، عمود = مكوّن، القيمة = الكمية
+# - تحليل كل Parent = slicing للمصفوفة + reductions بدل الـ loops المتداخلة
+# ==============================================================================
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# طرق تفجير الـ BOM: كل المستويات / المواد الخام بس
+EXPLODE_MODES = ("all", "leaves")
+
+
+def build_mrp_dict(mrp_df, mrp_component_col):
+    """
+    ارجع dict للمكونات الموجودة في MRP Control لتسهيل الlookup.
+    """
+    if mrp_df is None or mrp_component_col is None:
+        return {}
+    return mrp_df.drop_duplicates(subset=[mrp_component_col]).set_index(mrp_component_col).to_dict(orient='index')
+
+
+def build_desc_lookup(bom_df, mrp_df, mrp_component_col, desc_col_bom, desc_col_mrp, component_col):
+    """
+    بناء قاموس وصف لكل مكوّن (يستخدم MRP أولاً ثم BOM لتعويض الفجوات).
+    """
+    desc_lookup = {}
+    if mrp_df is not None and mrp_component_col and desc_col_mrp:
+        desc_lookup.update(
+            mrp_df.dropna(subset=[mrp_component_col]).drop_duplicates(subset=[mrp_component_col])
+            .set_index(mrp_component_col)[desc_col_mrp]
+            .to_dict()
+        )
+    if desc_col_bom:
+        bom_desc_map = (
+            bom_df.dropna(subset=[component_col, desc_col_bom])
+            .drop_duplicates(subset=[component_col])
+            .set_index(component_col)[desc_col_bom]
+            .to_dict()
+        )
+        for k, v in bom_desc_map.items():
+            if k not in desc_lookup and pd.notna(v):
+                desc_lookup[k] = v
+    return desc_lookup
+
+
+def build_engine(bom_df, code_col, component_col, qty_col=None,
+                 father_df=None, child_col=None,
+                 mrp_dict=None, desc_lookup=None,
+                 mrp_controller_col=None, mrp_order_type_col=None):
+    """
+    تجهيز المحرك مرة واحدة لكل تحليل:
+    - materials: pd.Index بكل المواد (الكود الرقمي للمادة = مكانها في الـ Index)
+    - matrix: مصفوفة CSR (مادة x مكوّن) فيها الكمية (أو 1 لو مفيش عمود كمية)
+    - order_ptr / order_idx: ترتيب مكونات كل مادة حسب أول ظهور في الـ BOM
+      (نفس ترتيب dict/groupby في الكود الأصلي)
+    - desc / controller / order_type: بيانات كل مادة كمصفوفات جاهزة للـ fancy indexing
+    """
+    mrp_dict = mrp_dict or {}
+    desc_lookup = desc_lookup or {}
+
+    bom = bom_df.dropna(subset=[code_col, component_col])
+    father_children = (
+        father_df[child_col].dropna().astype(str)
+        if father_df is not None and child_col else pd.Series([], dtype=object)
+    )
+    materials = pd.Index(pd.unique(pd.concat([
+        bom[code_col].astype(str), bom[component_col].astype(str), father_children
+    ], ignore_index=True)))
+    n = len(materials)
+
+    rows = materials.get_indexer(bom[code_col].astype(str))
+    cols = materials.get_indexer(bom[component_col].astype(str))
+
+    # قيمة كل خلية: آخر كمية للمكوّن داخل نفس الكود (زي dict(zip(...)) الأصلي)
+    if qty_col:
+        values = pd.to_numeric(bom[qty_col], errors="coerce").to_numpy()
+    else:
+        values = np.ones(len(bom), dtype=np.int64)
+    cells = pd.DataFrame({"r": rows, "c": cols, "v": values})
+    last = cells.drop_duplicates(subset=["r", "c"], keep="last")
+    matrix = sparse.csr_matrix(
+        (last["v"].to_numpy(), (last["r"].to_numpy(), last["c"].to_numpy())), shape=(n, n)
+    )
+
+    # ترتيب المكونات لكل كود حسب أول ظهور (stable sort بالحفاظ على ترتيب الصفوف)
+    first = cells.drop_duplicates(subset=["r", "c"], keep="first")
+    order = np.argsort(first["r"].to_numpy(), kind="stable")
+    order_idx = first["c"].to_numpy()[order]
+    order_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(order_ptr, first["r"].to_numpy() + 1, 1)
+    order_ptr = np.cumsum(order_ptr)
+
+    # بيانات المكوّن (وصف + MRP) لكل مادة مرة واحدة
+    desc = np.empty(n, dtype=object)
+    controller = np.empty(n, dtype=object)
+    order_type = np.empty(n, dtype=object)
+    for i, m in enumerate(materials):
+        mrp_info = mrp_dict.get(m, {})
+        desc[i] = desc_lookup.get(m, "")
+        controller[i] = mrp_info.get(mrp_controller_col)
+        order_type[i] = mrp_info.get(mrp_order_type_col)
+
+    return {
+        "materials": materials,
+        "matrix": matrix,
+        "has_qty": bool(qty_col),
+        "order_ptr": order_ptr,
+        "order_idx": order_idx,
+        "desc": desc,
+        "controller": controller,
+        "order_type": order_type,
+    }
+
+
+def component_mask(engine, selected_order_types=None, selected_mrp_controllers=None):
+    """
+    ماسك منطقي لكل مادة: هل تعدّي فلاتر Order Type + MRP Controller؟
+    القائمة الفاضية = مفيش فلترة للحقل ده (نفس سلوك الكود الأصلي).
+    """
+    mask = np.ones(len(engine["materials"]), dtype=bool)
+    if selected_order_types:
+        allowed = set(selected_order_types)
+        mask &= np.fromiter((str(v) in allowed for v in engine["order_type"]), dtype=bool, count=len(mask))
+    if selected_mrp_controllers:
+        allowed = set(selected_mrp_controllers)
+        mask &= np.fromiter((str(v) in allowed for v in engine["controller"]), dtype=bool, count=len(mask))
+    return mask
+
+
+def parent_components(engine, parent):
+    """
+    الأكواد الرقمية لمكونات الـ Parent بترتيب أول ظهور (مصفوفة فاضية لو مالوش BOM).
+    """
+    pos = engine["materials"].get_indexer([parent])[0]
+    if pos < 0:
+        return np.empty(0, dtype=np.int64)
+    return engine["order_idx"][engine["order_ptr"][pos]:engine["order_ptr"][pos + 1]]
+
+
+def bom_levels(engine):
+    """
+    ترتيب طوبولوجي للـ BOM كـ DAG (مادة -> مكوناتها):
+    level لكل مادة = أطول مسار لحد مادة خام (المادة اللي مالهاش BOM = 0).
+    بيتحسب مستوى بمستوى من تحت لفوق؛ ولو فيه دورة (مادة داخلة في نفسها) بنرمي ValueError
+    فيها المواد اللي عاملة الدورة.
+    """
+    matrix = engine["matrix"]
+    n = matrix.shape[0]
+    by_component = matrix.tocsc()
+    remaining = np.diff(matrix.indptr)
+    level = np.full(n, -1, dtype=np.int64)
+    frontier = np.flatnonzero(remaining == 0)
+    h = 0
+    while len(frontier):
+        level[frontier] = h
+        # كل مادة بتستخدم مكوّن من المستوى ده: مكوّن ناقص تاني من اللي مستنياهم
+        users = by_component[:, frontier].indices
+        remaining = remaining - np.bincount(users, minlength=n)
+        frontier = np.flatnonzero((remaining == 0) & (level < 0))
+        h += 1
+
+    unresolved = level < 0
+    if unresolved.any():
+        cycle = _find_cycle(matrix, unresolved)
+        path = " -> ".join(str(engine["materials"][i]) for i in cycle)
+        raise ValueError(f"في دورة في الـ BOM (مادة داخلة في نفسها): {path}")
+    return level
+
+
+def _find_cycle(matrix, unresolved):
+    # أي مادة مش متحلة ليها مكوّن مش متحل => نمشي وراهم لحد ما نرجع لمادة شفناها
+    seen, path = {}, []
+    node = int(np.flatnonzero(unresolved)[0])
+    while node not in seen:
+        seen[node] = len(path)
+        path.append(node)
+        succ = matrix.indices[matrix.indptr[node]:matrix.indptr[node + 1]]
+        node = int(succ[unresolved[succ]][0])
+    return path[seen[node]:] + [node]
+
+
+def explode_engine(engine, mode="all"):
+    """
+    تفجير الـ BOM لكل المستويات (multi-level explosion) ورجوع محرك بنفس الشكل:
+    - matrix: لكل مادة كل المكونات تحتها في أي مستوى، والكمية = مجموع (حاصل ضرب الكميات على كل مسار)
+    - order_ptr / order_idx: المكونات المباشرة بترتيبها وبعدها مكونات كل تجميعة فرعية
+    - mode="leaves": المواد الخام بس (اللي مالهاش BOM) بدل كل المستويات
+    كل تجميعة فرعية بتتفجر مرة واحدة بس (بالترتيب الطوبولوجي من تحت لفوق) ونتيجتها
+    بتتستخدم في كل الـ Parents اللي تحتهم، فالتكلفة مش بتكبر مع تكرار التجميعة.
+    """
+    if mode not in EXPLODE_MODES:
+        raise ValueError(f"طريقة تفجير غير معروفة: {mode}")
+    matrix = engine["matrix"]
+    n = matrix.shape[0]
+    level = bom_levels(engine)
+    ptr, idx = engine["order_ptr"], engine["order_idx"]
+
+    exploded = sparse.csr_matrix(matrix.shape, dtype=matrix.dtype)
+    orders = [idx[ptr[i]:ptr[i + 1]] for i in range(n)]
+    for h in range(1, int(level.max(initial=0)) + 1):
+        rows = np.flatnonzero(level == h)
+        # مكونات المستوى ده كلها من مستويات أقل، فتفجيرها جاهز في exploded
+        direct = matrix[rows]
+        block = (direct + direct @ exploded).tocoo()
+        exploded = exploded + sparse.csr_matrix(
+            (block.data, (rows[block.row], block.col)), shape=matrix.shape
+        )
+        for r in rows:
+            subs = [orders[c] for c in orders[r] if level[c] > 0]
+            if subs:
+                orders[r] = pd.unique(np.concatenate([orders[r]] + subs))
+
+    if mode == "leaves":
+        leaf = level == 0
+        coo = exploded.tocoo()
+        keep = leaf[coo.col]
+        exploded = sparse.csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=matrix.shape)
+        orders = [o[leaf[o]] for o in orders]
+
+    order_ptr = np.zeros(n + 1, dtype=np.int64)
+    order_ptr[1:] = np.cumsum([len(o) for o in orders])
+    order_idx = np.concatenate(orders).astype(np.int64) if n else np.empty(0, dtype=np.int64)
+    return dict(engine, matrix=exploded, order_ptr=order_ptr, order_idx=order_idx, levels=level, explode=mode)
+
+
+def analyze_parent_long(engine, parent, children, comp_mask=None):
+    """
+    تحليل Parent واحد بعمليات على المصفوفة، والنتيجة بصيغة long (من غير جدول عريض):
+    - components: أكواد مكونات الـ Parent بعد الفلترة (بترتيب أول ظهور)
+    - counts / usage: Num_Children_with_Component و Usage_% لكل مكوّن
+    - cell_child / cell_comp / cell_qty: الخلايا الموجودة فعلًا في الـ BOM بس
+      (مكان الابن ومكان المكوّن جوه الـ Parent + الكمية)
+    """
+    comps = parent_components(engine, parent)
+    if comp_mask is not None:
+        comps = comps[comp_mask[comps]]
+
+    children = [str(c) for c in children]
+    total_children = len(children)
+    child_ids = engine["materials"].get_indexer(children)
+
+    # الخلايا الموجودة في المصفوفة (ابن x مكوّن) للـ Parent ده بس (ابن مالوش BOM = مفيش خلايا)
+    known = np.flatnonzero(child_ids >= 0)
+    if len(comps) and len(known):
+        block = engine["matrix"][child_ids[known]][:, comps].tocoo()
+        cell_child, cell_comp, cell_qty = known[block.row], block.col, block.data
+    else:
+        cell_child = cell_comp = np.empty(0, dtype=np.int64)
+        cell_qty = np.empty(0, dtype=engine["matrix"].dtype)
+    counts = np.bincount(cell_comp[cell_qty > 0], minlength=len(comps)).astype(np.int64)
+
+    if total_children > 0:
+        usage = [round(c / total_children * 100, 2) for c in counts.tolist()]
+    else:
+        usage = [0.0] * len(comps)
+
+    return {
+        "parent": parent,
+        "child_names": children,
+        "children": child_ids,
+        "components": comps,
+        "counts": counts,
+        "usage": np.asarray(usage, dtype=np.float64),
+        "cell_child": cell_child,
+        "cell_comp": cell_comp,
+        "cell_qty": cell_qty,
+    }
+
+
+def parent_wide(engine, part):
+    """
+    بناء جدول الـ Parent العريض (عمود لكل ابن) من نتيجة analyze_parent_long.
+    بيرجع DataFrame بنفس أعمدة وترتيب وأنواع parent_df في الكود الأصلي (أو DataFrame فاضي).
+    """
+    comps = part["components"]
+    if len(comps) == 0:
+        return pd.DataFrame()
+    children = part["child_names"]
+    total_children = len(children)
+    counts = part["counts"]
+
+    parent_df = pd.DataFrame({
+        "Component": engine["materials"][comps].tolist(),
+        "Component Description": engine["desc"][comps].tolist(),
+        "Total_Children": [total_children] * len(comps),
+        "Num_Children_with_Component": counts.tolist(),
+        "Usage_%": part["usage"].tolist(),
+        "Deviation": np.abs(counts - total_children).tolist(),
+        "MRP_Controller": engine["controller"][comps].tolist(),
+        "Order_Type": engine["order_type"][comps].tolist(),
+    })
+    if total_children:
+        dtype = engine["matrix"].dtype if engine["has_qty"] else np.int64
+        sub = np.zeros((total_children, len(comps)), dtype=dtype)
+        sub[part["cell_child"], part["cell_comp"]] = part["cell_qty"]
+        present = np.zeros(total_children, dtype=bool)
+        present[part["cell_child"]] = True
+        # ابن مفيهوش أي مكوّن من دول = كله 0 (int) زي القيمة الافتراضية في الكود الأصلي
+        child_block = pd.DataFrame({
+            child: sub[i] if present[i] else sub[i].astype(np.int64)
+            for i, child in enumerate(children)
+        })
+        parent_df = pd.concat([parent_df, child_block], axis=1)
+    return parent_df
+
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Streaming report export (constant memory)
+# - كل شيت بيتكتب أول ما يخلص حسابه، ومفيش تقرير كامل في الذاكرة
+# - Excel: xlsxwriter في وضع constant_memory (صف بصف) على ملف مؤقت في الديسك
+#   (في مجلد تقارير محدود العدد، فملفات الجلسات اللي خلصت ما بتتراكمش)
+# - بديل للي مش محتاج Excel: zip فيه CSV أو Parquet لكل شيت
+# ==============================================================================
+import io
+import os
+import re
+import tempfile
+import zipfile
+
+from bom_ingest import CACHE_DIR
+from bom_results import store_parent_wide, store_parents, top_qty_variance
+from bom_similarity import store_near_duplicates, store_nearest_siblings
+
+# الصيغ المتاحة: الامتداد + نوع الـ MIME للتحميل
+EXPORT_FORMATS = {
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv.zip": (".csv.zip", "application/zip"),
+    "parquet.zip": (".parquet.zip", "application/zip"),
+}
+
+# مكان ملفات التقارير المؤقتة (ممكن يتغير من متغير البيئة BOM_REPORT_DIR)
+REPORT_DIR = os.environ.get("BOM_REPORT_DIR", os.path.join(CACHE_DIR, "reports"))
+# عدد التقارير اللي بنحتفظ بيها في REPORT_DIR (الأقدم بيتمسح مع كل تقرير جديد)
+KEEP_REPORTS = 16
+
+# حروف ممنوعة في أسماء شيتات Excel (ومش مريحة في أسماء الملفات برضه)
+_INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+def unique_sheet_name(name, used):
+    """
+    اسم شيت صالح (31 حرف بحد أقصى) ومش متكرر:
+    لو الاسم المقصوص اتاخد قبل كده بنضيف ~2, ~3 ... مع الحفاظ على الطول.
+    used: set بالأسماء المستخدمة (المقارنة case-insensitive زي Excel)، وبتتحدّث هنا.
+    """
+    base = _INVALID_SHEET_CHARS.sub("_", str(name)).strip("'") or "Sheet"
+    candidate = base[:31]
+    n = 1
+    while candidate.lower() in used:
+        n += 1
+        suffix = f"~{n}"
+        candidate = base[:31 - len(suffix)] + suffix
+    used.add(candidate.lower())
+    return candidate
+
+
+def _excel_rows(df):
+    # القيم الفاضية => None (خلية فاضية)، والأرقام => أنواع Python عشان xlsxwriter
+    values = df.astype(object).where(df.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+class ReportWriter:
+    """
+    كاتب تقرير بيكتب شيت بشيت (مش بيحتفظ بأي DataFrame بعد كتابته).
+
+    with ReportWriter(fmt="xlsx") as writer:
+        writer.write_sheet(parent, parent_df)
+        ...
+    path = writer.path   # ملف مؤقت في REPORT_DIR لو ما اتحددش path
+    """
+
+    def __init__(self, path=None, fmt="xlsx"):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"صيغة تصدير غير معروفة: {fmt}")
+        self.fmt = fmt
+        if path is None:
+            os.makedirs(REPORT_DIR, exist_ok=True)
+            prune_reports(keep=KEEP_REPORTS - 1)
+            fd, path = tempfile.mkstemp(prefix="mrp_bom_report_", suffix=EXPORT_FORMATS[fmt][0], dir=REPORT_DIR)
+            os.close(fd)
+        self.path = path
+        self.sheet_names = []
+        self._used = set()
+        if fmt == "xlsx":
+            import xlsxwriter
+            self._book = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True})
+            self._header_format = self._book.add_format({"bold": True})
+        else:
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write_sheet(self, name, df):
+        """
+        كتابة DataFrame كشيت واحد؛ بترجع اسم الشيت الفعلي بعد القص وإزالة التكرار.
+        """
+        sheet_name = unique_sheet_name(name, self._used)
+        self.sheet_names.append(sheet_name)
+        if self.fmt == "xlsx":
+            ws = self._book.add_worksheet(sheet_name)
+            ws.write_row(0, 0, [str(c) for c in df.columns], self._header_format)
+            for r, row in enumerate(_excel_rows(df), start=1):
+                ws.write_row(r, 0, row)
+        elif self.fmt == "csv.zip":
+            with self._zip.open(sheet_name + ".csv", "w") as f, \
+                    io.TextIOWrapper(f, encoding="utf-8-sig", newline="") as text:
+                df.to_csv(text, index=False)
+        else:
+            buffer = io.BytesIO()
+            df.to_parquet(buffer, index=False)
+            self._zip.writestr(sheet_name + ".parquet", buffer.getvalue())
+        return sheet_name
+
+    def close(self):
+        if self.fmt == "xlsx":
+            self._book.close()
+        else:
+            self._zip.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        if exc_type is not None:
+            remove_report(self.path)
+        return False
+
+
+def remove_report(path):
+    """
+    مسح ملف تقرير مؤقت قديم (بدون ما نوقف التنفيذ لو مش موجود).
+    """
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def prune_reports(report_dir=None, keep=KEEP_REPORTS):
+    """
+    مسح أقدم التقارير المؤقتة (بوقت آخر تعديل) لو عددها زاد عن keep.
+    """
+    report_dir = report_dir or REPORT_DIR
+    if not os.path.isdir(report_dir):
+        return
+    paths = [os.path.join(report_dir, name) for name in os.listdir(report_dir) if name.startswith("mrp_bom_report_")]
+    paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0, reverse=True)
+    for path in paths[keep:]:
+        remove_report(path)
+
+
+def report_mime(fmt):
+    return EXPORT_FORMATS[fmt][1]
+
+
+def report_suffix(fmt):
+    return EXPORT_FORMATS[fmt][0]
+
+
+def format_from_path(path):
+    """
+    استنتاج الصيغة من امتداد الملف (الافتراضي xlsx).
+    """
+    lowered = str(path).lower()
+    for fmt, (suffix, _) in EXPORT_FORMATS.items():
+        if lowered.endswith(suffix):
+            return fmt
+    return "xlsx"
+
+
+def export_store(store, summary_df, fmt="xlsx", path=None):
+    """
+    كتابة تقرير كامل من store (bom_results): شيت لكل Parent بالترتيب ثم Summary_Report
+    ثم Qty_Variance (تفاوت الكميات) ثم Child_Similarity (أقرب أخ لكل ابن) و Near_Duplicate_Children (MinHash/LSH).
+    الجدول العريض لكل Parent بيتبني ويتكتب ويتساب قبل اللي بعده (constant memory).
+    """
+    with ReportWriter(path, fmt) as writer:
+        for parent in store_parents(store):
+            writer.write_sheet(parent, store_parent_wide(store, parent))
+        writer.write_sheet("Summary_Report", summary_df)
+        writer.write_sheet("Qty_Variance", top_qty_variance(store, None))
+        writer.write_sheet("Child_Similarity", store_nearest_siblings(store))
+        writer.write_sheet("Near_Duplicate_Children", store_near_duplicates(store))
+    return writer.path
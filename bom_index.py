@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Adjacency indexes (built once per workbook)
+# - parent -> children من شيت father (بدل scan كامل للشيت لكل Parent)
+# - child -> parents (العكس) لمعرفة الـ Parents بتوع أي ابن
+# - component -> (material, qty) من شيت الـ BOM: "where-used" فوري لأي مكوّن
+# - commonality: مصفوفة sparse (Parent x Component) بعدد الأبناء اللي بيستخدموا كل مكوّن،
+#   عشان المكونات شبه العامة / شبه الفريدة على مستوى كل المنتجات (مرشحين للتوحيد)
+# ==============================================================================
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# أعمدة نتيجة البحث where-used
+WHERE_USED_COLUMNS = ["Component", "Used_In", "Role", "Parent", "Qty"]
+# أعمدة جدول المشاركة على مستوى المكوّن
+COMMONALITY_COLUMNS = [
+    "Component", "Component Description", "MRP_Controller", "Order_Type",
+    "Num_Parents", "Parents_%", "Num_Children", "Children_%",
+]
+# أعمدة ملخص المشاركة لكل (MRP Controller, Order Type)
+COMMONALITY_GROUP_COLUMNS = [
+    "MRP_Controller", "Order_Type", "Components", "Universal_Components", "Unique_Components",
+    "Num_Parents", "Num_Children",
+]
+# أعمدة نتيجة "مكوّن شبه عام في Parent بس ناقص من كام ابن"
+COMMONALITY_GAP_COLUMNS = [
+    "Parent", "Component", "Component Description", "MRP_Controller", "Order_Type", "Total_Children",
+    "Num_Children_with_Component", "Usage_%", "Missing", "Missing_Children", "Num_Parents",
+]
+
+# المكوّن "عام" لو موجود في النسبة دي (%) من الـ Parents أو أكتر
+UNIVERSAL_PCT = 90.0
+
+
+def build_children_index(father_df, parent_col, child_col):
+    """
+    قاموس parent -> أبناءه (نصوص، من غير تكرار، بترتيب أول ظهور في الشيت)
+    = نفس نتيجة father_df[father_df[parent_col] == parent][child_col].dropna().astype(str).unique()
+    لكل Parent، بس في مرور واحد على الشيت.
+    """
+    if father_df is None or parent_col is None or child_col is None:
+        return {}
+    pairs = father_df[[parent_col, child_col]].dropna()
+    pairs = pd.DataFrame({"parent": pairs[parent_col], "child": pairs[child_col].astype(str)})
+    return {
+        parent: children.tolist()
+        for parent, children in pairs.groupby("parent", sort=False)["child"].unique().items()
+    }
+
+
+def build_parents_index(children_index):
+    """
+    القاموس العكسي: child -> الـ Parents اللي هو تحتهم (بترتيب الـ Parents في الشيت).
+    """
+    parents_of = {}
+    for parent, children in children_index.items():
+        for child in children:
+            parents_of.setdefault(child, []).append(parent)
+    return parents_of
+
+
+def build_where_used_index(bom_df, cols, children_index=None):
+    """
+    فهرس مقلوب component -> (المادة اللي بتستخدمه، الكمية) من شيت الـ BOM:
+    السطور مترتبة بالمكوّن + offsets، فأي بحث = slice واحد.
+    الكمية = آخر كمية للمكوّن جوه نفس الكود (زي المحرك)، و NaN لو مفيش عمود كمية.
+    """
+    code_col, component_col, qty_col = cols["code_col"], cols["component_col"], cols["qty_col"]
+    bom = bom_df.dropna(subset=[code_col, component_col])
+    lines = pd.DataFrame({
+        "component": bom[component_col].astype(str).to_numpy(),
+        "material": bom[code_col].astype(str).to_numpy(),
+        "qty": pd.to_numeric(bom[qty_col], errors="coerce").to_numpy() if qty_col else np.nan,
+    }).drop_duplicates(subset=["component", "material"], keep="last")
+    lines = lines.sort_values("component", kind="stable")
+
+    components, starts = np.unique(lines["component"].to_numpy(), return_index=True)
+    children_index = children_index or {}
+    return {
+        "components": pd.Index(components),
+        "ptr": np.append(starts, len(lines)),
+        "material": lines["material"].to_numpy(),
+        "qty": lines["qty"].to_numpy(dtype=np.float64),
+        "parents_of": build_parents_index(children_index),
+        "parents": set(children_index),
+    }
+
+
+def where_used(index, component):
+    """
+    مين بيستخدم المكوّن ده وبكام:
+    - Role = Child: المادة ابن في شيت father (سطر لكل Parent بتاعه)
+    - Role = Parent: المادة نفسها Parent (المكوّن في الـ BOM بتاعه مباشرة)
+    - Role = "-": المادة مش موجودة في شيت father
+    """
+    pos = index["components"].get_indexer([str(component).strip()])[0]
+    if pos < 0:
+        return pd.DataFrame(columns=WHERE_USED_COLUMNS)
+    start, end = index["ptr"][pos], index["ptr"][pos + 1]
+    rows = []
+    for material, qty in zip(index["material"][start:end], index["qty"][start:end]):
+        if material in index["parents"]:
+            rows.append((component, material, "Parent", material, qty))
+        for parent in index["parents_of"].get(material, []):
+            rows.append((component, material, "Child", parent, qty))
+        if material not in index["parents"] and material not in index["parents_of"]:
+            rows.append((component, material, "-", None, qty))
+    return pd.DataFrame(rows, columns=WHERE_USED_COLUMNS)
+
+
+def search_components(index, text, limit=20):
+    """
+    أكواد مكونات فيها النص ده (للاقتراحات لما الكود مش مكتوب بالظبط).
+    """
+    text = str(text).strip()
+    if not text:
+        return []
+    matches = index["components"][index["components"].str.contains(text, case=False, regex=False)]
+    return matches[:limit].tolist()
+
+
+def build_commonality_index(engine, children_index):
+    """
+    فهرس المشاركة العام (مرة واحدة لكل workbook) من المحرك (bom_grouped) وفهرس الأبناء (father):
+    - counts: CSR (Parent x مادة) = عدد أبناء الـ Parent اللي كميتهم في المكوّن > 0
+      (ضرب sparse واحد: مصفوفة Parent x ابن في مصفوفة ابن x مكوّن)
+    - num_children: عدد أبناء كل Parent
+    - comp_parents / comp_children: لكل مكوّن عدد الـ Parents وعدد الأبناء المختلفين اللي بيستخدموه
+    """
+    parents = [parent for parent, children in children_index.items() if len(children)]
+    sizes = [len(children_index[parent]) for parent in parents]
+    rows = np.repeat(np.arange(len(parents)), sizes)
+    child_codes = engine["materials"].get_indexer([c for parent in parents for c in children_index[parent]])
+    known = child_codes >= 0
+    n = len(engine["materials"])
+
+    incidence = sparse.csr_matrix(
+        (np.ones(int(known.sum()), dtype=np.int32), (rows[known], child_codes[known])), shape=(len(parents), n)
+    )
+    uses = engine["matrix"].tocsr(copy=True)
+    uses.data = (uses.data > 0).astype(np.int32)
+    uses.eliminate_zeros()
+    counts = (incidence @ uses).tocsr()
+    counts.sort_indices()
+    child_uses = uses[np.unique(child_codes[known])]
+    return {
+        "engine": engine,
+        "parents": pd.Index(parents),
+        "children_index": children_index,
+        "num_children": np.asarray(sizes, dtype=np.int64),
+        "num_distinct_children": child_uses.shape[0],
+        "uses": uses,
+        "counts": counts,
+        "child_uses": child_uses,
+        "comp_parents": np.bincount(counts.indices, minlength=n),
+        "comp_children": np.bincount(child_uses.indices, minlength=n),
+    }
+
+
+def _percent(values, total):
+    return np.round(values / total * 100, 2) if total else np.zeros(len(values))
+
+
+def commonality_table(index, comp_mask=None, ascending=False, limit=None):
+    """
+    سطر لكل مكوّن مستخدم في Parent واحد على الأقل: عدد ونسبة الـ Parents والأبناء اللي بيستخدموه.
+    ascending=False => الأعم الأول (مرشحين للتوحيد)، True => الأندر الأول (شبه فريد).
+    """
+    engine = index["engine"]
+    used = index["comp_parents"] > 0
+    if comp_mask is not None:
+        used &= comp_mask
+    comps = np.flatnonzero(used)
+    num_parents, num_children = index["comp_parents"][comps], index["comp_children"][comps]
+    # الترتيب بعدد الـ Parents ثم عدد الأبناء (بنفس الاتجاه) ثم كود المادة
+    sign = 1 if ascending else -1
+    order = np.lexsort((comps, sign * num_children, sign * num_parents))
+    if limit is not None:
+        order = order[:limit]
+    comps, num_parents, num_children = comps[order], num_parents[order], num_children[order]
+    return pd.DataFrame({
+        "Component": engine["materials"][comps],
+        "Component Description": engine["desc"][comps],
+        "MRP_Controller": engine["controller"][comps],
+        "Order_Type": engine["order_type"][comps],
+        "Num_Parents": num_parents,
+        "Parents_%": _percent(num_parents, len(index["parents"])),
+        "Num_Children": num_children,
+        "Children_%": _percent(num_children, index["num_distinct_children"]),
+    }, columns=COMMONALITY_COLUMNS)
+
+
+def commonality_groups(index, comp_mask=None, universal_pct=UNIVERSAL_PCT):
+    """
+    المشاركة مجمعة بـ (MRP Controller, Order Type): عدد المكونات، العام منها (>= universal_pct من الـ Parents)،
+    الفريد (Parent واحد)، وعدد الـ Parents والأبناء المختلفين اللي بيستخدموا أي مكوّن في المجموعة.
+    """
+    engine = index["engine"]
+    used = index["comp_parents"] > 0
+    if comp_mask is not None:
+        used &= comp_mask
+    comps = np.flatnonzero(used)
+    if len(comps) == 0:
+        return pd.DataFrame(columns=COMMONALITY_GROUP_COLUMNS)
+    keys = pd.DataFrame({"MRP_Controller": engine["controller"][comps], "Order_Type": engine["order_type"][comps]})
+    grouper = keys.groupby(["MRP_Controller", "Order_Type"], dropna=False, sort=True)
+    group = grouper.ngroup().to_numpy()
+    groups = grouper.size().reset_index()[["MRP_Controller", "Order_Type"]]
+
+    # مصفوفة مكوّن x مجموعة: عدد الـ Parents / الأبناء لكل مجموعة = أعمدة فيها أي قيمة بعد الضرب
+    members = sparse.csr_matrix(
+        (np.ones(len(comps), dtype=np.int32), (comps, group)), shape=(len(engine["materials"]), len(groups))
+    )
+    parents_pct = _percent(index["comp_parents"][comps], len(index["parents"]))
+    groups["Components"] = np.bincount(group, minlength=len(groups))
+    groups["Universal_Components"] = np.bincount(group[parents_pct >= universal_pct], minlength=len(groups))
+    groups["Unique_Components"] = np.bincount(group[index["comp_parents"][comps] == 1], minlength=len(groups))
+    groups["Num_Parents"] = (index["counts"] @ members).getnnz(axis=0)
+    groups["Num_Children"] = (index["child_uses"] @ members).getnnz(axis=0)
+    return groups[COMMONALITY_GROUP_COLUMNS].sort_values("Components", ascending=False, kind="stable") \
+        .reset_index(drop=True)
+
+
+def commonality_gaps(index, min_pct=UNIVERSAL_PCT, k=50, parents=None, comp_mask=None, max_missing=None):
+    """
+    أعلى k (Parent, Component) المكوّن فيها عند min_pct% أو أكتر من أبناء الـ Parent بس ناقص من كام ابن
+    (مرشحين للتوحيد أو أخطاء BOM)، مترتبة بالنسبة تنازلي ثم عدد الناقصين ثم عدد الـ Parents.
+    الفلترة كلها على بيانات الـ CSR مباشرة؛ أسماء الأبناء الناقصين بتتجاب للـ k سطر بس.
+    """
+    engine, counts = index["engine"], index["counts"]
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    totals = index["num_children"][rows]
+    usage = np.round(counts.data / totals * 100, 2)
+    missing = totals - counts.data
+    keep = (usage >= min_pct) & (missing > 0)
+    if comp_mask is not None:
+        keep &= comp_mask[counts.indices]
+    if parents is not None:
+        keep &= np.isin(rows, index["parents"].get_indexer(list(parents)))
+    if max_missing is not None:
+        keep &= missing <= max_missing
+    sel = np.flatnonzero(keep)
+    sel = sel[np.lexsort((-index["comp_parents"][counts.indices[sel]], missing[sel], -usage[sel]))][:k]
+
+    comps, parent_rows = counts.indices[sel], rows[sel]
+    missing_children = []
+    for parent, comp in zip(index["parents"][parent_rows], comps):
+        children = index["children_index"][parent]
+        codes = engine["materials"].get_indexer(children)
+        has = np.zeros(len(children), dtype=bool)
+        has[codes >= 0] = index["uses"][codes[codes >= 0], comp].toarray().ravel() > 0
+        missing_children.append(", ".join(c for c, h in zip(children, has) if not h))
+    return pd.DataFrame({
+        "Parent": index["parents"][parent_rows],
+        "Component": engine["materials"][comps],
+        "Component Description": engine["desc"][comps],
+        "MRP_Controller": engine["controller"][comps],
+        "Order_Type": engine["order_type"][comps],
+        "Total_Children": totals[sel],
+        "Num_Children_with_Component": counts.data[sel],
+        "Usage_%": usage[sel],
+        "Missing": missing[sel],
+        "Missing_Children": missing_children,
+        "Num_Parents": index["comp_parents"][comps],
+    }, columns=COMMONALITY_GAP_COLUMNS)
+
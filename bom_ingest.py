@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Ingestion layer (parse once + on-disk Parquet cache)
+# - كل شيت بيتقري مرة واحدة بس، وبعدها يتخزن normalized في كاش Parquet
+# - مفتاح الكاش = hash لمحتوى الملف + اسم الشيت + دوره (BOM / Father / MRP)
+# - CSV / Parquet (لأي شيت، كملفات منفصلة): بتتقري chunk ورا chunk بالأعمدة المكتشفة بس
+#   والتنظيف بيتعمل لكل chunk، فالذاكرة مش بتكبر مع الأعمدة الزيادة أو حجم الملف الخام
+# ==============================================================================
+import hashlib
+import json
+import os
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from bom_profile import profile_stage
+
+# مكان الكاش على الديسك (ممكن يتغير من متغير البيئة BOM_CACHE_DIR)
+CACHE_DIR = os.environ.get(
+    "BOM_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bom_cache"),
+)
+
+# أسماء الأعمدة المرشحة (نفس القوائم اللي كانت في الكود الأصلي)
+CODE_CANDIDATES = ['Code', 'Material', 'Parent', 'Planning Material']
+COMPONENT_CANDIDATES = ['Component', 'Item', 'Material Name']
+QTY_CANDIDATES = ['Qty', 'Quantity', 'Component Quantity', 'Quantity_Per']
+PARENT_CANDIDATES = ['Parent', 'Planning Material', 'Parent_Material']
+CHILD_CANDIDATES = ['Material', 'Child', 'Child_Material']
+MRP_COMPONENT_CANDIDATES = ['Component', 'Material']
+MRP_CONTROLLER_CANDIDATES = ['MRP_Controller', 'MRP Controller', 'MRP controller', 'MRPC', 'MFC']
+ORDER_TYPE_CANDIDATES = ['Order_Type', 'Order Type', 'Order type', 'Type']
+DESC_CANDIDATES = [
+    'Component Description', 'Component_Description',
+    'Description', 'Material Description', 'Short Text',
+    'Item Description', 'Component Name', 'Material Name', 'Name'
+]
+
+# أنواع الملفات المدعومة حسب الامتداد (xlsx فيه شيتات، الباقي جدول واحد لكل ملف)
+FILE_KINDS = {".xlsx": "xlsx", ".csv": "csv", ".txt": "csv", ".parquet": "parquet", ".pq": "parquet"}
+
+# عدد السطور في كل chunk وقت قراءة CSV / Parquet
+CHUNK_ROWS = 250_000
+
+# الفواصل المحتملة في ملفات CSV (SAP بيطلّع ; أو tab حسب الإعدادات)
+CSV_DELIMITERS = [",", ";", "\t", "|"]
+
+
+def auto_detect(df, candidates):
+    """
+    اختَر أول عمود من candidates موجود في df.columns.
+    لو ولا واحد موجود، ارجع العمود الأول في الجدول كـ fallback.
+    """
+    for col in candidates:
+        if col in df.columns:
+            return col
+    return df.columns[0]
+
+
+def try_get_col(df, candidates):
+    """
+    حاول تجيب أول عمود من candidates، أو ارجع None لو الداتا None أو مفيهوش.
+    """
+    if df is None:
+        return None
+    for c in candidates:
+        if c in df.columns:
+            return c
+    return None
+
+
+def detect_bom_columns(bom_df):
+    """
+    اكتشاف أعمدة شيت الـ BOM: الكود، المكوّن، الكمية (اختياري)، والوصف (اختياري).
+    """
+    qty_candidates = [c for c in QTY_CANDIDATES if c in bom_df.columns]
+    return {
+        "code_col": auto_detect(bom_df, CODE_CANDIDATES),
+        "component_col": auto_detect(bom_df, COMPONENT_CANDIDATES),
+        "qty_col": auto_detect(bom_df, qty_candidates) if qty_candidates else None,
+        "desc_col_bom": try_get_col(bom_df, DESC_CANDIDATES),
+    }
+
+
+def detect_father_columns(father_df):
+    """
+    اكتشاف عمودي الأب والابن في شيت الـ father (لو موجود).
+    """
+    if father_df is None:
+        return {"parent_col": None, "child_col": None}
+    return {
+        "parent_col": auto_detect(father_df, PARENT_CANDIDATES),
+        "child_col": auto_detect(father_df, CHILD_CANDIDATES),
+    }
+
+
+def detect_mrp_columns(mrp_df):
+    """
+    اكتشاف أعمدة شيت MRP Control (مع دعم أسماء مختلفة للـ Controller والـ Order Type).
+    """
+    if mrp_df is None:
+        return {"mrp_component_col": None, "mrp_controller_col": None,
+                "mrp_order_type_col": None, "desc_col_mrp": None}
+    return {
+        "mrp_component_col": auto_detect(mrp_df, MRP_COMPONENT_CANDIDATES),
+        "mrp_controller_col": try_get_col(mrp_df, MRP_CONTROLLER_CANDIDATES)
+        or auto_detect(mrp_df, ['MRP_Controller', 'MFC']),
+        "mrp_order_type_col": try_get_col(mrp_df, ORDER_TYPE_CANDIDATES)
+        or auto_detect(mrp_df, ['Order_Type', 'Type']),
+        "desc_col_mrp": try_get_col(mrp_df, DESC_CANDIDATES),
+    }
+
+
+def strip_codes(series):
+    """
+    تحويل الأكواد لنص وتنظيفها من المسافات (القيم الفاضية تفضل NaN زي ما هي).
+    """
+    return series.where(series.isna(), series.astype(str).str.strip())
+
+
+def _arrow_safe(df):
+    """
+    الأعمدة اللي فيها أنواع مختلطة (أرقام + نص) بنحوّلها لنص عشان تتكتب في Parquet.
+    بنعمل كده في كل مرة (مش بس وقت الكتابة) عشان أول قراءة = القراءة من الكاش.
+    """
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) in ("mixed", "mixed-integer"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _role_columns(df, role):
+    # الأعمدة المكتشفة للشيت حسب دوره + أعمدة الأكواد اللي محتاجة تنظيف
+    if role == "bom":
+        cols = detect_bom_columns(df)
+        code_cols = [cols["code_col"], cols["component_col"]]
+    elif role == "father":
+        cols = detect_father_columns(df)
+        code_cols = [cols["parent_col"], cols["child_col"]]
+    else:
+        cols = detect_mrp_columns(df)
+        code_cols = [cols["mrp_component_col"]]
+    return cols, list(dict.fromkeys(code_cols))
+
+
+def normalize_sheet(df, role):
+    """
+    تنظيف شيت واحد حسب دوره: أسماء الأعمدة + أعمدة الأكواد.
+    بترجع (df, cols) حيث cols هي الأعمدة المكتشفة للشيت ده.
+    """
+    df.columns = [str(c).strip() for c in df.columns]
+    df = _arrow_safe(df)
+    cols, code_cols = _role_columns(df, role)
+    for col in code_cols:
+        df[col] = strip_codes(df[col])
+    return df, cols
+
+
+def file_kind(name):
+    """
+    نوع الملف من امتداده: xlsx / csv / parquet (أو None لو مش مدعوم).
+    """
+    return FILE_KINDS.get(os.path.splitext(str(name))[1].lower())
+
+
+def _open_source(source):
+    # المصدر يا bytes (ملف مرفوع) يا مسار على الديسك (الـ CLI، من غير تحميل الملف كله)
+    return BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _csv_delimiter(source):
+    # الفاصل = أكتر فاصل متكرر في سطر العناوين
+    if isinstance(source, bytes):
+        head = source[:65536]
+    else:
+        with open(source, "rb") as f:
+            head = f.read(65536)
+    header = head.decode("utf-8-sig", errors="replace").splitlines()[0] if head else ""
+    return max(CSV_DELIMITERS, key=header.count)
+
+
+def _table_header(source, kind, sep=None):
+    if kind == "parquet":
+        return pq.ParquetFile(_open_source(source)).schema_arrow.names
+    return pd.read_csv(_open_source(source), sep=sep, nrows=0, encoding="utf-8-sig",
+                       encoding_errors="replace").columns.tolist()
+
+
+def _iter_table_chunks(source, kind, columns, chunk_rows, sep=None):
+    # الأعمدة المطلوبة بس، chunk ورا chunk (الأكواد بتتقري كنص عشان الأصفار اللي على الشمال)
+    if kind == "parquet":
+        for batch in pq.ParquetFile(_open_source(source)).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(_open_source(source), sep=sep, usecols=columns, dtype=str, chunksize=chunk_rows,
+                           encoding="utf-8-sig", encoding_errors="replace")
+
+
+def _compact_chunk(chunk, cols, code_cols):
+    # تنظيف chunk واحد: أكواد متنضفة، الكمية رقم، وباقي الأعمدة نص (Arrow strings)
+    # من غير astype("str") في الآخر: على pandas 2 كانت بتقلب الخانات الفاضية لـ "nan" كنص
+    chunk.columns = [str(c).strip() for c in chunk.columns]
+    for col in chunk.columns:
+        if col in code_cols:
+            chunk[col] = strip_codes(chunk[col])
+        elif col == cols.get("qty_col"):
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+        elif chunk[col].dtype == object:
+            chunk[col] = chunk[col].where(chunk[col].isna(), chunk[col].astype(str))
+    return chunk
+
+
+def read_table(source, kind, role, chunk_rows=CHUNK_ROWS):
+    """
+    قراءة جدول CSV / Parquet لدور معين (bom / father / mrp) على chunks:
+    العناوين بتتقري الأول وبيتكشف منها الأعمدة، وبعدين الأعمدة دي بس بتتقري وتتنضف chunk ورا chunk.
+    بترجع (df, cols) زي normalize_sheet (بس بالأعمدة المكتشفة بس).
+    """
+    sep = _csv_delimiter(source) if kind == "csv" else None
+    header = _table_header(source, kind, sep)
+    raw_names = {str(c).strip(): c for c in header}
+    cols, code_cols = _role_columns(pd.DataFrame(columns=list(raw_names)), role)
+    wanted = list(dict.fromkeys(c for c in cols.values() if c is not None))
+    chunks = [
+        _compact_chunk(chunk, cols, code_cols)
+        for chunk in _iter_table_chunks(source, kind, [raw_names[c] for c in wanted], chunk_rows, sep)
+    ]
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=wanted)
+    return df[wanted], cols
+
+
+def file_digest(data):
+    """
+    hash لمحتوى الملف المرفوع (نفس الملف = نفس المفتاح مهما اتغيّر اسمه).
+    لو اتبعت مسار بدل bytes الملف بيتقري على أجزاء (من غير ما يتحمّل كله في الذاكرة).
+    """
+    if isinstance(data, bytes):
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    with open(data, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sheet_key(role, sheet):
+    return f"{role}-{hashlib.sha1(str(sheet).encode('utf-8')).hexdigest()[:12]}"
+
+
+def _cache_paths(cache_dir, digest, role, sheet):
+    base = os.path.join(cache_dir, digest, _sheet_key(role, sheet))
+    return base + ".parquet", base + ".json"
+
+
+def list_sheets(data, digest=None, cache_dir=None):
+    """
+    أسماء الشيتات في الملف (بتتخزن في الكاش عشان ما نفتحش الملف تاني).
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    digest = digest or file_digest(data)
+    path = os.path.join(cache_dir, digest, "sheets.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    sheets = pd.ExcelFile(BytesIO(data)).sheet_names
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(sheets, f, ensure_ascii=False)
+    except OSError:
+        pass
+    return sheets
+
+
+def _read_cached(cache_dir, digest, role, sheet):
+    data_path, meta_path = _cache_paths(cache_dir, digest, role, sheet)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        df = pd.read_parquet(data_path)
+        with open(meta_path, encoding="utf-8") as f:
+            cols = json.load(f)
+    except Exception:
+        # كاش بايظ أو مكتبة Parquet مش متاحة => نقرأ من الإكسل عادي
+        return None
+    return df, cols
+
+
+def _write_cached(cache_dir, digest, role, sheet, df, cols):
+    data_path, meta_path = _cache_paths(cache_dir, digest, role, sheet)
+    try:
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        tmp_path = data_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, data_path)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(cols, f, ensure_ascii=False)
+    except Exception:
+        # الكاش اختياري: أي فشل في الكتابة ما يوقفش التحليل
+        pass
+
+
+def _read_role_cached(cache_dir, digest, role, sheet, profile):
+    with profile_stage(profile, f"read {role} (parquet cache)") as record:
+        cached = _read_cached(cache_dir, digest, role, sheet)
+        record["rows"] = None if cached is None else len(cached[0])
+    if cached is None and profile is not None:
+        profile["stages"].pop()
+    return cached
+
+
+def _load_excel(data, digest, wanted, cache_dir, profile):
+    # wanted: role -> sheet. أي شيت في الكاش بيتقري منه، والناقص بيتقري من الإكسل في parse واحد
+    frames, cols = {}, {}
+    missing = []
+    for role, sheet in wanted.items():
+        cached = _read_role_cached(cache_dir, digest, role, sheet, profile)
+        if cached is None:
+            missing.append((role, sheet))
+        else:
+            frames[role], cols[role] = cached
+
+    if missing:
+        # قراءة كل الشيتات الناقصة في parse واحد للملف
+        with profile_stage(profile, "read excel") as record:
+            raw = pd.read_excel(_open_source(data), sheet_name=list(dict.fromkeys(s for _, s in missing)))
+            record["rows"] = sum(len(df) for df in raw.values())
+        for role, sheet in missing:
+            with profile_stage(profile, f"normalize {role}", rows=len(raw[sheet])):
+                df, role_cols = normalize_sheet(raw[sheet].copy(), role)
+            with profile_stage(profile, f"cache write {role}", rows=len(df)):
+                _write_cached(cache_dir, digest, role, sheet, df, role_cols)
+            frames[role], cols[role] = df, role_cols
+    return frames, cols
+
+
+def _load_table(source, kind, role, digest, cache_dir, profile, chunk_rows):
+    # جدول CSV / Parquet لدور واحد: من الكاش، أو قراءة على chunks ثم الكاش
+    cached = _read_role_cached(cache_dir, digest, role, kind, profile)
+    if cached is not None:
+        return cached
+    with profile_stage(profile, f"read {role} ({kind}, chunked)") as record:
+        df, cols = read_table(source, kind, role, chunk_rows)
+        record["rows"] = len(df)
+    with profile_stage(profile, f"cache write {role}", rows=len(df)):
+        _write_cached(cache_dir, digest, role, kind, df, cols)
+    return df, cols
+
+
+def _assemble(frames, cols):
+    all_cols = dict(cols["bom"])
+    all_cols.update(cols.get("father") or detect_father_columns(None))
+    all_cols.update(cols.get("mrp") or detect_mrp_columns(None))
+    return frames.get("bom"), frames.get("father"), frames.get("mrp"), all_cols
+
+
+def load_inputs(files, bom_source, father_source=None, mrp_source=None, cache_dir=None, digests=None,
+                profile=None, chunk_rows=CHUNK_ROWS):
+    """
+    تحميل الشيتات الثلاثة من ملف واحد أو أكتر (xlsx / csv / parquet، ممكن مختلطين):
+    - files: اسم الملف -> محتواه (bytes) أو مساره على الديسك
+    - كل source = (اسم الملف، اسم الشيت) لـ xlsx أو (اسم الملف، None) لـ CSV / Parquet، أو None = مش موجود
+    - digests: اسم الملف -> hash المحتوى لو متحسب قبل كده
+    الشيتات اللي من نفس ملف الإكسل بتتقري في parse واحد، وCSV / Parquet على chunks (شوف read_table).
+    - الشيتات اللي في الكاش بتتقري من Parquet مباشرة، والناقصة بتتقري من الملف وتتخزن في الكاش.
+    - profile: لو اتبعت، مراحل read / normalize بتتسجل فيه (شوف bom_profile)
+    بترجع (bom_df, father_df, mrp_df, cols) حيث cols قاموس بكل الأعمدة المكتشفة.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    digests = dict(digests or {})
+    frames, cols, workbooks = {}, {}, {}
+    for role, source in (("bom", bom_source), ("father", father_source), ("mrp", mrp_source)):
+        if source is None:
+            continue
+        name, sheet = source
+        if name not in digests:
+            digests[name] = file_digest(files[name])
+        kind = file_kind(name)
+        if kind == "xlsx":
+            workbooks.setdefault(name, {})[role] = sheet
+        elif kind is not None:
+            frames[role], cols[role] = _load_table(files[name], kind, role, digests[name], cache_dir, profile,
+                                                   chunk_rows)
+        else:
+            raise ValueError(f"نوع ملف غير مدعوم: {name}")
+    for name, wanted in workbooks.items():
+        loaded_frames, loaded_cols = _load_excel(files[name], digests[name], wanted, cache_dir, profile)
+        frames.update(loaded_frames)
+        cols.update(loaded_cols)
+    return _assemble(frames, cols)
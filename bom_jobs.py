@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Background analysis jobs
+# - التحليل الكامل بيشتغل في thread منفصل ومتسجل في registry على مستوى الـ process،
+#   فأي rerun للـ script (أو ضغطة على أي widget) مش بيوقفه ولا بيضيع شغله
+# - التقدم لكل Parent + سطور الملخص للـ Parents اللي خلصت أول بأول
+# - الإلغاء بيوقف بعد الـ Parent الحالي، والنتيجة بتتبني من اللي خلص (partial)
+# - وضع الـ snapshot (اختياري): الـ Parents اللي ما اتغيرتش بترجع من آخر snapshot (شوف bom_snapshot)
+# - النتيجة الكاملة بتتكتب في SQLite (bom_db) جوه الـ job نفسه، والفلاتر بعد كده views صغيرة عليها
+# ==============================================================================
+import threading
+import time
+from contextlib import nullcontext
+
+import pandas as pd
+
+from bom_batch import iter_parent_results, iter_snapshot_results, parent_summary_row, prepare_analysis
+from bom_db import run_key, save_run
+from bom_profile import memory_tracing, new_profile, profile_stage, track_parents
+from bom_results import SUMMARY_COLUMNS, build_result_store
+from bom_snapshot import (change_report, latest_snapshot, load_snapshot, parent_fingerprints, save_snapshot,
+                          snapshot_changes, snapshot_key)
+
+# أقصى عدد jobs خلصانة بنحتفظ بنتايجها (زي max_entries بتاع الكاش)؛ الشغالة عمرها ما بتتمسح
+MAX_JOBS = 4
+
+# حالات الـ job
+RUNNING, DONE, CANCELLED, FAILED = "running", "done", "cancelled", "failed"
+
+_JOBS = {}
+_LOCK = threading.Lock()
+
+
+def get_job(key):
+    return _JOBS.get(key)
+
+
+def submit_job(key, bom_df, father_df, mrp_df, cols, parents, explode=None, children_index=None, track_memory=False,
+               snapshot_dir=None, snapshot_meta=None, engine=None):
+    """
+    تشغيل التحليل الكامل لكل الـ Parents في الخلفية بمفتاح key (الملف + الشيتات + التفجير).
+    لو فيه job بنفس المفتاح شغال أو خلص بنرجّعه زي ما هو (مشترك بين الجلسات)؛
+    الـ job اللي اتلغى أو فشل بيتعاد من الأول.
+    job["run_id"] = التشغيل الكامل في bom_db بعد ما يخلص.
+    snapshot_dir => وضع الـ snapshot: job["snapshot"] بيبقى فيه path / previous / stats / changes / report
+    (المقارنة بآخر snapshot بنفس التفجير والشيتات؛ snapshot_meta["sheets"] = أسماء الشيتات bom / father / mrp)
+    (الـ snapshot الجديد بيتحفظ بس لو التحليل كمل، مش لو اتلغى).
+    engine: محرك جاهز من نسخة منشورة (bom_publish) بدل بناءه من bom_df.
+    """
+    parents = list(parents)
+    with _LOCK:
+        job = _JOBS.get(key)
+        if job is not None and job["status"] in (RUNNING, DONE):
+            return job
+        job = {
+            "key": key,
+            "status": RUNNING,
+            "total": len(parents),
+            "done": 0,
+            "summary_rows": [],
+            "store": None,
+            "run_id": None,
+            "snapshot": None,
+            "profile": new_profile(),
+            "error": None,
+            "started": time.time(),
+            "finished": None,
+            "cancel": threading.Event(),
+        }
+        _JOBS[key] = job
+        _evict()
+    thread = threading.Thread(
+        target=_run_job,
+        args=(job, bom_df, father_df, mrp_df, cols, parents, explode, children_index, track_memory,
+              snapshot_dir, snapshot_meta, engine),
+        name=f"bom-analysis-{len(parents)}",
+        daemon=True,
+    )
+    thread.start()
+    return job
+
+
+def _run_job(job, bom_df, father_df, mrp_df, cols, parents, explode, children_index, track_memory,
+             snapshot_dir, snapshot_meta, engine):
+    profile, cancel = job["profile"], job["cancel"]
+    parts = []
+    try:
+        with memory_tracing() if track_memory else nullcontext():
+            context = prepare_analysis(bom_df, father_df, mrp_df, cols, explode=explode, profile=profile,
+                                       children_index=children_index, engine=engine)
+            if snapshot_dir:
+                # التحليل في الخلفية من غير فلاتر دايمًا، فالمفتاح = التفجير + الشيتات (snapshot_meta["sheets"])
+                key = snapshot_key(explode, sheets=(snapshot_meta or {}).get("sheets"))
+                with profile_stage(profile, "fingerprints", rows=len(parents)):
+                    fingerprints = parent_fingerprints(context, parents)
+                previous_path = latest_snapshot(snapshot_dir, key=key)
+                previous = load_snapshot(previous_path) if previous_path else None
+                stats = {}
+                results = iter_snapshot_results(context, parents, previous, fingerprints, 1, stats)
+            else:
+                results = iter_parent_results(context, parents, workers=1)
+            with profile_stage(profile, "per-parent analysis", rows=len(parents)) as record:
+                for part in track_parents(profile, results):
+                    parts.append(part)
+                    job["summary_rows"].append(parent_summary_row(part))
+                    job["done"] = len(parts)
+                    if cancel.is_set():
+                        break
+                record["rows"] = len(parts)
+            with profile_stage(profile, "result store (assembly)") as record:
+                store = build_result_store(context["engine"], parts)
+                record["rows"] = len(store["components"])
+            if snapshot_dir and not cancel.is_set():
+                with profile_stage(profile, "snapshot (save + changes)", rows=len(parts)):
+                    current = save_snapshot(context["engine"], parts, fingerprints, snapshot_dir,
+                                            dict(snapshot_meta or {}, explode=explode), key=key)
+                    job["snapshot"] = {
+                        "path": current["path"],
+                        "previous": previous["path"] if previous is not None else None,
+                        "stats": stats,
+                        "changes": snapshot_changes(previous, current) if previous is not None else None,
+                        "report": change_report(previous, current) if previous is not None else None,
+                    }
+            # النتيجة الكاملة في SQLite مرة واحدة لكل job (حالة الـ job وعدد الـ Parents في المفتاح
+            # عشان نتيجة متلغية ما تتخلطش بالكاملة)
+            status = CANCELLED if cancel.is_set() else DONE
+            run_id = run_key(job["key"], status, len(parts))
+            with profile_stage(profile, "save results (SQLite)", rows=len(store["components"])):
+                save_run(run_id, store, {"analysis": job["key"]})
+        job["store"] = store
+        job["run_id"] = run_id
+        job["status"] = status
+    except Exception as e:
+        job["error"] = str(e)
+        job["status"] = FAILED
+    finally:
+        job["finished"] = time.time()
+
+
+def cancel_job(job):
+    """
+    طلب إلغاء: الـ thread بيقف بعد الـ Parent اللي شغال عليه، والنتيجة بتبقى للـ Parents اللي خلصت بس.
+    """
+    job["cancel"].set()
+
+
+def job_progress(job):
+    """
+    (عدد الـ Parents اللي خلصت، الإجمالي، الوقت المتبقي التقريبي بالثواني أو None).
+    """
+    done, total = job["done"], job["total"]
+    elapsed = (job["finished"] or time.time()) - job["started"]
+    remaining = elapsed / done * (total - done) if done and job["status"] == RUNNING else None
+    return done, total, remaining
+
+
+def partial_summary(job):
+    """
+    ملخص الـ Parents اللي خلصت لحد دلوقتي (نفس أعمدة Summary_Report).
+    """
+    return pd.DataFrame(job["summary_rows"][:job["done"]], columns=SUMMARY_COLUMNS)
+
+
+def _evict():
+    # بنمسح أقدم الـ jobs الخلصانة لو عددها زاد عن MAX_JOBS
+    finished = sorted((job for job in _JOBS.values() if job["status"] != RUNNING), key=lambda job: job["started"])
+    for job in finished[:max(0, len(finished) - MAX_JOBS)]:
+        del _JOBS[job["key"]]
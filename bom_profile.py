@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Per-stage instrumentation (diagnostics)
+# - لكل مرحلة: الوقت الفعلي + ذروة الذاكرة (tracemalloc لو شغال) + عدد السطور
+# - أبطأ الـ Parents في التحليل
+# - التصدير JSON للـ monitoring
+# ==============================================================================
+import heapq
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# عدد أبطأ الـ Parents اللي بنحتفظ بيهم
+SLOWEST_PARENTS = 10
+
+# tracemalloc واحد للـ process كله (reset_peak / stop بيأثروا على أي thread)، فـ thread واحد بس
+# بيملك القياس في نفس الوقت؛ أي job تاني بيشتغل من غير قياس ذاكرة بدل ما يبوّظ أرقام التاني
+_TRACING_OWNER = None
+_TRACING_LOCK = threading.Lock()
+
+
+def new_profile(**meta):
+    """
+    profile فاضي: stages (بالترتيب) + slowest_parents + أي بيانات إضافية (اسم الملف، الشيتات...).
+    """
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "timestamp": time.time(),
+        "meta": meta,
+        "stages": [],
+        "slowest_parents": [],
+    }
+
+
+@contextmanager
+def memory_tracing():
+    """
+    تشغيل tracemalloc طول البلوك عشان ذروة الذاكرة تتسجل لكل مرحلة في الـ thread ده.
+    لو thread تاني بيقيس دلوقتي (أو tracemalloc شغال من برة) البلوك بيشتغل من غير قياس
+    (peak_mb = None). بترجع True لو القياس شغال للـ thread ده.
+    """
+    global _TRACING_OWNER
+    me = threading.get_ident()
+    with _TRACING_LOCK:
+        nested = _TRACING_OWNER == me
+        started = _TRACING_OWNER is None and not tracemalloc.is_tracing()
+        if started:
+            _TRACING_OWNER = me
+            tracemalloc.start()
+    try:
+        yield started or nested
+    finally:
+        if started:
+            with _TRACING_LOCK:
+                tracemalloc.stop()
+                _TRACING_OWNER = None
+
+
+@contextmanager
+def profile_stage(profile, name, rows=None):
+    """
+    قياس مرحلة واحدة وإضافتها للـ profile (profile=None => من غير تسجيل).
+    البلوك يقدر يحدّث record["rows"] بعدد السطور اللي اتعالجت.
+    المراحل مش بتتداخل (ذروة الذاكرة بتتصفر في بداية كل مرحلة)، والذاكرة بتتقاس بس للـ thread
+    اللي مالك القياس (memory_tracing)؛ الرقم بيشمل أي حاجة اتحجزت في الـ process وقتها.
+    """
+    record = {"stage": name, "seconds": None, "peak_mb": None, "rows": rows, "cached": False}
+    tracing = profile is not None and _TRACING_OWNER == threading.get_ident()
+    if tracing:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        if tracing:
+            record["peak_mb"] = round((tracemalloc.get_traced_memory()[1] - base) / 2 ** 20, 2)
+        if profile is not None:
+            profile["stages"].append(record)
+
+
+def track_parents(profile, parts, top=SLOWEST_PARENTS):
+    """
+    تمرير نتائج analyze_parent_long زي ما هي، مع الاحتفاظ بأبطأ top Parents في الـ profile
+    (الوقت بيتقاس جوه الـ worker نفسه في part["seconds"]).
+    """
+    heap = []
+    for i, part in enumerate(parts):
+        if profile is not None:
+            entry = (part.get("seconds", 0.0), i, {
+                "parent": part["parent"],
+                "seconds": round(part.get("seconds", 0.0), 4),
+                "children": len(part["child_names"]),
+                "components": int(len(part["components"])),
+                "cells": int(len(part["cell_qty"])),
+            })
+            if len(heap) < top:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+        yield part
+    if profile is not None:
+        profile["slowest_parents"] = [entry[2] for entry in sorted(heap, reverse=True)]
+
+
+def merge_profile(profile, inner, since):
+    """
+    إضافة مراحل profile داخلي (من دالة متكاشة) للـ profile الحالي.
+    لو الـ profile الداخلي اتعمل قبل since (يعني النتيجة رجعت من الكاش) المراحل بتتعلّم cached=True
+    عشان يبان إن الأرقام دي من أول مرة اتحسبت، مش من التشغيل ده.
+    """
+    cached = inner["timestamp"] < since
+    profile["stages"].extend(dict(stage, cached=cached) for stage in inner["stages"])
+    if inner["slowest_parents"]:
+        profile["slowest_parents"] = list(inner["slowest_parents"])
+
+
+def stages_frame(profile):
+    return pd.DataFrame(profile["stages"], columns=["stage", "seconds", "peak_mb", "rows", "cached"])
+
+
+def profile_json(profile):
+    return json.dumps(profile, ensure_ascii=False, indent=2, default=str)
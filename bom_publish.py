@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Published master-data snapshot (memory-mapped, shared)
+# - "نشر" نسخة من البيانات الأساسية: شيتات BOM / father / MRP بعد التنضيف (Arrow IPC)
+#   + مصفوفات المحرك والأبناء بأكواد رقمية (NumPy .npy) في مجلد لكل نسخة
+# - أي process (أي Streamlit worker) بيفتح النسخة memory-mapped للقراءة بس: الصفحات
+#   بتتشارك من الـ page cache بين كل الـ processes، وكل الجلسات جوه الـ process بتشاور على نفس النسخة
+# - التحليل بيشتغل على المحرك المنشور مباشرة (من غير groupby / build_engine لكل جلسة)
+# - نسخة جديدة = python bom_publish.py workbook.xlsx (أو زرار النشر في الواجهة)
+# ==============================================================================
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from scipy import sparse
+
+from bom_batch import _input_source, prepare_analysis
+from bom_ingest import CACHE_DIR, file_kind, load_inputs
+from bom_profile import new_profile, profile_stage
+
+# مكان النسخ المنشورة (ممكن يتغير من متغير البيئة BOM_PUBLISH_DIR)
+PUBLISH_DIR = os.environ.get("BOM_PUBLISH_DIR", os.path.join(CACHE_DIR, "published"))
+
+# عدد النسخ اللي بنحتفظ بيها (الأقدم بيتمسح؛ اللي فاتحها memory-mapped بيفضل شغال عليها)
+KEEP_VERSIONS = 4
+
+# جداول Arrow IPC (الشيتات بعد التنضيف + بيانات المواد)
+_FRAMES = ("bom", "father", "mrp")
+# مصفوفات NumPy (المحرك + فهرس الأبناء بأكواد المواد)
+_ARRAYS = ("matrix_data", "matrix_indices", "matrix_indptr", "order_ptr", "order_idx", "child_ptr", "child_codes")
+
+# النسخ المفتوحة في الـ process ده (مشتركة بين كل الجلسات)
+_LOADED = {}
+_LOCK = threading.Lock()
+
+
+def _write_frame(path, df):
+    _write_table(path, pa.Table.from_pandas(df, preserve_index=False))
+
+
+def _write_table(path, table):
+    # Arrow IPC file من غير ضغط عشان يتقري memory-mapped من غير نسخ
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_frame(path):
+    # الأعمدة الرقمية والنصية بتفضل على الـ buffers الممسوحة (split_blocks = من غير تجميع في block واحد)
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _content_digest(path):
+    # hash لمحتوى ملفات النسخة بس (بترتيب الأسماء)، فنفس البيانات = نفس الـ digest مهما اتنشرت كام مرة
+    digest = hashlib.sha1()
+    for file_name in sorted(os.listdir(path)):
+        digest.update(file_name.encode("utf-8"))
+        with open(os.path.join(path, file_name), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _object_column(values):
+    # وصف / MRP لكل مادة: نص أو None (أي قيمة ناقصة بتبقى None)
+    return pa.array([None if pd.isna(v) else str(v) for v in values], type=pa.string())
+
+
+def publish(bom_df, father_df, mrp_df, cols, root=None, meta=None, profile=None, keep=KEEP_VERSIONS):
+    """
+    نشر نسخة جديدة من البيانات الأساسية (بعد load_inputs) في root:
+    bom / father / mrp + materials (Arrow IPC) و مصفوفات المحرك وفهرس الأبناء (.npy) و meta.json.
+    المجلد بيتكتب باسم مؤقت وبعدين بيتنقل (زي bom_snapshot)، فأي نسخة يا كاملة يا مش موجودة.
+    بترجع مسار النسخة.
+    """
+    root = root or PUBLISH_DIR
+    with profile_stage(profile, "publish: engine", rows=len(bom_df)):
+        context = prepare_analysis(bom_df, father_df, mrp_df, cols)
+    engine, children_index = context["engine"], context["children_index"]
+
+    name = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path, tmp_path = os.path.join(root, name), os.path.join(root, "." + name)
+    os.makedirs(tmp_path, exist_ok=True)
+    with profile_stage(profile, "publish: write", rows=int(engine["matrix"].nnz)):
+        for frame, df in zip(_FRAMES, (bom_df, father_df, mrp_df)):
+            if df is not None:
+                _write_frame(os.path.join(tmp_path, frame + ".arrow"), df)
+        _write_table(os.path.join(tmp_path, "materials.arrow"), pa.table({
+            "material": pa.array(engine["materials"].astype(str), type=pa.string()),
+            "desc": _object_column(engine["desc"]),
+            "controller": _object_column(engine["controller"]),
+            "order_type": _object_column(engine["order_type"]),
+        }))
+        parents = list(children_index)
+        arrays = {
+            "matrix_data": engine["matrix"].data,
+            "matrix_indices": engine["matrix"].indices,
+            "matrix_indptr": engine["matrix"].indptr,
+            "order_ptr": engine["order_ptr"],
+            "order_idx": engine["order_idx"],
+            "child_ptr": np.concatenate(([0], np.cumsum([len(children_index[p]) for p in parents]))).astype(np.int64),
+            "child_codes": engine["materials"].get_indexer([c for p in parents for c in children_index[p]]),
+        }
+        for key, values in arrays.items():
+            np.save(os.path.join(tmp_path, key + ".npy"), np.ascontiguousarray(values))
+        _write_frame(os.path.join(tmp_path, "parents.arrow"), pd.DataFrame({"parent": pd.Series(parents, dtype=object)}))
+        info = dict(meta or {}, created=datetime.now().isoformat(timespec="seconds"), version=name,
+                    digest=_content_digest(tmp_path), cols=cols, has_qty=engine["has_qty"],
+                    materials=len(engine["materials"]), parents=len(parents), bom_rows=len(bom_df),
+                    frames=[frame for frame, df in zip(_FRAMES, (bom_df, father_df, mrp_df)) if df is not None])
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    prune_versions(root, keep)
+    return path
+
+
+def list_versions(root=None):
+    """
+    مسارات النسخ المنشورة (الأحدث الأول).
+    """
+    root = root or PUBLISH_DIR
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root), reverse=True)
+            if not name.startswith(".") and os.path.exists(os.path.join(root, name, "meta.json"))]
+
+
+def latest_version(root=None):
+    paths = list_versions(root)
+    return paths[0] if paths else None
+
+
+def prune_versions(root=None, keep=KEEP_VERSIONS):
+    for path in list_versions(root)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_published(path):
+    """
+    فتح نسخة منشورة memory-mapped (مرة واحدة لكل process، وبعد كده نفس الـ dict لكل الجلسات).
+    بترجع bom_df / father_df / mrp_df / cols / engine / children_index / meta / digest / profile.
+    مصفوفات المحرك والجداول على الـ buffers الممسوحة للقراءة بس؛ فهرس المواد والوصف وبيانات MRP
+    بيتبنوا مرة واحدة للـ process.
+    """
+    with _LOCK:
+        published = _LOADED.get(path)
+        if published is None:
+            published = _open_version(path)
+            _LOADED[path] = published
+            # النسخ الأقدم اللي مفتوحة بنسيبها للجلسات اللي شغالة عليها، بس مش أكتر من KEEP_VERSIONS
+            for old in list(_LOADED)[:-KEEP_VERSIONS]:
+                del _LOADED[old]
+    return published
+
+
+def _open_version(path):
+    profile = new_profile(published=path)
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    with profile_stage(profile, "published snapshot (memory map)", rows=meta["bom_rows"]):
+        frames = {
+            frame: _read_frame(os.path.join(path, frame + ".arrow")) if frame in meta["frames"] else None
+            for frame in _FRAMES
+        }
+        arrays = {key: np.load(os.path.join(path, key + ".npy"), mmap_mode="r") for key in _ARRAYS}
+        materials = _read_frame(os.path.join(path, "materials.arrow"))
+        n = meta["materials"]
+        engine = {
+            "materials": pd.Index(materials["material"]).rename(None),
+            "matrix": sparse.csr_matrix(
+                (arrays["matrix_data"], arrays["matrix_indices"], arrays["matrix_indptr"]), shape=(n, n), copy=False
+            ),
+            "has_qty": meta["has_qty"],
+            "order_ptr": arrays["order_ptr"],
+            "order_idx": arrays["order_idx"],
+            "desc": materials["desc"].to_numpy(dtype=object, na_value=None),
+            "controller": materials["controller"].to_numpy(dtype=object, na_value=None),
+            "order_type": materials["order_type"].to_numpy(dtype=object, na_value=None),
+        }
+        # الوصف من غير قيمة = "" زي build_engine
+        engine["desc"][pd.isna(engine["desc"])] = ""
+        parents = _read_frame(os.path.join(path, "parents.arrow"))["parent"].tolist()
+        child_ptr, child_names = arrays["child_ptr"], engine["materials"][arrays["child_codes"]].tolist()
+        children_index = {parent: child_names[child_ptr[i]:child_ptr[i + 1]] for i, parent in enumerate(parents)}
+    return {
+        "path": path,
+        "version": meta["version"],
+        "meta": meta,
+        "digest": meta["digest"],
+        "cols": meta["cols"],
+        "bom_df": frames["bom"],
+        "father_df": frames["father"],
+        "mrp_df": frames["mrp"],
+        "engine": engine,
+        "children_index": children_index,
+        "profile": profile,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="نشر نسخة جديدة من البيانات الأساسية (BOM / father / MRP) memory-mapped لكل الـ workers"
+    )
+    parser.add_argument("workbook", nargs="?", help="ملف Excel (أو CSV / Parquet للـ BOM)")
+    parser.add_argument("--bom-sheet", default="Bom")
+    parser.add_argument("--father-sheet", default="father code")
+    parser.add_argument("--mrp-sheet", default="MRP Controller")
+    parser.add_argument("--father-file", help="ملف father منفصل (xlsx / csv / parquet)")
+    parser.add_argument("--mrp-file", help="ملف MRP Controller منفصل (xlsx / csv / parquet)")
+    parser.add_argument("--dir", default=PUBLISH_DIR, help="مجلد النسخ المنشورة")
+    parser.add_argument("--list", action="store_true", help="عرض النسخ المنشورة بس")
+    args = parser.parse_args(argv)
+
+    if args.list or not args.workbook:
+        for path in list_versions(args.dir):
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            print(f"{meta['version']}  {meta.get('workbook', '')}  parents={meta['parents']}  bom_rows={meta['bom_rows']}")
+        return 0
+
+    files = {}
+    in_workbook = args.workbook if file_kind(args.workbook) == "xlsx" else None
+    profile = new_profile(workbook=args.workbook)
+    bom_df, father_df, mrp_df, cols = load_inputs(
+        files,
+        _input_source(args.workbook, args.bom_sheet, files),
+        _input_source(args.father_file or in_workbook, args.father_sheet, files),
+        _input_source(args.mrp_file or in_workbook, args.mrp_sheet, files),
+        profile=profile,
+    )
+    path = publish(bom_df, father_df, mrp_df, cols, args.dir, {"workbook": os.path.basename(args.workbook)}, profile)
+    print(f"✅ نسخة منشورة: {path}")
+    for stage in profile["stages"]:
+        print(f"  {stage['stage']}: {stage['seconds']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
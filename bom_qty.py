@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Quantity-variance analytics
+# - لكل (Parent, Component): أقل / أعلى / متوسط / انحراف معياري / معامل اختلاف (CV) للكمية
+#   على الأبناء اللي بيستخدموا المكوّن + عدد الكميات المختلفة + الأبناء الشاذين
+# - كله بيتحسب في مرور واحد مترتب (sort + bincount) على خلايا الكميات الطويلة،
+#   مش من أعمدة الأبناء في الجدول العريض
+# - ترتيب "تفاوت الكميات": CV ثم عدد الشواذ ثم Deviation
+# ==============================================================================
+import numpy as np
+import pandas as pd
+
+# أعمدة إحصائيات الكمية (بالترتيب) على مستوى المكوّن
+QTY_COLUMNS = ["Qty_Min", "Qty_Max", "Qty_Mean", "Qty_Std", "Qty_CV", "Qty_Distinct", "Qty_Outliers"]
+# أعمدة شيت Qty_Variance
+QTY_VARIANCE_COLUMNS = [
+    "Parent", "Component", "Component Description", "Num_Children_with_Component", "Deviation",
+    *QTY_COLUMNS, "Qty_Outlier_Children",
+]
+
+# الابن شاذ لو كميته بعيدة عن الوسيط أكتر من OUTLIER_MAD x MAD (مقياس robust)؛
+# لو MAD = 0 (أغلب الأبناء بنفس الكمية) أي كمية مختلفة عن الوسيط تعتبر شاذة
+OUTLIER_MAD = 3.0
+_MAD_SCALE = 1.4826
+
+
+def _group_median(values, starts, count):
+    # values مترتبة جوه كل مجموعة؛ الوسيط = متوسط العنصرين اللي في النص
+    median = np.full(len(count), np.nan)
+    has = count > 0
+    lo = starts[has] + (count[has] - 1) // 2
+    hi = starts[has] + count[has] // 2
+    median[has] = (values[lo] + values[hi]) / 2
+    return median
+
+
+def qty_stats(comp_row, qty, n):
+    """
+    إحصائيات الكمية لكل صف مكوّن (0..n-1) من الخلايا الطويلة (comp_row / qty).
+    الأبناء اللي بيستخدموا المكوّن بس (qty > 0، زي Num_Children_with_Component) هم اللي بيدخلوا.
+    بترجع (DataFrame بأعمدة QTY_COLUMNS بطول n، ماسك الخلايا الشاذة بطول الخلايا).
+    مكوّن مفيش ابن بيستخدمه = NaN في الإحصائيات و 0 في العدادات.
+    """
+    comp_row = np.asarray(comp_row, dtype=np.int64)
+    qty = np.asarray(qty, dtype=np.float64)
+    used = np.flatnonzero(qty > 0)
+    order = used[np.lexsort((qty[used], comp_row[used]))]
+    g, q = comp_row[order], qty[order]
+
+    count = np.bincount(g, minlength=n)
+    starts = np.concatenate(([0], np.cumsum(count)[:-1])).astype(np.int64)
+    has = count > 0
+    q_min, q_max = np.full(n, np.nan), np.full(n, np.nan)
+    q_min[has] = q[starts[has]]
+    q_max[has] = q[starts[has] + count[has] - 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(g, weights=q, minlength=n) / count
+        std = np.sqrt(np.bincount(g, weights=(q - mean[g]) ** 2, minlength=n) / count)
+        cv = std / mean
+
+    # كمية جديدة = أول خلية في المجموعة أو كمية مختلفة عن اللي قبلها (الكميات مترتبة)
+    new = np.ones(len(q), dtype=bool)
+    new[1:] = (g[1:] != g[:-1]) | (q[1:] != q[:-1])
+    distinct = np.bincount(g[new], minlength=n)
+
+    median = _group_median(q, starts, count)
+    dev = np.abs(q - median[g])
+    mad = _group_median(dev[np.lexsort((dev, g))], starts, count)
+    outlier = dev > (OUTLIER_MAD * _MAD_SCALE * mad)[g]
+    cell_outlier = np.zeros(len(qty), dtype=bool)
+    cell_outlier[order[outlier]] = True
+
+    stats = pd.DataFrame({
+        "Qty_Min": q_min,
+        "Qty_Max": q_max,
+        "Qty_Mean": np.round(mean, 4),
+        "Qty_Std": np.round(std, 4),
+        "Qty_CV": np.round(cv, 4),
+        "Qty_Distinct": distinct.astype(np.int32),
+        "Qty_Outliers": np.bincount(g[outlier], minlength=n).astype(np.int32),
+    })
+    return stats, cell_outlier
+
+
+def outlier_children(comp_row, child_names, cell_outlier, rows):
+    """
+    أسماء الأبناء الشاذين لكل صف في rows (نص مفصول بفواصل، "" لو مفيش).
+    child_names: اسم الابن لكل خلية.
+    """
+    comp_row = np.asarray(comp_row)
+    keep = np.asarray(cell_outlier, dtype=bool) & np.isin(comp_row, rows)
+    if not keep.any():
+        return [""] * len(rows)
+    names = pd.Series(np.asarray(child_names, dtype=object)[keep]).groupby(comp_row[keep], sort=False).agg(", ".join)
+    return names.reindex(rows, fill_value="").tolist()
+
+
+def rank_qty_variance(df, n=None):
+    """
+    ترتيب "تفاوت الكميات": المكونات اللي ليها أكتر من كمية بس، بالـ CV ثم عدد الشواذ ثم Deviation (تنازلي).
+    """
+    ranked = df[df["Qty_Distinct"] > 1].sort_values(
+        ["Qty_CV", "Qty_Outliers", "Deviation"], ascending=False, kind="stable"
+    )
+    if n is not None:
+        ranked = ranked.head(n)
+    return ranked.reset_index(drop=True)
+
+
+def part_qty_variance(engine, part):
+    """
+    صفوف شيت Qty_Variance لـ Parent واحد من نتيجة analyze_parent_long (للتشغيل streaming من غير store).
+    بترجع المكونات اللي كمياتها مختلفة بس (غير مترتبة؛ الترتيب بـ rank_qty_variance على الكل).
+    """
+    comps = part["components"]
+    stats, cell_outlier = qty_stats(part["cell_comp"], part["cell_qty"], len(comps))
+    rows = np.flatnonzero(stats["Qty_Distinct"].to_numpy() > 1)
+    if len(rows) == 0:
+        return pd.DataFrame(columns=QTY_VARIANCE_COLUMNS)
+    counts = np.asarray(part["counts"])[rows]
+    child_names = np.asarray(part["child_names"], dtype=object)
+    frame = pd.DataFrame({
+        "Parent": part["parent"],
+        "Component": engine["materials"][comps[rows]],
+        "Component Description": engine["desc"][comps[rows]],
+        "Num_Children_with_Component": counts,
+        "Deviation": np.abs(counts - len(part["child_names"])),
+    })
+    frame = pd.concat([frame, stats.iloc[rows].reset_index(drop=True)], axis=1)
+    frame["Qty_Outlier_Children"] = outlier_children(part["cell_comp"], child_names[part["cell_child"]],
+                                                     cell_outlier, rows)
+    return frame[QTY_VARIANCE_COLUMNS]
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Long-format result store
+# - النتائج بتتخزن "طويلة": سطر لكل (Parent, Component) + سطر لكل خلية كمية موجودة
+#   بدل all_merged_df العريض (عمود لكل ابن في كل الـ Parents وأغلبه NaN)
+# - الأكواد أرقام int32 بتشاور على materials، والكميات بأصغر نوع رقمي من غير فقد
+# - الجدول العريض لأي Parent بيتبني وقت العرض/التصدير بس
+# - إحصائيات الكمية لكل مكوّن (bom_qty) بتتحسب عند الطلب بس (مرة لكل store) في مرور واحد على الخلايا
+# ==============================================================================
+import numpy as np
+import pandas as pd
+
+from bom_engine import component_mask, parent_wide
+from bom_qty import QTY_COLUMNS, outlier_children, qty_stats, rank_qty_variance
+
+# أعمدة Summary_Report
+SUMMARY_COLUMNS = ["Parent_Code", "Num_Children", "Total_Components", "Shared_Components", "Shared_Components_%"]
+
+
+def _compact_qty(values):
+    # float32 لو مفيش أي فقد في القيم، وإلا نسيب النوع الأصلي
+    if values.dtype == np.float64:
+        small = values.astype(np.float32)
+        if np.array_equal(small.astype(np.float64), values, equal_nan=True):
+            return small
+    elif values.dtype.kind == "i" and len(values):
+        return pd.to_numeric(pd.Series(values), downcast="integer").to_numpy()
+    return values
+
+
+def build_result_store(engine, parts, comp_mask=None):
+    """
+    تجميع نتائج الـ Parents (من analyze_parent_long) في store واحد:
+    - components: Parent / Component / Total_Children / Num / Usage_% / Deviation
+    - children: الأبناء لكل Parent بالترتيب
+    - cells: comp_row / child_row (أرقام صفوف في الجدولين اللي فوق) + qty
+    - index: parent -> (بداية/نهاية) كل جدول عشان نرجّع الجدول العريض فورًا
+    - num_children: parent -> عدد الأبناء لكل الـ Parents (حتى اللي مالهمش مكونات، للملخص)
+    - comp_mask: ماسك فلاتر المكونات اللي اتحلل بيها (None = من غير فلترة)
+    الـ Parents اللي مالهمش مكونات (بعد الفلترة) مش بيتخزنوا، زي all_parents_rows الأصلي.
+    """
+    n = len(engine["materials"])
+    extra_children = {}
+    comp_parts, child_parts, cell_parts = [], [], []
+    index, num_children = {}, {}
+    comp_offset = child_offset = cell_offset = 0
+
+    for part in parts:
+        num_children[part["parent"]] = len(part["child_names"])
+        comps = part["components"]
+        if len(comps) == 0:
+            continue
+        parent_code = engine["materials"].get_indexer([part["parent"]])[0]
+        k, m, c = len(part["children"]), len(comps), len(part["cell_qty"])
+
+        # أبناء مش موجودين في المحرك بياخدوا أكواد بعد آخر مادة (عشان نقدر نرجّع أسماءهم)
+        child_codes = np.asarray(part["children"], dtype=np.int64).copy()
+        for i in np.flatnonzero(child_codes < 0):
+            name = part["child_names"][i]
+            child_codes[i] = extra_children.setdefault(name, n + len(extra_children))
+
+        comp_parts.append((np.full(m, parent_code), comps, np.full(m, k), part["counts"], part["usage"]))
+        child_parts.append((np.full(k, parent_code), child_codes))
+        cell_parts.append((part["cell_comp"] + comp_offset, part["cell_child"] + child_offset, part["cell_qty"]))
+        index[part["parent"]] = (comp_offset, comp_offset + m, child_offset, child_offset + k,
+                                 cell_offset, cell_offset + c)
+        comp_offset, child_offset, cell_offset = comp_offset + m, child_offset + k, cell_offset + c
+
+    def _cat(chunks, i, dtype):
+        if not chunks:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([chunk[i] for chunk in chunks]).astype(dtype, copy=False)
+
+    counts = _cat(comp_parts, 3, np.int32)
+    totals = _cat(comp_parts, 2, np.int32)
+    components = pd.DataFrame({
+        "parent": _cat(comp_parts, 0, np.int32),
+        "component": _cat(comp_parts, 1, np.int32),
+        "Total_Children": totals,
+        "Num_Children_with_Component": counts,
+        "Usage_%": _cat(comp_parts, 4, np.float64),
+        "Deviation": np.abs(counts - totals).astype(np.int32),
+    })
+    children = pd.DataFrame({
+        "parent": _cat(child_parts, 0, np.int32),
+        "child": _cat(child_parts, 1, np.int32),
+    })
+    qty_dtype = engine["matrix"].dtype
+    cells = pd.DataFrame({
+        "comp_row": _cat(cell_parts, 0, np.int32),
+        "child_row": _cat(cell_parts, 1, np.int32),
+        "qty": _compact_qty(_cat(cell_parts, 2, qty_dtype)),
+    })
+    return {
+        "engine": engine,
+        "names": engine["materials"].append(pd.Index(list(extra_children), dtype=object)),
+        "components": components,
+        "children": children,
+        "cells": cells,
+        "index": index,
+        "num_children": num_children,
+        "comp_mask": comp_mask,
+    }
+
+
+def filter_store(store, parents=None, selected_order_types=None, selected_mrp_controllers=None):
+    """
+    تطبيق الفلاتر على store محسوب من غير فلاتر (بدون إعادة التحليل):
+    - parents: الـ Parents المختارين وبنفس ترتيب الاختيار (None = الكل)
+    - Order Type / MRP Controller: ماسك على أكواد المكونات (نفس component_mask)
+    النتيجة store بنفس الشكل، فكل دوال العرض والتصدير شغالة عليه زي ما هي.
+    عدد الأبناء و Usage_% لكل مكوّن مش بيتأثروا بفلترة المكونات التانية، فالنتيجة
+    مطابقة لتحليل كامل بنفس الفلاتر.
+    """
+    engine = store["engine"]
+    comps, cells = store["components"], store["cells"]
+    mask = component_mask(engine, selected_order_types, selected_mrp_controllers)
+    if store.get("comp_mask") is not None:
+        mask &= store["comp_mask"]
+    comp_ok = mask[comps["component"].to_numpy()]
+    cell_comp = cells["comp_row"].to_numpy()
+
+    order = list(store["index"]) if parents is None else [p for p in dict.fromkeys(parents) if p in store["index"]]
+    comp_map = np.full(len(comps), -1, dtype=np.int64)
+    child_map = np.full(len(store["children"]), -1, dtype=np.int64)
+    comp_rows, child_rows, cell_rows, index = [], [], [], {}
+    c_off = k_off = x_off = 0
+    for parent in order:
+        c0, c1, k0, k1, x0, x1 = store["index"][parent]
+        rows = c0 + np.flatnonzero(comp_ok[c0:c1])
+        if len(rows) == 0:
+            continue
+        kept_cells = x0 + np.flatnonzero(comp_ok[cell_comp[x0:x1]])
+        comp_map[rows] = np.arange(c_off, c_off + len(rows))
+        child_map[k0:k1] = np.arange(k_off, k_off + (k1 - k0))
+        comp_rows.append(rows)
+        child_rows.append(np.arange(k0, k1))
+        cell_rows.append(kept_cells)
+        index[parent] = (c_off, c_off + len(rows), k_off, k_off + (k1 - k0), x_off, x_off + len(kept_cells))
+        c_off, k_off, x_off = c_off + len(rows), k_off + (k1 - k0), x_off + len(kept_cells)
+
+    def _take(df, chunks):
+        rows = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+        return df.iloc[rows].reset_index(drop=True)
+
+    new_cells = _take(cells, cell_rows)
+    new_cells["comp_row"] = comp_map[new_cells["comp_row"].to_numpy()].astype(np.int32)
+    new_cells["child_row"] = child_map[new_cells["child_row"].to_numpy()].astype(np.int32)
+    selected = store["num_children"] if parents is None else {
+        p: store["num_children"][p] for p in dict.fromkeys(parents) if p in store["num_children"]
+    }
+    return dict(
+        store,
+        components=_take(comps, comp_rows),
+        children=_take(store["children"], child_rows),
+        cells=new_cells,
+        index=index,
+        num_children=selected,
+        comp_mask=mask,
+        qty=None,
+        # رقم كل صف مكوّن في الـ store الأصلي (للـ views في bom_db)
+        source_rows=np.concatenate(comp_rows) if comp_rows else np.empty(0, dtype=np.int64),
+    )
+
+
+def summary_row(parent, total_children, counts):
+    """
+    سطر الملخص لـ Parent واحد (نفس أعمدة Summary_Report).
+    counts: Num_Children_with_Component لكل مكوّن من مكونات الـ Parent.
+    """
+    total_comps = int(len(counts))
+    shared_comps = int((np.asarray(counts) > 0).sum()) if total_comps > 0 else 0
+    similarity_pct = round(shared_comps / total_comps * 100, 2) if total_comps > 0 else 0.0
+    return {
+        "Parent_Code": parent,
+        "Num_Children": total_children,
+        "Total_Components": total_comps,
+        "Shared_Components": shared_comps,
+        "Shared_Components_%": similarity_pct
+    }
+
+
+def store_summary(store):
+    """
+    Summary_Report من الـ store: سطر لكل Parent (بترتيب num_children) حتى لو مالوش مكونات.
+    """
+    counts = store["components"]["Num_Children_with_Component"].to_numpy()
+    summary_list = []
+    for parent, total_children in store["num_children"].items():
+        c0, c1 = store["index"][parent][:2] if parent in store["index"] else (0, 0)
+        summary_list.append(summary_row(parent, total_children, counts[c0:c1]))
+    return pd.DataFrame(summary_list, columns=SUMMARY_COLUMNS)
+
+
+def store_parents(store):
+    """
+    الـ Parents المخزنين بالترتيب (اللي ليهم مكونات).
+    """
+    return list(store["index"])
+
+
+def store_parent_wide(store, parent):
+    """
+    الجدول العريض لـ Parent واحد (نفس parent_df في الكود الأصلي) من الـ store.
+    """
+    if parent not in store["index"]:
+        return pd.DataFrame()
+    c0, c1, k0, k1, x0, x1 = store["index"][parent]
+    cells = store["cells"].iloc[x0:x1]
+    child_codes = store["children"]["child"].to_numpy()[k0:k1]
+    engine = store["engine"]
+    part = {
+        "child_names": store["names"][child_codes].tolist(),
+        "components": store["components"]["component"].to_numpy()[c0:c1].astype(np.int64),
+        "counts": store["components"]["Num_Children_with_Component"].to_numpy()[c0:c1].astype(np.int64),
+        "usage": store["components"]["Usage_%"].to_numpy()[c0:c1],
+        "cell_comp": cells["comp_row"].to_numpy() - c0,
+        "cell_child": cells["child_row"].to_numpy() - k0,
+        "cell_qty": cells["qty"].to_numpy().astype(engine["matrix"].dtype),
+    }
+    return parent_wide(engine, part)
+
+
+def store_qty_stats(store):
+    """
+    إحصائيات الكمية (QTY_COLUMNS) لكل صف مكوّن + ماسك الخلايا الشاذة، من مرور واحد على خلايا الـ store.
+    بتتحسب أول مرة تتطلب بس وبتتحفظ في store["qty"] (filter_store بيرجّع store من غيرها).
+    """
+    if store.get("qty") is None:
+        cells = store["cells"]
+        store["qty"] = qty_stats(cells["comp_row"].to_numpy(), cells["qty"].to_numpy(), len(store["components"]))
+    return store["qty"]
+
+
+def store_outlier_children(store, rows):
+    """
+    أسماء الأبناء الشاذين (بالكمية) للصفوف rows بس.
+    """
+    rows = np.asarray(rows)
+    _, cell_outlier = store_qty_stats(store)
+    outliers = np.flatnonzero(cell_outlier)
+    comp_row = store["cells"]["comp_row"].to_numpy()[outliers]
+    outliers = outliers[np.isin(comp_row, rows)]
+    child_codes = store["children"]["child"].to_numpy()[store["cells"]["child_row"].to_numpy()[outliers]]
+    return outlier_children(store["cells"]["comp_row"].to_numpy()[outliers], store["names"][child_codes],
+                            np.ones(len(outliers), dtype=bool), rows)
+
+
+def store_component_view(store, rows=None, qty=False):
+    """
+    جدول على مستوى المكوّن (سطر لكل Parent x Component) بأكواد categorical.
+    rows: أرقام صفوف لو عايزين جزء بس (الفلترة والترتيب بيتعملوا على الأكواد قبل البناء).
+    qty=True => + أعمدة إحصائيات الكمية (QTY_COLUMNS، من غير أسماء الشواذ؛ شوف store_outlier_children).
+    """
+    engine = store["engine"]
+    comp = store["components"] if rows is None else store["components"].iloc[rows]
+    names = engine["materials"]
+    comp_codes = comp["component"].to_numpy()
+    view = pd.DataFrame({
+        "Parent": pd.Categorical.from_codes(comp["parent"].to_numpy(), categories=names, validate=False),
+        "Component": pd.Categorical.from_codes(comp_codes, categories=names, validate=False),
+        "Component Description": engine["desc"][comp_codes],
+        "Total_Children": comp["Total_Children"].to_numpy(),
+        "Num_Children_with_Component": comp["Num_Children_with_Component"].to_numpy(),
+        "Usage_%": comp["Usage_%"].to_numpy(),
+        "Deviation": comp["Deviation"].to_numpy(),
+        "MRP_Controller": engine["controller"][comp_codes],
+        "Order_Type": engine["order_type"][comp_codes],
+    })
+    if qty:
+        stats, _ = store_qty_stats(store)
+        stats = stats if rows is None else stats.iloc[rows]
+        for col in QTY_COLUMNS:
+            view[col] = stats[col].to_numpy()
+    return view
+
+
+def top_deviation(store, n=10):
+    """
+    أعلى n مكونات انحرافًا على مستوى كل الـ Parents (بديل top10_global).
+    """
+    order = store["components"]["Deviation"].sort_values(ascending=False, kind="stable").index[:n]
+    return store_component_view(store, order.to_numpy())
+
+
+def low_shared(store, limit=None):
+    """
+    المكونات اللي Usage_% بتاعها أقل من 100 مرتبة تصاعديًا (بديل Low_Shared من all_merged_df).
+    """
+    usage = store["components"]["Usage_%"]
+    order = usage[usage < 100].sort_values(kind="stable").index
+    if limit is not None:
+        order = order[:limit]
+    return store_component_view(store, order.to_numpy())
+
+
+def top_qty_variance(store, n=10):
+    """
+    ترتيب Deviation بالكميات: المكونات اللي كمياتها مختلفة بين الأبناء، بالـ CV ثم عدد الشواذ ثم Deviation
+    (n=None => الكل، ده شيت Qty_Variance في التقرير).
+    """
+    stats, _ = store_qty_stats(store)
+    ranked = rank_qty_variance(stats[["Qty_Distinct", "Qty_CV", "Qty_Outliers"]].assign(
+        Deviation=store["components"]["Deviation"].to_numpy(), row=np.arange(len(stats))), n)
+    rows = ranked["row"].to_numpy()
+    view = store_component_view(store, rows, qty=True)
+    view["Qty_Outlier_Children"] = store_outlier_children(store, rows)
+    return view
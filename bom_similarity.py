@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Child-to-child similarity + near-duplicate children
+# - تشابه أبناء كل Parent مع بعض: Jaccard على المكونات + Jaccard بالكميات (sum min / sum max)
+# - الأبناء المتكررين تقريبًا على مستوى كل الـ Parents: MinHash + LSH banding
+#   (المقارنة الكاملة بتتعمل على الأزواج المرشحة بس، مش كل الأزواج)
+# ==============================================================================
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# أعمدة شيت Child_Similarity (أقرب أخ لكل ابن)
+SIBLING_COLUMNS = ["Parent", "Child", "Most_Similar_Child", "Jaccard_%", "Weighted_%", "Shared_Components"]
+# أعمدة شيت Near_Duplicate_Children
+NEAR_DUPLICATE_COLUMNS = [
+    "Child_A", "Child_B", "Jaccard_%", "Weighted_%", "Shared_Components",
+    "Components_A", "Components_B", "Parents_A", "Parents_B",
+]
+
+# حد التشابه الافتراضي (Jaccard %) للأبناء المتكررين تقريبًا
+NEAR_DUPLICATE_THRESHOLD = 80.0
+
+# معامل الـ hash في MinHash (عدد أولي أكبر من أي كود مادة)
+_PRIME = (1 << 31) - 1
+
+
+def child_rows(engine, children, comp_mask=None):
+    """
+    مصفوفة sparse (ابن x مكوّن) فيها الكميات الموجبة بس بعد فلاتر المكونات.
+    ابن مالوش BOM (أو مش موجود في المحرك) = صف فاضي.
+    """
+    child_ids = engine["materials"].get_indexer([str(c) for c in children])
+    known = child_ids >= 0
+    rows = sparse.csr_matrix((len(child_ids), engine["matrix"].shape[1]), dtype=engine["matrix"].dtype)
+    if known.any():
+        block = engine["matrix"][child_ids[known]].tocoo()
+        keep = block.data > 0
+        if comp_mask is not None:
+            keep &= comp_mask[block.col]
+        rows = sparse.csr_matrix(
+            (block.data[keep], (np.flatnonzero(known)[block.row[keep]], block.col[keep])), shape=rows.shape
+        )
+    return rows
+
+
+def _percent(num, den):
+    # نسبة مئوية بتقريب رقمين (زي Usage_%)، والقسمة على صفر = 0
+    out = np.zeros(np.broadcast(num, den).shape, dtype=np.float64)
+    np.divide(num, den, out=out, where=den > 0)
+    return np.round(out * 100, 2)
+
+
+def similarity_matrices(rows):
+    """
+    مصفوفتين (k x k) بنسب مئوية بين صفوف rows:
+    - jaccard: المكونات المشتركة / كل المكونات في الاتنين
+    - weighted: مجموع أقل كمية / مجموع أكبر كمية لكل مكوّن (لو مفيش كميات = jaccard)
+    + shared: عدد المكونات المشتركة
+    """
+    binary = (rows > 0).astype(np.int64)
+    shared = (binary @ binary.T).toarray()
+    sizes = np.asarray(binary.sum(axis=1)).ravel()
+    jaccard = _percent(shared, sizes[:, None] + sizes[None, :] - shared)
+
+    # الكميات على المكونات اللي ظاهرة في أي ابن بس (عشان الـ dense يبقى صغير)
+    used = np.unique(rows.indices)
+    dense = rows[:, used].toarray().astype(np.float64)
+    low = np.empty_like(shared, dtype=np.float64)
+    high = np.empty_like(shared, dtype=np.float64)
+    for i in range(dense.shape[0]):
+        low[i] = np.minimum(dense[i], dense).sum(axis=1)
+        high[i] = np.maximum(dense[i], dense).sum(axis=1)
+    weighted = _percent(low, high)
+    return jaccard, weighted, shared
+
+
+def child_similarity(engine, children, comp_mask=None):
+    """
+    مصفوفات تشابه أبناء Parent واحد كجداول (الصفوف والأعمدة = أكواد الأبناء):
+    بترجع (jaccard_df, weighted_df).
+    """
+    children = [str(c) for c in children]
+    jaccard, weighted, _ = similarity_matrices(child_rows(engine, children, comp_mask))
+    return (pd.DataFrame(jaccard, index=children, columns=children),
+            pd.DataFrame(weighted, index=children, columns=children))
+
+
+def nearest_siblings(engine, parent, children, comp_mask=None):
+    """
+    أقرب أخ لكل ابن في نفس الـ Parent (أعلى Jaccard ثم أعلى Weighted).
+    """
+    children = [str(c) for c in children]
+    if not children:
+        return pd.DataFrame(columns=SIBLING_COLUMNS)
+    jaccard, weighted, shared = similarity_matrices(child_rows(engine, children, comp_mask))
+    k = len(children)
+    if k == 1:
+        return pd.DataFrame([[parent, children[0], None, 0.0, 0.0, 0]], columns=SIBLING_COLUMNS)
+    # أعلى Jaccard وعند التساوي أعلى Weighted (النسب بتقريب رقمين فالمفتاح ده بيحافظ على الترتيب)
+    key = jaccard * 1e5 + weighted
+    np.fill_diagonal(key, -1)
+    best = key.argmax(axis=1)
+    own = np.arange(k)
+    return pd.DataFrame({
+        "Parent": parent,
+        "Child": children,
+        "Most_Similar_Child": [children[j] for j in best],
+        "Jaccard_%": jaccard[own, best],
+        "Weighted_%": weighted[own, best],
+        "Shared_Components": shared[own, best],
+    }, columns=SIBLING_COLUMNS)
+
+
+def minhash_signatures(rows, num_perm=128, seed=0):
+    """
+    توقيع MinHash لكل صف (num_perm قيمة): أقل hash لمكونات الصف تحت كل دالة hash.
+    احتمال تساوي قيمتين في نفس المكان = Jaccard بين الصفين.
+    الحساب على دفعات من دوال الـ hash عشان الذاكرة ما تكبرش مع عدد الخلايا.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, num_perm, dtype=np.int64)
+    b = rng.integers(0, _PRIME, num_perm, dtype=np.int64)
+    rows = rows.tocsr()
+    n_rows = rows.shape[0]
+    signatures = np.full((n_rows, num_perm), _PRIME, dtype=np.int64)
+    nonempty = np.flatnonzero(np.diff(rows.indptr) > 0)
+    if len(nonempty) == 0:
+        return signatures
+    starts = rows.indptr[nonempty]
+    step = max(1, 1_000_000 // max(len(rows.indices), 1))
+    for p0 in range(0, num_perm, step):
+        p1 = min(num_perm, p0 + step)
+        hashed = (a[p0:p1, None] * rows.indices[None, :] + b[p0:p1, None]) % _PRIME
+        signatures[nonempty, p0:p1] = np.minimum.reduceat(hashed, starts, axis=1).T
+    return signatures
+
+
+def lsh_pairs(signatures, bands=16, seed=0):
+    """
+    الأزواج المرشحة من LSH banding: التوقيع بيتقسم bands جزء، وأي صفين متطابقين في جزء كامل = مرشحين.
+    كل جزء بيتحول لمفتاح رقمي واحد، وبعد الترتيب الأزواج = صفوف متجاورة بنفس المفتاح.
+    بترجع مصفوفتين (i, j) مع i < j ومن غير تكرار.
+    """
+    n_rows, num_perm = signatures.shape
+    rows_per_band = max(1, num_perm // bands)
+    mult = np.random.default_rng(seed).integers(1, 1 << 62, rows_per_band, dtype=np.int64).astype(np.uint64) | 1
+    pairs = []
+    for start in range(0, rows_per_band * bands, rows_per_band):
+        band = signatures[:, start:start + rows_per_band].astype(np.uint64)
+        keys = (band * mult[:band.shape[1]]).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # مسافة d في الترتيب: لو مفيش ولا زوج بنفس المفتاح على بعد d يبقى مفيش على أبعد من كده
+        d = 1
+        while d < n_rows:
+            same = np.flatnonzero(sorted_keys[:-d] == sorted_keys[d:])
+            if len(same) == 0:
+                break
+            pairs.append(np.stack([order[same], order[same + d]], axis=1))
+            d += 1
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.sort(np.concatenate(pairs), axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def near_duplicates(engine, children, comp_mask=None, parents_of=None,
+                    threshold=NEAR_DUPLICATE_THRESHOLD, num_perm=128, bands=16, seed=0):
+    """
+    الأبناء المتشابهين جدًا (Jaccard >= threshold %) على مستوى كل الـ Parents.
+    - MinHash + LSH بيطلّعوا أزواج مرشحة، وبعدين Jaccard / Weighted الحقيقيين بيتحسبوا ليهم بس
+    - parents_of: قاموس ابن -> Parents بتوعه (لعرضهم في التقرير)
+    الأبناء اللي مالهمش مكونات مش بيدخلوا المقارنة.
+    """
+    children = list(dict.fromkeys(str(c) for c in children))
+    rows = child_rows(engine, children, comp_mask)
+    nonempty = np.flatnonzero(np.diff(rows.indptr) > 0)
+    rows = rows[nonempty]
+    if rows.shape[0] < 2:
+        return pd.DataFrame(columns=NEAR_DUPLICATE_COLUMNS)
+
+    left, right = lsh_pairs(minhash_signatures(rows, num_perm, seed), bands, seed)
+    if len(left) == 0:
+        return pd.DataFrame(columns=NEAR_DUPLICATE_COLUMNS)
+
+    # التحقق الفعلي على الأزواج المرشحة (عمليات sparse على الصفين بس)
+    binary = (rows > 0).astype(np.int64)
+    sizes = np.asarray(binary.sum(axis=1)).ravel()
+    shared = np.asarray(binary[left].multiply(binary[right]).sum(axis=1)).ravel()
+    jaccard = _percent(shared, sizes[left] + sizes[right] - shared)
+    low = np.asarray(rows[left].minimum(rows[right]).sum(axis=1), dtype=np.float64).ravel()
+    high = np.asarray(rows[left].maximum(rows[right]).sum(axis=1), dtype=np.float64).ravel()
+    weighted = _percent(low, high)
+
+    keep = jaccard >= threshold
+    names = np.asarray(children, dtype=object)[nonempty]
+    parents_of = parents_of or {}
+    result = pd.DataFrame({
+        "Child_A": names[left[keep]],
+        "Child_B": names[right[keep]],
+        "Jaccard_%": jaccard[keep],
+        "Weighted_%": weighted[keep],
+        "Shared_Components": shared[keep],
+        "Components_A": sizes[left[keep]],
+        "Components_B": sizes[right[keep]],
+    })
+    result["Parents_A"] = [", ".join(parents_of.get(c, [])) for c in result["Child_A"]]
+    result["Parents_B"] = [", ".join(parents_of.get(c, [])) for c in result["Child_B"]]
+    return result.sort_values(["Jaccard_%", "Weighted_%"], ascending=False, kind="stable").reset_index(drop=True)
+
+
+def store_children(store, parent):
+    """
+    أكواد أبناء Parent من الـ store بالترتيب.
+    """
+    if parent not in store["index"]:
+        return []
+    k0, k1 = store["index"][parent][2:4]
+    return store["names"][store["children"]["child"].to_numpy()[k0:k1]].tolist()
+
+
+def store_parents_of(store):
+    """
+    قاموس ابن -> Parents اللي هو تحتهم (من الـ store بعد الفلاتر).
+    """
+    parents_of = {}
+    for parent in store["index"]:
+        for child in store_children(store, parent):
+            parents_of.setdefault(child, []).append(parent)
+    return parents_of
+
+
+def store_child_similarity(store, parent):
+    return child_similarity(store["engine"], store_children(store, parent), store.get("comp_mask"))
+
+
+def store_nearest_siblings(store):
+    """
+    شيت Child_Similarity: أقرب أخ لكل ابن في كل الـ Parents.
+    """
+    frames = [
+        nearest_siblings(store["engine"], parent, store_children(store, parent), store.get("comp_mask"))
+        for parent in store["index"]
+    ]
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=SIBLING_COLUMNS)
+
+
+def store_near_duplicates(store, threshold=NEAR_DUPLICATE_THRESHOLD):
+    parents_of = store_parents_of(store)
+    return near_duplicates(store["engine"], list(parents_of), store.get("comp_mask"), parents_of, threshold)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Snapshots (diff mode)
+# - fingerprint لكل Parent من مدخلاته: قايمة الأبناء (father) + سطور الـ BOM للـ Parent وأبناءه
+#   + بيانات MRP/الوصف لمكوناته + ماسك الفلاتر
+# - نتايج كل Parent بتتحفظ في snapshot (Parquet بأسماء الأكواد، مش أرقام المحرك)
+# - التشغيل الجاي بيرجّع نتيجة أي Parent الـ fingerprint بتاعه ما اتغيرش، ويحلل المتغيرين بس
+# - تقرير التغييرات بين snapshotين: مكونات اتضافت/اتشالت + فرق Usage_% و Deviation
+# ==============================================================================
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bom_engine import parent_components
+from bom_ingest import CACHE_DIR
+
+# مكان الـ snapshots (ممكن يتغير من متغير البيئة BOM_SNAPSHOT_DIR)
+SNAPSHOT_DIR = os.environ.get("BOM_SNAPSHOT_DIR", os.path.join(CACHE_DIR, "snapshots"))
+
+# عدد الـ snapshots اللي بنحتفظ بيها (الأقدم بيتمسح)
+KEEP_SNAPSHOTS = 8
+
+# أعمدة تقرير التغييرات
+CHANGE_COLUMNS = [
+    "Parent", "Component", "Change", "Usage_%_Old", "Usage_%_New", "Usage_%_Delta",
+    "Deviation_Old", "Deviation_New", "Deviation_Delta",
+]
+
+_TABLES = ("parents", "components", "children", "cells")
+
+
+def parent_fingerprints(context, parents):
+    """
+    parent -> fingerprint (sha1) لكل المدخلات اللي نتيجة الـ Parent بتعتمد عليها.
+    سطر الـ BOM لكل مادة بيتعمله hash مرة واحدة (الابن ممكن يكون تحت أكتر من Parent).
+    """
+    engine, children_index, comp_mask = context["engine"], context["children_index"], context["comp_mask"]
+    names = engine["materials"].to_numpy(dtype=object)
+    matrix = engine["matrix"] if engine["matrix"].has_sorted_indices else engine["matrix"].sorted_indices()
+    order_ptr, order_idx = engine["order_ptr"], engine["order_idx"]
+    row_hashes = {}
+
+    def row_hash(code):
+        # ترتيب المكونات (بيحدد ترتيب العرض) + الخلايا بالكميات
+        if code < 0:
+            return b"-"
+        if code not in row_hashes:
+            start, end = matrix.indptr[code], matrix.indptr[code + 1]
+            digest = hashlib.sha1("\x1f".join(names[order_idx[order_ptr[code]:order_ptr[code + 1]]]).encode("utf-8"))
+            digest.update(b"\x1e" + "\x1f".join(names[matrix.indices[start:end]]).encode("utf-8"))
+            digest.update(matrix.data[start:end].tobytes())
+            row_hashes[code] = digest.digest()
+        return row_hashes[code]
+
+    fingerprints = {}
+    for parent in parents:
+        parent = str(parent).strip()
+        children = list(children_index.get(parent, []))
+        comps = parent_components(engine, parent)
+        digest = hashlib.sha1(json.dumps([parent, children, engine["has_qty"], str(matrix.dtype)]).encode("utf-8"))
+        for code in engine["materials"].get_indexer([parent] + children):
+            digest.update(row_hash(code))
+        digest.update(comp_mask[comps].tobytes())
+        for values in (engine["desc"], engine["controller"], engine["order_type"]):
+            digest.update(b"\x1e" + "\x1f".join(map(str, values[comps])).encode("utf-8"))
+        fingerprints[parent] = digest.hexdigest()
+    return fingerprints
+
+
+def snapshot_frames(engine, parts, fingerprints):
+    """
+    جداول الـ snapshot من نتايج الـ Parents (الأكواد كنصوص عشان تفضل صالحة مع أي ملف تاني).
+    """
+    names = engine["materials"].to_numpy(dtype=object)
+    parent_rows, comp_parts, child_parts, cell_parts = [], [], [], []
+    for part in parts:
+        parent, k, m = part["parent"], len(part["child_names"]), len(part["components"])
+        parent_rows.append((parent, fingerprints[parent], k))
+        comp_parts.append((np.full(m, parent, dtype=object), names[part["components"]], part["counts"],
+                           part["usage"], np.abs(part["counts"] - k)))
+        child_parts.append((np.full(k, parent, dtype=object), np.asarray(part["child_names"], dtype=object)))
+        cell_parts.append((np.full(len(part["cell_qty"]), parent, dtype=object), part["cell_child"],
+                           part["cell_comp"], part["cell_qty"]))
+
+    def _cat(chunks, i, dtype):
+        if not chunks:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([chunk[i] for chunk in chunks]).astype(dtype, copy=False)
+
+    return {
+        "parents": pd.DataFrame(parent_rows, columns=["Parent", "Fingerprint", "Num_Children"]),
+        "components": pd.DataFrame({
+            "Parent": _cat(comp_parts, 0, object),
+            "Component": _cat(comp_parts, 1, object),
+            "Num_Children_with_Component": _cat(comp_parts, 2, np.int64),
+            "Usage_%": _cat(comp_parts, 3, np.float64),
+            "Deviation": _cat(comp_parts, 4, np.int64),
+        }),
+        "children": pd.DataFrame({"Parent": _cat(child_parts, 0, object), "Child": _cat(child_parts, 1, object)}),
+        "cells": pd.DataFrame({
+            "Parent": _cat(cell_parts, 0, object),
+            "Child_Pos": _cat(cell_parts, 1, np.int64),
+            "Comp_Pos": _cat(cell_parts, 2, np.int64),
+            "Qty": _cat(cell_parts, 3, engine["matrix"].dtype),
+        }),
+    }
+
+
+def snapshot_key(explode=None, order_types=None, mrp_controllers=None, sheets=None):
+    """
+    مفتاح المقارنة: الـ snapshot القديم لازم يكون بنفس طريقة التفجير ونفس فلاتر المكونات ونفس الشيتات
+    (من غير فلترة = None). الملف نفسه مش جزء من المفتاح عن قصد: المقارنة الأسبوعية بين ملف الأسبوع ده
+    وملف الأسبوع اللي فات (أسماء ومحتوى مختلفين) هي الاستخدام الأساسي.
+    """
+    return {
+        "explode": explode,
+        "order_types": sorted(map(str, order_types)) if order_types else None,
+        "mrp_controllers": sorted(map(str, mrp_controllers)) if mrp_controllers else None,
+        "sheets": list(sheets) if sheets else None,
+    }
+
+
+def save_snapshot(engine, parts, fingerprints, root=None, meta=None, keep=KEEP_SNAPSHOTS, key=None):
+    """
+    كتابة snapshot جديد في root (مجلد لكل snapshot: Parquet لكل جدول + meta.json)
+    وبترجع الـ snapshot نفسه (نفس شكل load_snapshot) عشان تقرير التغييرات.
+    key (من snapshot_key) بيتحفظ في الـ meta عشان latest_snapshot يقارن بنفس الإعدادات بس.
+    المجلد بيتكتب باسم مؤقت وبعدين بيتنقل، فأي snapshot موجود يا كامل يا مش موجود.
+    """
+    root = root or SNAPSHOT_DIR
+    snapshot = snapshot_frames(engine, parts, fingerprints)
+    snapshot["meta"] = dict(meta or {}, key=key or snapshot_key(), created=datetime.now().isoformat(timespec="seconds"),
+                            parents=len(snapshot["parents"]))
+    name = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path, tmp_path = os.path.join(root, name), os.path.join(root, "." + name)
+    os.makedirs(tmp_path, exist_ok=True)
+    for table in _TABLES:
+        snapshot[table].to_parquet(os.path.join(tmp_path, table + ".parquet"), index=False)
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(snapshot["meta"], f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    snapshot["path"] = path
+    prune_snapshots(root, keep, snapshot["meta"]["key"])
+    return snapshot
+
+
+def list_snapshots(root=None, **match):
+    """
+    مسارات الـ snapshots (الأحدث الأول)؛ match => بس اللي الـ meta بتاعها فيها القيم دي (مثلًا key=snapshot_key(...)).
+    """
+    root = root or SNAPSHOT_DIR
+    if not os.path.isdir(root):
+        return []
+    paths = []
+    for name in sorted(os.listdir(root), reverse=True):
+        meta_path = os.path.join(root, name, "meta.json")
+        if name.startswith(".") or not os.path.exists(meta_path):
+            continue
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if all(meta.get(key) == value for key, value in match.items()):
+            paths.append(os.path.join(root, name))
+    return paths
+
+
+def latest_snapshot(root=None, **match):
+    paths = list_snapshots(root, **match)
+    return paths[0] if paths else None
+
+
+def load_snapshot(path):
+    snapshot = {table: pd.read_parquet(os.path.join(path, table + ".parquet")) for table in _TABLES}
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        snapshot["meta"] = json.load(f)
+    snapshot["path"] = path
+    return snapshot
+
+
+def prune_snapshots(root=None, keep=KEEP_SNAPSHOTS, key=None):
+    # بنحتفظ بآخر keep لكل مفتاح لوحده، فمفتاح بيتشغل كتير ما يمسحش الـ baseline الوحيد لمفتاح تاني
+    for path in list_snapshots(root, key=key or snapshot_key())[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def snapshot_changes(previous, current):
+    """
+    الـ Parents اللي اتضافت / اتشالت / اتغيرت مدخلاتها + عدد اللي زي ما هي.
+    """
+    old, new = fingerprint_map(previous), fingerprint_map(current)
+    return {
+        "added": [p for p in new if p not in old],
+        "removed": [p for p in old if p not in new],
+        "changed": [p for p in new if p in old and old[p] != new[p]],
+        "unchanged": sum(1 for p in new if old.get(p) == new[p]),
+    }
+
+
+def change_report(previous, current):
+    """
+    تقرير التغييرات على مستوى (Parent, Component) للـ Parents اللي اتغيرت أو اتضافت أو اتشالت:
+    Change = added / removed / changed (Usage_% أو Deviation اتغيروا). المكونات اللي ما اتغيرتش مش بتظهر.
+    """
+    changes = snapshot_changes(previous, current)
+    parents = set(changes["added"]) | set(changes["removed"]) | set(changes["changed"])
+    columns = ["Parent", "Component", "Usage_%", "Deviation"]
+    old = previous["components"].loc[previous["components"]["Parent"].isin(parents), columns]
+    new = current["components"].loc[current["components"]["Parent"].isin(parents), columns]
+    merged = old.merge(new, on=["Parent", "Component"], how="outer", suffixes=("_Old", "_New"),
+                       indicator=True, sort=False)
+    merged["Change"] = np.select(
+        [merged["_merge"] == "left_only", merged["_merge"] == "right_only"], ["removed", "added"], "changed"
+    )
+    merged["Usage_%_Delta"] = (merged["Usage_%_New"].fillna(0.0) - merged["Usage_%_Old"].fillna(0.0)).round(2)
+    for col in ("Deviation_Old", "Deviation_New"):
+        merged[col] = merged[col].astype("Int64")
+    merged["Deviation_Delta"] = merged["Deviation_New"].fillna(0) - merged["Deviation_Old"].fillna(0)
+    moved = (merged["Usage_%_Delta"] != 0) | (merged["Deviation_Delta"] != 0)
+    report = merged[(merged["Change"] != "changed") | moved]
+    return report.sort_values(["Parent", "Change"], kind="stable")[CHANGE_COLUMNS].reset_index(drop=True)
+
+
+def fingerprint_map(snapshot):
+    return dict(zip(snapshot["parents"]["Parent"], snapshot["parents"]["Fingerprint"]))
+
+
+def _slices(df):
+    # الجداول مكتوبة Parent ورا Parent، فكل Parent = slice واحد
+    values = df["Parent"].to_numpy()
+    if not len(values):
+        return {}
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+    return dict(zip(values[starts], zip(starts, ends)))
+
+
+def _restore_arrays(snapshot, engine):
+    # جداول الـ snapshot كمصفوفات بأرقام المحرك الحالي (بتتحسب مرة واحدة لكل محرك)
+    cached = snapshot.get("restore")
+    if cached is not None and cached[0] is engine["materials"]:
+        return cached[1]
+    comps, children, cells = snapshot["components"], snapshot["children"], snapshot["cells"]
+    arrays = {
+        "slices": {table: _slices(snapshot[table]) for table in ("components", "children", "cells")},
+        "components": engine["materials"].get_indexer(comps["Component"]),
+        "counts": comps["Num_Children_with_Component"].to_numpy(dtype=np.int64),
+        "usage": comps["Usage_%"].to_numpy(dtype=np.float64),
+        "child_names": children["Child"].to_numpy(dtype=object),
+        "children": engine["materials"].get_indexer(children["Child"]),
+        "cell_child": cells["Child_Pos"].to_numpy(dtype=np.int64),
+        "cell_comp": cells["Comp_Pos"].to_numpy(dtype=np.int64),
+        "cell_qty": cells["Qty"].to_numpy(dtype=engine["matrix"].dtype),
+    }
+    snapshot["restore"] = (engine["materials"], arrays)
+    return arrays
+
+
+def restore_part(snapshot, engine, parent):
+    """
+    نتيجة Parent من الـ snapshot بنفس شكل analyze_parent_long (الأكواد بتتحول لأرقام المحرك الحالي).
+    """
+    arrays = _restore_arrays(snapshot, engine)
+    c0, c1 = arrays["slices"]["components"].get(parent, (0, 0))
+    k0, k1 = arrays["slices"]["children"].get(parent, (0, 0))
+    x0, x1 = arrays["slices"]["cells"].get(parent, (0, 0))
+    return {
+        "parent": parent,
+        "child_names": arrays["child_names"][k0:k1].tolist(),
+        "children": arrays["children"][k0:k1],
+        "components": arrays["components"][c0:c1],
+        "counts": arrays["counts"][c0:c1],
+        "usage": arrays["usage"][c0:c1],
+        "cell_child": arrays["cell_child"][x0:x1],
+        "cell_comp": arrays["cell_comp"][x0:x1],
+        "cell_qty": arrays["cell_qty"][x0:x1],
+        "seconds": 0.0,
+        "reused": True,
+    }
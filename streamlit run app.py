@@ -3,29 +3,122 @@
 # MRP BOM Analysis - UI Enhanced & State-Preserving Version (with Child Qty Support)
 # Developed by: Reda Roshdy
 # ==============================================================================
+import os
+import time
+from contextlib import nullcontext
+
 import streamlit as st
 import pandas as pd
-from io import BytesIO
-
-def auto_detect(df, candidates):
-    # دالة بسيطة تحاول تختار أول اسم عمود مطابق من قائمة المرشحين
-    # لو لقيت أي اسم من candidates في df.columns هترجعه، وإلا ترجع العمود الأول كfallback
-    for col in candidates:
-        if col in df.columns:
-            return col
-    # fallback
-    return df.columns[0]
-
-# Helper: try to get a column safely بدون fallback (لو مش موجود يرجّع None)
-def try_get_col(df, candidates):
-    # دالة مساعدة ترجع None لو الداتا None أو مفيش أي من المرشحين
-    if df is None:
-        return None
-    for c in candidates:
-        if c in df.columns:
-            return c
+
+from bom_batch import prepare_analysis
+from bom_db import (has_run, parent_page, query_page, run_key, run_parents, save_run, save_view, summary_totals,
+                    touch_run)
+from bom_engine import component_mask
+from bom_export import EXPORT_FORMATS, export_store, remove_report, report_mime, report_suffix
+from bom_index import (UNIVERSAL_PCT, build_children_index, build_commonality_index, build_where_used_index,
+                       commonality_gaps, commonality_groups, commonality_table, search_components, where_used)
+from bom_ingest import file_digest, file_kind, list_sheets, load_inputs
+from bom_jobs import CANCELLED, FAILED, RUNNING, cancel_job, get_job, job_progress, partial_summary, submit_job
+from bom_profile import memory_tracing, merge_profile, new_profile, profile_json, profile_stage, stages_frame
+from bom_publish import latest_version, load_published, publish
+from bom_results import SUMMARY_COLUMNS, filter_store, store_parents, store_summary
+from bom_similarity import (NEAR_DUPLICATE_THRESHOLD, nearest_siblings, store_child_similarity, store_children,
+                            store_near_duplicates)
+from bom_snapshot import SNAPSHOT_DIR
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_sheets_cached(digest, _files, _digests, bom_source, father_source, mrp_source):
+    # نفس الملفات + نفس اختيار الشيتات => نرجّع النتيجة من الذاكرة بدون أي parse
+    # (ولو الجلسة جديدة، load_inputs نفسها بتقرا من كاش Parquet على الديسك)
+    # الـ profile بيرجع مع النتيجة عشان مراحل القراءة تظهر في الـ diagnostics
+    profile = new_profile()
+    frames = load_inputs(_files, bom_source, father_source, mrp_source, digests=_digests, profile=profile)
+    return frames + (profile,)
+
+
+def default_source(sources, sheet_name, keyword):
+    # الشيت الافتراضي: بالاسم المعتاد في ملف الإكسل، أو ملف CSV / Parquet اسمه فيه الكلمة دي
+    for label, (name, sheet) in sources.items():
+        if sheet == sheet_name:
+            return label
+    for label, (name, sheet) in sources.items():
+        if sheet is None and keyword in name.lower():
+            return label
     return None
 
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_indexes_cached(load_key, _bom_df, _father_df, _cols, _children_index=None):
+    # فهرس parent -> children + فهرس where-used بيتبنوا مرة واحدة لكل ملف/شيتات (للقراءة بس بعد كده)
+    # (النسخة المنشورة فيها فهرس الأبناء جاهز، فبيتبني where-used بس)
+    children_index = _children_index if _children_index is not None else \
+        build_children_index(_father_df, _cols["parent_col"], _cols["child_col"])
+    return children_index, build_where_used_index(_bom_df, _cols, children_index)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def build_commonality_cached(load_key, explode, _bom_df, _father_df, _mrp_df, _cols, _children_index, _engine=None):
+    # فهرس المشاركة العام (Parent x Component) مرة واحدة لكل ملف/شيتات/مستوى تفجير
+    context = prepare_analysis(_bom_df, _father_df, _mrp_df, _cols, explode=explode, children_index=_children_index,
+                               engine=_engine)
+    return build_commonality_index(context["engine"], context["children_index"])
+
+
+@st.fragment(run_every=1.0)
+def show_job_progress(job_key):
+    # بيتحدث لوحده كل ثانية (من غير rerun للصفحة كلها) طول ما التحليل شغال في الخلفية،
+    # ولما يخلص أو يتلغى بيعمل rerun للصفحة عشان النتايج تظهر
+    job = get_job(job_key)
+    if job is None or job["status"] != RUNNING:
+        st.rerun()
+    done, total, remaining = job_progress(job)
+    text = f"⏳ تم تحليل {done} من {total} Parent"
+    if remaining is not None:
+        text += f" (متبقي تقريبًا {remaining:.0f} ثانية)"
+    elif not done:
+        text = "⏳ جاري تجهيز البيانات..."
+    st.progress(done / total if total else 0.0, text=text)
+    if job["cancel"].is_set():
+        st.caption("⏹️ جاري الإلغاء بعد الـ Parent الحالي...")
+    elif st.button("⏹️ إلغاء التحليل (الاحتفاظ باللي خلص)"):
+        cancel_job(job)
+    # الـ Parents اللي خلصت بتظهر أول بأول (آخر 50 بس عشان التحديث يفضل خفيف)
+    finished = partial_summary(job)
+    if not finished.empty:
+        st.caption(f"متوسط نسبة التشابه لحد دلوقتي: {finished['Shared_Components_%'].mean():.2f}%")
+        st.dataframe(finished.tail(50), hide_index=True)
+
+
+def current_results(analysis_key, filter_key):
+    # النتيجة بعد الفلاتر عند الطلب (التشابه / التقرير) من store الـ job المشترك بين الجلسات،
+    # مش نسخة محفوظة في الجلسة؛ None لو الـ job اتمسح من الذاكرة
+    job = get_job(analysis_key)
+    if job is None or job["store"] is None or filter_key is None:
+        return None
+    parents, order_types, controllers = filter_key
+    return filter_store(job["store"], [str(p).strip() for p in parents], list(order_types), list(controllers))
+
+
+def page_controls(key, total, page_sizes=(10, 50, 200)):
+    # التنقل بين الصفحات: الصفحة بس هي اللي بتتقري من الداتابيز (مش الجدول كله)
+    c1, c2 = st.columns(2)
+    size = c1.selectbox("عدد السطور في الصفحة", page_sizes, key=f"{key}_size")
+    pages = max(1, -(-total // size))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = 1
+    page = c2.number_input(f"الصفحة (من {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    return size, (page - 1) * size
+
+
+def sort_controls(key, columns, default, ascending=False):
+    # الترتيب بيتعمل في الداتابيز (ORDER BY) قبل ما الصفحة تتقري
+    c1, c2 = st.columns(2)
+    sort_by = c1.selectbox("ترتيب حسب", columns, index=columns.index(default), key=f"{key}_sort")
+    direction = c2.radio("الاتجاه", ["تنازلي", "تصاعدي"], index=1 if ascending else 0,
+                         horizontal=True, key=f"{key}_dir")
+    return sort_by, direction == "تصاعدي"
+
 # --- إعداد الصفحة ---
 st.set_page_config(page_title="MRP BOM Analysis", layout="wide")
 st.subheader("🚀 الأبناء مع الاباء BOM أداة تحليل ")
@@ -37,102 +130,134 @@ st.markdown("---")
 # نهيّئ المتغيرات اللي هنخزن فيها نتائج التحليل وملفات الإخراج داخل session_state
 if 'analysis_complete' not in st.session_state:
     st.session_state.analysis_complete = False
-    st.session_state.summary_df = pd.DataFrame()
-    st.session_state.top10_global = pd.DataFrame()
-    st.session_state.per_parent_topdev = {}
-    st.session_state.all_merged_df = pd.DataFrame()
-    st.session_state.output_excel = BytesIO()
+    # مفتاح التشغيل (view الفلاتر) في الداتابيز المشتركة (الجداول بتتقري منها صفحة صفحة، شوف bom_db)؛
+    # النتائج نفسها مش بتتحفظ في الجلسة
+    st.session_state.run_id = None
+    st.session_state.report_path = None
+    st.session_state.report_format = "xlsx"
+    # مفاتيح آخر تحليل / آخر فلاتر اتطبقت / آخر تقرير اتكتب
+    st.session_state.analysis_key = None
+    st.session_state.filter_key = None
+    st.session_state.report_key = None
+    # الأبناء المتكررين تقريبًا (بيتحسبوا عند الطلب لكل فلاتر + حد تشابه)
+    st.session_state.near_duplicates_key = None
+    st.session_state.near_duplicates = pd.DataFrame()
+    # نتيجة وضع الـ snapshot لآخر تحليل (التغييرات عن آخر snapshot، شوف bom_snapshot)
+    st.session_state.snapshot_info = None
+    # الوقت/الذاكرة/عدد السطور لكل مرحلة من آخر تشغيل (شوف bom_profile)
+    st.session_state.diagnostics = None
+    # التحليل اللي شغال في الخلفية للجلسة دي (شوف bom_jobs) ووقت الضغط على الزر
+    st.session_state.job_key = None
+    st.session_state.job_submitted = None
 
 # ==============================================================================
 # 🔹 1. الشريط الجانبي للإعدادات
 # ==============================================================================
 st.sidebar.header("⚙️ 1. إعدادات التحليل")
-uploaded_file = st.sidebar.file_uploader("⬆️ ارفع ملف Excel", type=["xlsx"])
-
-# لو المستخدم ما رفعش ملف، نوقف التنفيذ ونطلب رفع الملف
-if uploaded_file is None:
-    st.info("👋 يرجى رفع ملف Excel من الشريط الجانبي لبدء التحليل.")
-    st.stop()
+# نسخة منشورة من البيانات الأساسية (شوف bom_publish): لو موجودة أي جلسة تقدر تحلل عليها من غير رفع،
+# والجداول والمحرك memory-mapped ومشتركين بين كل الجلسات والـ workers
+published_path = latest_version()
+use_published = False
+if published_path:
+    use_published = st.sidebar.toggle(
+        f"📦 استخدام النسخة المنشورة ({os.path.basename(published_path)})", value=False,
+        help="آخر نسخة اتنشرت بـ python bom_publish.py أو بزرار النشر؛ من غير رفع ولا نسخة لكل جلسة."
+    )
+    if use_published:
+        st.sidebar.info("ℹ️ التحليل على النسخة المنشورة، مش على ملف مرفوع. اقفل الاختيار ده عشان ترفع ملف جديد.")
+
+if not use_published:
+    # Excel (الشيتات الثلاثة في ملف واحد) أو CSV / Parquet لكل شيت في ملف لوحده (للـ BOM الأكبر من حد الإكسل)
+    uploaded_files = st.sidebar.file_uploader(
+        "⬆️ ارفع ملف Excel (أو CSV / Parquet لكل شيت)", type=["xlsx", "csv", "parquet"], accept_multiple_files=True
+    )
+
+    # لو المستخدم ما رفعش ملف، نوقف التنفيذ ونطلب رفع الملف
+    if not uploaded_files:
+        st.info("👋 يرجى رفع ملف Excel من الشريط الجانبي لبدء التحليل.")
+        st.stop()
 
 try:
-    # محاولة قراءة ملف الإكسل ومعرفة أسماء الشيتات المتاحة
-    xls = pd.ExcelFile(uploaded_file)
-    sheets = xls.sheet_names
+    if use_published:
+        # النسخة المنشورة: بتتفتح memory-mapped مرة واحدة للـ process، وكل الجلسات بتشاور على نفس الجداول والمحرك
+        published = load_published(published_path)
+        bom_df, father_df, mrp_control_df = published["bom_df"], published["father_df"], published["mrp_df"]
+        cols, digest = published["cols"], published["digest"]
+        file_names = f"published {published['version']}"
+        snapshot_sheets = [None, None, None]
+        bom_sheet = "Bom"
+        father_sheet = "father code" if father_df is not None else "None"
+        mrp_sheet = "MRP Controller" if mrp_control_df is not None else "None"
+        run_started = time.time()
+        run_profile = new_profile(file=file_names, published=published["path"])
+        load_profile = published["profile"]
+    else:
+        published = None
+        # محاولة قراءة الملفات ومعرفة الشيتات المتاحة
+        # (بنحسب hash لمحتوى كل ملف مرة واحدة ونستخدمه كمفتاح للكاش)
+        # كل اختيار = (اسم الملف، اسم الشيت) للإكسل أو (اسم الملف، None) لملف CSV / Parquet
+        files = {f.name: f.getvalue() for f in uploaded_files}
+        digests = {name: file_digest(data) for name, data in files.items()}
+        sources = {}
+        for name, data in files.items():
+            if file_kind(name) == "xlsx":
+                for sheet in list_sheets(data, digest=digests[name]):
+                    sources[sheet if len(files) == 1 else f"{name} › {sheet}"] = (name, sheet)
+            else:
+                sources[name] = (name, None)
+        sheets = list(sources)
+        file_names = ", ".join(files)
+
+        st.sidebar.markdown("---")
+        st.sidebar.subheader("📄 2. اختر الشيتات")
+
+        # اختيار شيت BOM بشكل افتراضي لو موجود، وإلا أول شيت
+        default_bom = default_source(sources, "Bom", "bom")
+        bom_sheet = st.sidebar.selectbox("اختر شيت الـ BOM", options=sheets,
+                                         index=sheets.index(default_bom) if default_bom else 0)
+
+        # اختيار شيت father code (يمكن "None")
+        father_options = ["None"] + sheets
+        default_father = default_source(sources, "father code", "father")
+        father_sheet = st.sidebar.selectbox("اختر شيت الـ Father", options=father_options,
+                                            index=father_options.index(default_father) if default_father else 0)
+
+        # اختيار شيت MRP Controller اختيارياً (تم المحافظة على الاسم الافتراضي كما في الكود الأصلي)
+        mrp_options = ["None"] + sheets
+        default_mrp = default_source(sources, "MRP Controller", "mrp")
+        mrp_sheet = st.sidebar.selectbox("اختر شيت MRP Controller (اختياري)", options=mrp_options,
+                                         index=mrp_options.index(default_mrp) if default_mrp else 0)
+
+        # مفتاح الكاش = hash الملف المستخدم (أو مجموعة الملفات لو الشيتات من أكتر من ملف)
+        used_files = sorted({sources[s][0] for s in (bom_sheet, father_sheet, mrp_sheet) if s != "None"})
+        digest = digests[used_files[0]] if len(used_files) == 1 else \
+            file_digest(" ".join(digests[name] for name in used_files).encode("utf-8"))
+
+        # أسماء الشيتات نفسها (من غير اسم الملف) عشان مقارنة الـ snapshot بملف الأسبوع اللي فات
+        snapshot_sheets = [sources[s][1] if s in sources else None for s in (bom_sheet, father_sheet, mrp_sheet)]
+
+        # قراءة البيانات من الشيتات المختارة (مرة واحدة لكل ملف/شيت بفضل الكاش)
+        # الشيتات بترجع جاهزة: أسماء الأعمدة والأكواد متنضفة، والأعمدة الرئيسية متحددة
+        run_started = time.time()
+        run_profile = new_profile(file=file_names, bom_sheet=bom_sheet, father_sheet=father_sheet, mrp_sheet=mrp_sheet)
+        with profile_stage(run_profile, "load sheets (this run)"):
+            bom_df, father_df, mrp_control_df, cols, load_profile = load_sheets_cached(
+                digest, files, digests, sources[bom_sheet], sources.get(father_sheet), sources.get(mrp_sheet)
+            )
+
+    with profile_stage(run_profile, "indexes (this run)"):
+        children_index, where_used_index = build_indexes_cached(
+            (digest, bom_sheet, father_sheet, mrp_sheet), bom_df, father_df, cols,
+            published["children_index"] if published else None,
+        )
 
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("📄 2. اختر الشيتات")
-
-    # اختيار شيت BOM بشكل افتراضي لو موجود، وإلا أول شيت
-    default_bom = sheets.index("Bom") if "Bom" in sheets else 0
-    bom_sheet = st.sidebar.selectbox("اختر شيت الـ BOM", options=sheets, index=default_bom)
-
-    # اختيار شيت father code (يمكن "None")
-    father_options = ["None"] + sheets
-    default_father = 1 + sheets.index("father code") if "father code" in sheets else 0
-    father_sheet = st.sidebar.selectbox("اختر شيت الـ Father", options=father_options, index=default_father)
-
-    # اختيار شيت MRP Controller اختيارياً (تم المحافظة على الاسم الافتراضي كما في الكود الأصلي)
-    mrp_options = ["None"] + sheets
-    default_mrp = 1 + sheets.index("MRP Controller") if "MRP Controller" in sheets else 0
-    mrp_sheet = st.sidebar.selectbox("اختر شيت MRP Controller (اختياري)", options=mrp_options, index=default_mrp)
-
-    # قراءة البيانات من الشيتات المختارة
-    bom_df = pd.read_excel(uploaded_file, sheet_name=bom_sheet)
-    father_df = pd.read_excel(uploaded_file, sheet_name=father_sheet) if father_sheet != "None" else None
-    mrp_control_df = pd.read_excel(uploaded_file, sheet_name=mrp_sheet) if mrp_sheet != "None" else None
-
-    # تنظيف أسماء الأعمدة من مسافات زائدة لضمان تطابق أفضل
-    bom_df.columns = [str(c).strip() for c in bom_df.columns]
-    if father_df is not None:
-        father_df.columns = [str(c).strip() for c in father_df.columns]
-    if mrp_control_df is not None:
-        mrp_control_df.columns = [str(c).strip() for c in mrp_control_df.columns]
-
-    # -------------------------
-    # اختيار الأعمدة الرئيسية باستخدام auto_detect أو try_get_col
-    # -------------------------
-    code_col = auto_detect(bom_df, ['Code', 'Material', 'Parent', 'Planning Material'])
-    component_col = auto_detect(bom_df, ['Component', 'Item', 'Material Name'])
-
-    # محاولة تحديد عمود الكمية إن وُجد
-    qty_col = None
-    qty_candidates = [c for c in ['Qty', 'Quantity', 'Component Quantity', 'Quantity_Per'] if c in bom_df.columns]
-    if qty_candidates:
-        qty_col = auto_detect(bom_df, qty_candidates)
-
-    # أعمدة الأب والابن في شيت الـ father (لو موجود)
-    parent_col, child_col = None, None
-    if father_df is not None:
-        parent_col = auto_detect(father_df, ['Parent', 'Planning Material', 'Parent_Material'])
-        child_col = auto_detect(father_df, ['Material', 'Child', 'Child_Material'])
-
-    # أعمدة من شيت MRP Control (اختيار مرن للتعامل مع أسماء مختلفة)
-    mrp_component_col = None
-    mrp_controller_col = None
-    mrp_order_type_col = None
-
-    if mrp_control_df is not None:
-        mrp_component_col = auto_detect(mrp_control_df, ['Component', 'Material'])
-        # دعم أسماء مختلفة للـ Controller
-        mrp_controller_col = try_get_col(mrp_control_df, [
-            'MRP_Controller', 'MRP Controller', 'MRP controller', 'MRPC', 'MFC'
-        ]) or auto_detect(mrp_control_df, ['MRP_Controller', 'MFC'])
-        # دعم أسماء مختلفة للـ Order Type
-        mrp_order_type_col = try_get_col(mrp_control_df, [
-            'Order_Type', 'Order Type', 'Order type', 'Type'
-        ]) or auto_detect(mrp_control_df, ['Order_Type', 'Type'])
-
-    # 🔸 التقاط عمود الوصف (Component Description) من BOM أو MRP
-    desc_candidates = [
-        'Component Description', 'Component_Description',
-        'Description', 'Material Description', 'Short Text',
-        'Item Description', 'Component Name', 'Material Name', 'Name'
-    ]
-    desc_col_bom = try_get_col(bom_df, desc_candidates)
-    desc_col_mrp = try_get_col(mrp_control_df, desc_candidates) if mrp_control_df is not None else None
+    # عمود الأب في شيت الـ father + أعمدة الفلاتر من شيت MRP Control
+    parent_col = cols["parent_col"]
+    mrp_controller_col = cols["mrp_controller_col"]
+    mrp_order_type_col = cols["mrp_order_type_col"]
 
     # فلترة الـ Parents المتاحة في شيت father
-    parents_available = sorted(father_df[parent_col].dropna().unique().astype(str)) if father_df is not None else []
+    parents_available = sorted(father_df[parent_col].dropna().unique()) if father_df is not None else []
     selected_parents = st.sidebar.multiselect("اختر Parent(s) للتحليل", options=parents_available, default=parents_available)
 
     # =============== NEW: فلاتر متعددة لـ Order Type و MRP Controller ===============
@@ -158,289 +283,379 @@ try:
         )
     # ================================================================================
 
+    # مستوى الـ BOM: المكونات المباشرة بس (زي الأصل) أو تفجير كل المستويات
+    explode_options = {"مستوى واحد (المكونات المباشرة)": None, "كل المستويات": "all", "المواد الخام بس": "leaves"}
+    explode_label = st.sidebar.selectbox(
+        "مستوى الـ BOM",
+        options=list(explode_options),
+        help="التفجير بيمشي على التجميعات الفرعية لحد المواد الخام والكميات بتتضرب على كل مسار."
+    )
+    explode = explode_options[explode_label]
+
+    # صيغة التقرير (Excel أو zip فيه CSV/Parquet لكل شيت)
+    report_format = st.sidebar.selectbox(
+        "صيغة التقرير",
+        options=list(EXPORT_FORMATS),
+        help="Excel للعرض، أو CSV/Parquet مضغوطين لأي أداة تانية (أسرع وأخف)."
+    )
+
+    # قياس الذاكرة لكل مرحلة (tracemalloc) بيبطّأ التحليل، فهو اختياري؛ وهو واحد للـ process كله،
+    # فتحليل واحد بس بيتقاس في نفس الوقت (شوف memory_tracing)
+    track_memory = st.sidebar.checkbox(
+        "📏 قياس الذاكرة لكل مرحلة (أبطأ)", value=False,
+        help="القياس على مستوى السيرفر كله: تحليل واحد بس بيتقاس في نفس الوقت (التاني بيطلع من غير ذاكرة)، "
+             "والرقم بيشمل أي شغل تاني شغال على نفس السيرفر وقتها."
+    )
+
+    # وضع الـ snapshot: الـ Parents اللي مدخلاتها ما اتغيرتش من آخر رفع بترجع نتيجتها من غير تحليل
+    use_snapshot = st.sidebar.checkbox(
+        "📸 وضع الـ snapshot (مقارنة بآخر رفع)", value=False,
+        help="بيحلل الـ Parents اللي اتغيرت بس، وبيعرض تقرير بالتغييرات عن آخر snapshot."
+    )
+
     # زر تشغيل التحليل
     st.sidebar.markdown("---")
+    analysis_key = (digest, bom_sheet, father_sheet, mrp_sheet, explode, use_snapshot)
     if st.sidebar.button("🚀 تشغيل التحليل", type="primary"):
-        with st.spinner("⏳ جاري معالجة البيانات..."):
-            # --- تحويل قيم الأعمدة الأساسية إلى نص وتنظيفها ---
-            bom_df[code_col] = bom_df[code_col].astype(str).str.strip()
-            bom_df[component_col] = bom_df[component_col].astype(str).str.strip()
-
-            if father_df is not None:
-                father_df[parent_col] = father_df[parent_col].astype(str).str.strip()
-                father_df[child_col] = father_df[child_col].astype(str).str.strip()
-
-            if mrp_control_df is not None and mrp_component_col:
-                mrp_control_df[mrp_component_col] = mrp_control_df[mrp_component_col].astype(str).str.strip()
-
-            # --- تجميع BOM حسب الـ Parent (مع دعم الكميات إن وُجدت) ---
-            if qty_col:
-                # لو فيه عمود كمية: نحوّل كل parent لقاموس component->qty
-                bom_grouped = bom_df.groupby(code_col).apply(
-                    lambda g: dict(zip(g[component_col], g[qty_col]))
-                ).to_dict()
+        # التحليل الكامل (كل الـ Parents ومن غير فلاتر) بيشتغل في الخلفية مرة واحدة لكل ملف/شيتات،
+        # وأي ضغطة على أي widget بعد كده مش بتوقفه (الـ job متسجل برة الـ script)
+        submit_job(analysis_key, bom_df, father_df, mrp_control_df, cols, parents_available, explode,
+                   children_index, track_memory, SNAPSHOT_DIR if use_snapshot else None,
+                   {"file": file_names, "digest": digest, "sheets": snapshot_sheets},
+                   published["engine"] if published else None)
+        st.session_state.job_key = analysis_key
+        st.session_state.job_submitted = run_started
+
+    # نشر الملفات المرفوعة كنسخة مشتركة (memory-mapped) لكل الجلسات والـ workers
+    if published is None and st.sidebar.button("📤 نشر البيانات دي كنسخة مشتركة"):
+        with st.spinner("⏳ جاري نشر النسخة..."):
+            published_path = publish(bom_df, father_df, mrp_control_df, cols, meta={"workbook": file_names})
+        st.sidebar.success(f"✅ اتنشرت النسخة {os.path.basename(published_path)}")
+
+    job_key = st.session_state.job_key
+    job = get_job(job_key) if job_key is not None else None
+    if job is not None and job["status"] == RUNNING:
+        show_job_progress(job_key)
+    elif job is not None:
+        # التحليل خلص (أو اتلغى) في الخلفية: نعتمده كنتيجة الجلسة مرة واحدة
+        st.session_state.job_key = None
+        if job["status"] == FAILED:
+            st.error(f"❌ فشل التحليل: {job['error']}")
+        else:
+            # مراحل القراءة والتحليل الفعلية (cached=True لو النتيجة كانت محسوبة قبل الضغط على الزر)
+            merge_profile(run_profile, load_profile, st.session_state.job_submitted)
+            merge_profile(run_profile, job["profile"], st.session_state.job_submitted)
+            run_profile["meta"]["explode"] = job_key[4]
+            run_profile["meta"]["parents_done"] = job["done"]
+            st.session_state.diagnostics = run_profile
+            st.session_state.snapshot_info = job["snapshot"]
+            st.session_state.analysis_key = job_key
+            st.session_state.filter_key = None
+            st.session_state.report_key = None
+            st.session_state.analysis_complete = True
+            if job["status"] == CANCELLED:
+                st.warning(f"⏹️ التحليل اتلغى: النتايج لأول {job['done']} من {job['total']} Parent بس.")
             else:
-                # لو مفيش كمية: مجرد مجموعة من المكونات لكل parent
-                bom_grouped = bom_df.groupby(code_col)[component_col].apply(set).to_dict()
-
-            # تجهيز قاموس بيانات MRP لتسهيل الربط لاحقًا
-            mrp_dict = {}
-            if mrp_control_df is not None and mrp_component_col:
-                mrp_dict = (
-                    mrp_control_df
-                    .drop_duplicates(subset=[mrp_component_col])
-                    .set_index(mrp_component_col)
-                    .to_dict(orient='index')
-                )
+                st.success("✅ اكتمل التحليل بنجاح! يمكنك الآن تصفح النتائج.")
 
-            # قاموس الوصف للمكوّن (نملأه من MRP أو BOM إن توفّر)
-            desc_lookup = {}
-            if mrp_control_df is not None and mrp_component_col and desc_col_mrp:
-                desc_lookup.update(
-                    mrp_control_df.dropna(subset=[mrp_component_col]).drop_duplicates(subset=[mrp_component_col])
-                    .set_index(mrp_component_col)[desc_col_mrp]
-                    .to_dict()
+    # تطبيق الفلاتر على النتائج المحفوظة (masks على الأكواد، من غير إعادة التحليل)
+    # أي تغيير في الـ Parents / Order Type / MRP Controller بيظهر فورًا
+    filter_key = (tuple(selected_parents), tuple(selected_order_types), tuple(selected_mrp_controllers))
+    # (ولو التشغيل اتمسح من الداتابيز وهو لسه معروض بيتكتب تاني من النتيجة اللي في الذاكرة)
+    if st.session_state.analysis_complete and st.session_state.analysis_key == analysis_key \
+            and (st.session_state.filter_key != filter_key or not has_run(st.session_state.run_id)):
+        # النتيجة الكاملة من الـ job اللي خلص (مشتركة بين الـ reruns والجلسات بنفس الملف)
+        analysis_job = get_job(analysis_key)
+        if analysis_job is None or analysis_job["store"] is None:
+            # النتيجة اتمسحت من الذاكرة (jobs أحدث) أو بيتعاد حسابها دلوقتي: لازم تشغيل التحليل تاني
+            st.session_state.analysis_complete = False
+        else:
+            diagnostics = st.session_state.diagnostics
+            with memory_tracing() if track_memory else nullcontext():
+                with profile_stage(diagnostics, "filters (masks)") as record:
+                    results = current_results(analysis_key, filter_key)
+                    record["rows"] = len(results["components"])
+                # التشغيل الكامل اتكتب في SQLite مرة واحدة جوه الـ job؛ الفلاتر بتتكتب view صغير عليه
+                # (الملخص + أرقام صفوف المكونات) مرة واحدة لكل فلاتر، وأي جلسة تانية بنفس المفتاح بتقرا نفس السطور
+                base_id = analysis_job["run_id"]
+                run_id = run_key(base_id, filter_key)
+                if not has_run(run_id):
+                    with profile_stage(diagnostics, "save filter view (SQLite)", rows=len(results["components"])):
+                        if not has_run(base_id):
+                            save_run(base_id, analysis_job["store"], {"file": file_names, "analysis": analysis_key})
+                        save_view(run_id, base_id, results,
+                                  {"file": file_names, "analysis": analysis_key, "filters": filter_key})
+            st.session_state.run_id = run_id
+            st.session_state.filter_key = filter_key
+
+    # التقرير بيتكتب على ملف مؤقت في الديسك شيت بشيت (constant memory) بعد التحليل مباشرة؛
+    # ولو الفلاتر اتغيرت بعد كده نعرض زرار لتحديثه بدل ما نعيد كتابته مع كل ضغطة
+    if st.session_state.analysis_complete and st.session_state.filter_key is not None:
+        report_key = (st.session_state.filter_key, report_format)
+        refresh = st.sidebar.button(
+            "🔄 تحديث التقرير للفلاتر الحالية",
+            disabled=st.session_state.report_key in (None, report_key),
+        )
+        results = None
+        # (ولو الملف اتمسح من مجلد التقارير المحدود بيتكتب تاني)
+        report_path = st.session_state.report_path
+        if st.session_state.report_key is None or refresh or not (report_path and os.path.exists(report_path)):
+            results = current_results(st.session_state.analysis_key, st.session_state.filter_key)
+        if results is not None:
+            remove_report(st.session_state.report_path)
+            with memory_tracing() if track_memory else nullcontext(), \
+                    profile_stage(st.session_state.diagnostics, f"export report ({report_format})",
+                                  rows=len(store_parents(results))):
+                st.session_state.report_path = export_store(results, store_summary(results), report_format)
+            st.session_state.report_format = report_format
+            st.session_state.report_key = report_key
+
+    # ==============================================================================
+    # 🔎 Where-used: مين بيستخدم مكوّن معين (من الفهرس مباشرة، من غير تشغيل التحليل)
+    # ==============================================================================
+    with st.expander("🔎 Where-used: مين بيستخدم المكوّن ده وبكام؟"):
+        component_query = st.text_input("كود المكوّن", key="where_used_query")
+        if component_query:
+            used_df = where_used(where_used_index, component_query)
+            if not used_df.empty:
+                st.caption(
+                    f"{used_df['Used_In'].nunique()} مادة بتستخدمه تحت {used_df['Parent'].nunique()} Parent"
                 )
+                st.dataframe(used_df, hide_index=True)
+            else:
+                suggestions = search_components(where_used_index, component_query)
+                if suggestions:
+                    st.info("مفيش كود مطابق بالظبط. أكواد قريبة: " + "، ".join(suggestions))
+                else:
+                    st.warning("المكوّن ده مش موجود في شيت الـ BOM.")
 
-            if desc_col_bom:
-                bom_desc_map = (
-                    bom_df.dropna(subset=[component_col, desc_col_bom])
-                    .drop_duplicates(subset=[component_col])
-                    .set_index(component_col)[desc_col_bom]
-                    .to_dict()
+    # ==============================================================================
+    # 🌐 فهرس المشاركة العام: المكونات شبه العامة / شبه الفريدة على مستوى كل الـ Parents
+    # ==============================================================================
+    with st.expander("🌐 فهرس المشاركة العام (مرشحين للتوحيد)"):
+        if st.toggle("بناء وعرض الفهرس", key="commonality_on"):
+            with st.spinner("⏳ جاري بناء فهرس المشاركة..."):
+                commonality = build_commonality_cached(
+                    (digest, bom_sheet, father_sheet, mrp_sheet), explode, bom_df, father_df, mrp_control_df, cols,
+                    children_index, published["engine"] if published else None,
                 )
-                # أكمل أي فراغات من الـ BOM لو الـ MRP ما غطّاش كله
-                for k, v in bom_desc_map.items():
-                    if k not in desc_lookup and pd.notna(v):
-                        desc_lookup[k] = v
-
-            # تهيئة قوائم مساعدة لتجميع النتائج
-            summary_list, all_parents_rows, per_parent_topdev = [], [], {}
-            output = BytesIO()
-
-            # نكتب النتائج في ملف Excel مؤقت داخل الذاكرة (output)
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                for parent in selected_parents:
-                    parent = str(parent).strip()
-                    # جلب قائمة الأبناء للـ parent الحالي
-                    children = father_df[father_df[parent_col] == parent][child_col].dropna().astype(str).unique().tolist() if father_df is not None else []
-                    total_children = len(children)
-                    parent_components = bom_grouped.get(parent, set())
-
-                    # ==============================
-                    # معالجة كل Parent + دمج بيانات الأبناء
-                    # ==============================
-                    usage_rows = []
-                    for comp in parent_components:
-                        mrp_info = mrp_dict.get(comp, {})
-
-                        # =============== NEW: تطبيق فلاتر Order Type + MRP Controller ===============
-                        # ملاحظة: لو المستخدم ما اختارش حاجة (القائمة فاضية) => ما فيش فلترة لهذا الحقل.
-                        if selected_order_types:
-                            if str(mrp_info.get(mrp_order_type_col)) not in set(selected_order_types):
-                                continue
-
-                        if selected_mrp_controllers:
-                            if str(mrp_info.get(mrp_controller_col)) not in set(selected_mrp_controllers):
-                                continue
-                        # ============================================================================
-
-                        count = 0
-                        child_usage = {}
-                        for child in children:
-                            # جلب مكونات الابن، وإلا 0
-                            child_components = bom_grouped.get(child, {})
-                            if qty_col and isinstance(child_components, dict):
-                                qty_value = child_components.get(comp, 0)
-                            else:
-                                qty_value = 1 if comp in child_components else 0
-
-                            child_usage[child] = qty_value
-                            if qty_value > 0:
-                                count += 1
-
-                        # حساب نسبة الاستخدام (نسبة الأبناء اللي استخدموا المكون)
-                        usage_pct = round(count / total_children * 100, 2) if total_children > 0 else 0.0
-                        row = {
-                            # سنحوّل الاسم لــ 'Component' لاحقًا للتوحيد في العرض
-                            component_col: comp,
-                            "Component Description": desc_lookup.get(comp, ""),
-                            "Total_Children": total_children,
-                            "Num_Children_with_Component": count,
-                            "Usage_%": usage_pct,
-                            "MRP_Controller": mrp_info.get(mrp_controller_col),
-                            "Order_Type": mrp_info.get(mrp_order_type_col)
-                        }
-                        # نضيف أعمدة كل ابن وقيمته (كمية أو صار/لم يصَر)
-                        row.update(child_usage)
-                        usage_rows.append(row)
-
-                    # إنشاء DataFrame واحتساب الانحراف + ترتيب الأعمدة
-                    parent_df = pd.DataFrame(usage_rows)
-                    if not parent_df.empty:
-                        # توحيد اسم العمود إلى 'Component' للعرض والفرز
-                        if component_col != 'Component' and component_col in parent_df.columns:
-                            parent_df.rename(columns={component_col: 'Component'}, inplace=True)
-                        comp_col_for_display = 'Component' if 'Component' in parent_df.columns else component_col
-
-                        # حساب الانحراف (كم يبتعد العدد عن إجمالي الأبناء)
-                        parent_df["Deviation"] = abs(parent_df["Num_Children_with_Component"] - (total_children))
-
-                        # ترتيب الأعمدة لواجهة المستخدم لعرض منطقي
-                        child_columns = [str(child) for child in children]
-                        first_block = [
-                            "Component",
-                            "Component Description",
-                            "Total_Children",
-                            "Num_Children_with_Component",
-                            "Usage_%",
-                            "Deviation",
-                            "parent",
-                        ]
-                        # باقي الأعمدة (MRP + Order + الأبناء + أي أعمدة تانية)
-                        rest_cols = [c for c in ["MRP_Controller", "Order_Type"] if c in parent_df.columns] + child_columns
-                        # أضف أي أعمدة أخرى غير مذكورة (مثل Deviation، ننقله لآخر الجدول)
-                        others = [c for c in parent_df.columns if c not in first_block + rest_cols]
-                        ordered_columns = [c for c in first_block if c in parent_df.columns] + rest_cols + others
-                        parent_df = parent_df.reindex(columns=ordered_columns)
-
-                        # كتابة شيت Parent داخل ملف الإكسل المؤقت
-                        parent_df.to_excel(writer, sheet_name=str(parent)[:31], index=False)
-
-                        # نحفظ لأعلى الانحرافات لكل Parent (لمحة سريعة)
-                        per_parent_topdev[parent] = parent_df.sort_values("Deviation", ascending=False).head(10)
-
-                        # للاستخدام الإجمالي (التجميع لكل Parents لاحقًا)
-                        all_parents_rows.append(parent_df.assign(Parent=parent))
-
-                    # ملخص Parent (سطر واحد لكل Parent في ملخص)
-                    total_comps = int(len(parent_df)) if 'parent_df' in locals() and not parent_df.empty else 0
-                    shared_comps = int(parent_df['Num_Children_with_Component'].gt(0).sum()) if total_comps > 0 else 0
-                    similarity_pct = round(shared_comps / total_comps * 100, 2) if total_comps > 0 else 0.0
-                    summary_list.append({
-                        "Parent_Code": parent,
-                        "Num_Children": total_children,
-                        "Total_Components": total_comps,
-                        "Shared_Components": shared_comps,
-                        "Shared_Components_%": similarity_pct
-                    })
-
-                # شيت الملخص: نحفظه في session_state وفي ملف الإكسل
-                st.session_state.summary_df = pd.DataFrame(summary_list)
-                st.session_state.summary_df.to_excel(writer, sheet_name="Summary_Report", index=False)
-
-                # تجميعة الكل + أعلى 10
-                if all_parents_rows:
-                    all_merged_df = pd.concat(all_parents_rows, ignore_index=True)
-                    st.session_state.all_merged_df = all_merged_df
-
-                    # تأكيد وجود عمود Component موحّد قبل الفرز
-                    if component_col != 'Component' and component_col in all_merged_df.columns:
-                        all_merged_df = all_merged_df.rename(columns={component_col: 'Component'})
-
-                    st.session_state.top10_global = all_merged_df.sort_values("Deviation", ascending=False).head(10)
-
-                # حفظ باقي النتائج في الستيت
-                st.session_state.per_parent_topdev = per_parent_topdev
-                st.session_state.output_excel = output
-                st.session_state.analysis_complete = True
-                st.success("✅ اكتمل التحليل بنجاح! يمكنك الآن تصفح النتائج.")
+            # فلاتر Order Type / MRP Controller اللي في الشريط الجانبي بتتطبق على المكونات
+            comp_filter = component_mask(commonality["engine"], selected_order_types, selected_mrp_controllers)
+            st.caption(
+                f"{len(commonality['parents'])} Parent و {commonality['num_distinct_children']} ابن مختلف "
+                f"و {int((commonality['comp_parents'] > 0).sum())} مكوّن مستخدم"
+            )
+            commonality_view = st.radio(
+                "العرض",
+                ["الأعم (في أكبر عدد Parents)", "الأندر (شبه فريد)", "حسب MRP Controller / Order Type",
+                 "شبه عام في الـ Parent وناقص من كام ابن"],
+                horizontal=True, key="commonality_view",
+            )
+            if commonality_view.startswith("الأعم") or commonality_view.startswith("الأندر"):
+                top_k = st.number_input("عدد المكونات", min_value=10, max_value=5000, value=50, step=10,
+                                        key="commonality_k")
+                st.dataframe(commonality_table(commonality, comp_filter, commonality_view.startswith("الأندر"),
+                                               int(top_k)), hide_index=True)
+            elif commonality_view.startswith("حسب"):
+                st.dataframe(commonality_groups(commonality, comp_filter), hide_index=True)
+            else:
+                gap_cols = st.columns(3)
+                min_pct = gap_cols[0].slider("أقل نسبة أبناء (%)", 50.0, 99.9, UNIVERSAL_PCT, step=0.5,
+                                             key="gap_min_pct")
+                max_missing = gap_cols[1].number_input("أقصى عدد أبناء ناقصين (0 = من غير حد)", min_value=0, value=0,
+                                                       key="gap_max_missing")
+                top_k = gap_cols[2].number_input("عدد النتايج", min_value=10, max_value=5000, value=50, step=10,
+                                                 key="gap_k")
+                gaps = commonality_gaps(commonality, min_pct, int(top_k), selected_parents, comp_filter,
+                                        int(max_missing) or None)
+                if not gaps.empty:
+                    st.dataframe(gaps, hide_index=True)
+                else:
+                    st.info("مفيش مكونات بالنسبة دي ناقصة من أي ابن.")
 
     # ==============================================================================
     # 🔹 3. عرض النتائج
     # ==============================================================================
+    # الجلسة بتسجل إنها لسه بتعرض التشغيل ده (عشان prune_runs ما يمسحوش)؛ لو اتمسح خلاص
+    # وما اتكتبش تاني فوق (الملف اتغير أو الـ job اتمسح من الذاكرة) لازم تحليل جديد
+    if st.session_state.analysis_complete and not touch_run(st.session_state.run_id):
+        st.session_state.analysis_complete = False
+        st.warning("⚠️ نتيجة التحليل ده اتمسحت من الكاش؛ شغّل التحليل تاني.")
+
     if not st.session_state.analysis_complete:
-        st.info("ℹ️ اضغط على زر 'تشغيل التحليل' لعرض النتائج.")
+        if st.session_state.job_key is None:
+            st.info("ℹ️ اضغط على زر 'تشغيل التحليل' لعرض النتائج.")
     else:
         st.header("📈 نتائج التحليل")
 
-        # --- بطاقة مؤشرات سريعة بالجزء العلوي ---
+        # --- بطاقة مؤشرات سريعة بالجزء العلوي (aggregates من الداتابيز) ---
+        run_id = st.session_state.run_id
+        totals = summary_totals(run_id)
         col1, col2, col3 = st.columns(3)
-        col1.metric("👨‍👩‍👧 عدد الـ Parents", len(st.session_state.summary_df))
-        avg_similarity = st.session_state.summary_df['Shared_Components_%'].mean()
-        col2.metric("🔄 متوسط نسبة التشابه", f"{avg_similarity:.2f}%")
-        total_shared = st.session_state.summary_df['Shared_Components'].sum()
-        col3.metric("🔗 إجمالي المكونات المشتركة", f"{total_shared}")
+        col1.metric("👨‍👩‍👧 عدد الـ Parents", totals["Parents"])
+        col2.metric("🔄 متوسط نسبة التشابه", f"{totals['Shared_Components_%']:.2f}%")
+        col3.metric("🔗 إجمالي المكونات المشتركة", f"{totals['Shared_Components']}")
+
+        # --- وضع الـ snapshot: اللي اتحلل فعلًا + التغييرات عن آخر snapshot ---
+        snapshot_info = st.session_state.snapshot_info
+        if snapshot_info is not None:
+            with st.expander("📸 التغييرات عن آخر snapshot", expanded=snapshot_info["changes"] is not None):
+                stats = snapshot_info["stats"]
+                st.caption(f"{stats['reused']} Parent رجعوا من الـ snapshot القديم و {stats['recomputed']} اتحللوا.")
+                changes = snapshot_info["changes"]
+                if changes is None:
+                    st.info("مفيش snapshot قديم للمقارنة؛ الـ snapshot ده هيتقارن بيه الرفع الجاي.")
+                else:
+                    c1, c2, c3, c4 = st.columns(4)
+                    c1.metric("اتغيروا", len(changes["changed"]))
+                    c2.metric("جداد", len(changes["added"]))
+                    c3.metric("اتشالوا", len(changes["removed"]))
+                    c4.metric("زي ما هما", changes["unchanged"])
+                    report = snapshot_info["report"]
+                    if not report.empty:
+                        st.dataframe(report, hide_index=True)
+                        st.download_button(
+                            label="⬇️ تحميل تقرير التغييرات (CSV)",
+                            data=report.to_csv(index=False).encode("utf-8-sig"),
+                            file_name="mrp_bom_changes.csv",
+                            mime="text/csv",
+                        )
+                    else:
+                        st.info("مفيش تغيير في Usage_% أو Deviation لأي مكوّن.")
 
         # --- تبويبات العرض ---
-        tab1, tab2, tab3 = st.tabs(["📊 الملخص الرئيسي", "🔥 أعلى الانحرافات", "👨‍👩‍👧 تفاصيل كل Parent"])
+        tab1, tab2, tab3, tab4 = st.tabs(["📊 الملخص الرئيسي", "🔥 أعلى الانحرافات", "👨‍👩‍👧 تفاصيل كل Parent", "🧬 تشابه الأبناء"])
 
         with tab1:
             st.subheader("ملخص أداء كل Parent")
-#            st.dataframe(st.session_state.summary_df)
-            # نعمل نسخة محلية من الـ DataFrame عشان نقدر نعدل عليها بدون تغيير الستيت مباشرة
-            summary_df = st.session_state.summary_df.copy()
-            if not summary_df.empty:
-                # تحديد الأعمدة الرقمية (لاستخدامها في حساب المجموع/المتوسط)
-                numeric_cols = summary_df.select_dtypes(include='number').columns
-
-                # تحديد الأعمدة اللي تمثل نسب/تشابه (لو أسم العمود فيه % أو "تشابه")
-                percent_cols = [c for c in numeric_cols if "%" in c or "تشابه" in c]
-
-                # مجموع الأعمدة الرقمية (سنعتمد على مجموع للأعمدة الطبيعية)
-                totals = summary_df[numeric_cols].sum()
-                # متوسط للأعمدة النسبية (لأن جمع النسب غير منطقِي)
-                averages = summary_df[percent_cols].mean()
-
-                # دمج النتائج (المتوسط يحل محل المجموع لو العمود نسبي)
-                for col in percent_cols:
-                    totals[col] = averages[col]
-
-                # إنشاء صف يجمع الإجماليات/المتوسطات (صف أفقي باستخدام .T)
-                totals_row = pd.DataFrame(totals).T
-                # وضع علامة واضحة في عمود Parent_Code للإشارة إلى أن هذا سطر إجمالي
-                totals_row["Parent_Code"] = ['🔢 الإجماليات / المتوسطات']
-                # دمج صف الإجماليات مع الـ DataFrame (ignore_index=True لضمان إندكس سليم)
+            # الترتيب والبحث والصفحات بيتعملوا في الداتابيز
+            sort_by, ascending = sort_controls("summary", SUMMARY_COLUMNS, "Parent_Code", ascending=True)
+            parent_search = st.text_input("بحث بكود الـ Parent", key="summary_search")
+            _, total = query_page(run_id, "summary", search=("Parent_Code", parent_search), limit=0)
+            limit, offset = page_controls("summary", total)
+            summary_df, _ = query_page(run_id, "summary", sort_by, ascending, search=("Parent_Code", parent_search),
+                                       limit=limit, offset=offset)
+            summary_df = summary_df.drop(columns=["row_no"])
+            if totals["Parents"]:
+                # صف الإجماليات على كل الـ Parents (مش الصفحة بس): مجموع للأعمدة العادية ومتوسط للنسب
+                totals_row = pd.DataFrame([{
+                    "Parent_Code": '🔢 الإجماليات / المتوسطات',
+                    "Num_Children": totals["Num_Children"],
+                    "Total_Components": totals["Total_Components"],
+                    "Shared_Components": totals["Shared_Components"],
+                    "Shared_Components_%": totals["Shared_Components_%"],
+                }])
                 summary_df = pd.concat([summary_df, totals_row], ignore_index=True)
 
-
             # عرض الجدول للمستخدم (مع إخفاء الإندكس لأنه يسبب عمود فارغ)
             st.dataframe(summary_df, hide_index=True)   # ← بديل للسطر الأخير
 
             st.markdown("---")
 
             # --- قسم عرض المكونات الأقل مشاركة (إذا كانت متوفرة) ---
-            if not st.session_state.all_merged_df.empty:
-                low_shared_df = st.session_state.all_merged_df[st.session_state.all_merged_df['Usage_%'] < 100].sort_values('Usage_%')
+            low_filter = {"Usage_%": ("<", 100)}
+            _, low_total = query_page(run_id, "components", filters=low_filter, limit=0)
+            if low_total:
                 st.subheader("📉 المكونات الأقل مشاركة عبر كل الـ Parents")
-                display_first = ['Parent', 'Component', 'Component Description', 'Parents', 'Total_Children', 'Num_Children_with_Component', 'Usage_%']
-                cols = [c for c in display_first if c in low_shared_df.columns] + [c for c in low_shared_df.columns if c not in display_first]
-                st.dataframe(low_shared_df[cols].head(200), hide_index=True)   # ← بديل للسطر الأخير)
+                limit, offset = page_controls("low_shared", low_total)
+                low_shared_df, _ = query_page(run_id, "components", "Usage_%", True, low_filter,
+                                              limit=limit, offset=offset)
+                st.dataframe(low_shared_df.drop(columns=["row_no"]), hide_index=True)   # ← بديل للسطر الأخير)
 
         with tab2:
-            st.subheader("أعلى 10 مكونات انحرافًا على المستوى الإجمالي")
-            top10 = st.session_state.top10_global.copy()
-            if not top10.empty:
-                display_first = ['Parent', 'Component', 'Component Description', 'Total_Children', 'Num_Children_with_Component', 'Usage_%']
-                cols = [c for c in display_first if c in top10.columns] + [c for c in top10.columns if c not in display_first]
-                st.dataframe(top10[cols], hide_index=True)   # ← بديل للسطر الأخير)
+            st.subheader("أعلى المكونات انحرافًا على المستوى الإجمالي")
+            # ترتيب بعدد الأبناء (Deviation) أو بتفاوت الكميات بين الأبناء (CV ثم الشواذ ثم Deviation)
+            rank_by = st.radio("الترتيب حسب", ["Deviation (عدد الأبناء)", "تفاوت الكميات (Qty_CV)"],
+                               horizontal=True, key="top_dev_rank")
+            if rank_by.startswith("Deviation"):
+                rank_cols, rank_filter = "Deviation", None
+            else:
+                rank_cols, rank_filter = ["Qty_CV", "Qty_Outliers", "Deviation"], {"Qty_Distinct": (">", 1)}
+            _, dev_total = query_page(run_id, "components", filters=rank_filter, limit=0)
+            if dev_total:
+                limit, offset = page_controls("top_dev", dev_total)
+                top_dev, _ = query_page(run_id, "components", rank_cols, False, rank_filter, limit=limit, offset=offset)
+                st.dataframe(top_dev.drop(columns=["row_no"]), hide_index=True)   # ← بديل للسطر الأخير)
             else:
                 st.info("لا توجد بيانات لعرض أعلى الانحرافات.")
 
         with tab3:
             st.subheader("استعراض تفاصيل الانحراف لكل Parent")
-            parents_with_dev = list(st.session_state.per_parent_topdev.keys())
+            parents_with_dev = run_parents(run_id)
             if parents_with_dev:
                 chosen_parent = st.selectbox("اختر Parent لعرض تفاصيله", options=parents_with_dev)
-                dfp = st.session_state.per_parent_topdev.get(chosen_parent, pd.DataFrame()).copy()
+                # صفحة من جدول الـ Parent العريض مترتبة بالانحراف (الكميات للمكونات اللي في الصفحة بس)
+                _, parent_total = query_page(run_id, "components", filters={"Parent": chosen_parent}, limit=0)
+                limit, offset = page_controls("parent", parent_total)
+                dfp, _ = parent_page(run_id, chosen_parent, limit=limit, offset=offset)
                 if not dfp.empty:
-                    display_first = ['Parent', 'Component', 'Component Description', 'Parents', 'Total_Children', 'Num_Children_with_Component', 'Usage_%']
-                    cols = [c for c in display_first if c in dfp.columns] + [c for c in dfp.columns if c not in display_first]
-                    st.dataframe(dfp[cols], hide_index=True)   # ← بديل للسطر الأخير)
+                    st.dataframe(dfp, hide_index=True)   # ← بديل للسطر الأخير)
                 else:
                     st.info("لا توجد بيانات انحراف لهذا الـ Parent.")
             else:
                 st.warning("لا توجد بيانات انحراف لعرضها.")
 
+        with tab4:
+            st.subheader("تشابه الأبناء داخل كل Parent")
+            results = current_results(st.session_state.analysis_key, st.session_state.filter_key)
+            sim_parents = store_parents(results) if results is not None else []
+            if sim_parents:
+                sim_parent = st.selectbox("اختر Parent لعرض تشابه أبنائه", options=sim_parents, key="sim_parent")
+                metric = st.radio("مقياس التشابه", ["Jaccard (المكونات)", "Weighted (بالكميات)"], horizontal=True)
+                jaccard_df, weighted_df = store_child_similarity(results, sim_parent)
+                st.dataframe(jaccard_df if metric.startswith("Jaccard") else weighted_df)
+                st.caption("أقرب أخ لكل ابن")
+                st.dataframe(
+                    nearest_siblings(results["engine"], sim_parent, store_children(results, sim_parent), results["comp_mask"]),
+                    hide_index=True
+                )
+
+                st.markdown("---")
+                st.subheader("🔁 أبناء متكررين تقريبًا عبر كل الـ Parents")
+                threshold = st.slider("أقل نسبة Jaccard %", min_value=50, max_value=100,
+                                      value=int(NEAR_DUPLICATE_THRESHOLD), step=5)
+                # MinHash + LSH بيتحسبوا مرة واحدة لكل فلاتر + حد تشابه
+                near_key = (st.session_state.filter_key, threshold)
+                if st.session_state.near_duplicates_key != near_key:
+                    st.session_state.near_duplicates = store_near_duplicates(results, threshold)
+                    st.session_state.near_duplicates_key = near_key
+                near_df = st.session_state.near_duplicates
+                if not near_df.empty:
+                    st.dataframe(near_df, hide_index=True)
+                else:
+                    st.info("لا يوجد أبناء متشابهين بالنسبة دي.")
+            else:
+                st.warning("لا توجد بيانات لعرض التشابه.")
+
         st.markdown("---")
-        # زر تحميل الإكسل النهائي
-        st.download_button(
-            label="🗂️  (Excel) تحميل التقرير الكامل  🔥",
-            data=st.session_state.output_excel.getvalue(),
-            file_name="MRP_BOM_Report_Stateful.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-        )
+        # زر تحميل التقرير النهائي (بيتقري من الملف المؤقت وقت التحميل بس)
+        if st.session_state.report_path and os.path.exists(st.session_state.report_path):
+            with open(st.session_state.report_path, "rb") as report_file:
+                st.download_button(
+                    label=f"🗂️  ({st.session_state.report_format}) تحميل التقرير الكامل  🔥",
+                    data=report_file,
+                    file_name="MRP_BOM_Report_Stateful" + report_suffix(st.session_state.report_format),
+                    mime=report_mime(st.session_state.report_format),
+                    use_container_width=True
+                )
+
+        # --- Diagnostics: الوقت والذاكرة وعدد السطور لكل مرحلة + أبطأ الـ Parents ---
+        diagnostics = st.session_state.diagnostics
+        if diagnostics is not None:
+            with st.expander("🩺 Diagnostics (الوقت والذاكرة لكل مرحلة)"):
+                st.caption("cached = الرقم من أول مرة المرحلة اتحسبت (النتيجة رجعت من الكاش في التشغيل ده). "
+                           "الذاكرة بتتقاس بس لو اخترت قياس الذاكرة من الشريط الجانبي، ومفيش تحليل تاني بيتقاس في نفس الوقت "
+                           "(الرقم بيشمل أي شغل تاني شغال على السيرفر وقتها).")
+                st.dataframe(stages_frame(diagnostics), hide_index=True)
+                if diagnostics["slowest_parents"]:
+                    st.caption("أبطأ الـ Parents في التحليل")
+                    st.dataframe(pd.DataFrame(diagnostics["slowest_parents"]), hide_index=True)
+                st.download_button(
+                    label="⬇️ تحميل الـ diagnostics (JSON)",
+                    data=profile_json(diagnostics),
+                    file_name="mrp_bom_diagnostics.json",
+                    mime="application/json",
+                )
 
 except Exception as e:
     # في حالة أي خطأ، نعرضه للمستخدم لكي يسهل تتبعه
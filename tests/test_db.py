@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - SQLite result store tests
+# - query_page / parent_page / run_parents (تشغيل كامل و view) لازم يطلعوا نفس صفوف وترتيب
+#   filter_store في الذاكرة: ترتيب، فلاتر، بحث، limit / offset
+# - prune_runs: الأقدم استخدامًا بيتمسح، واللي اتفتح من قريب (touch_run) بيفضل، والـ views بتتمسح مع الـ base
+# - الداتابيز في tmp_path مش في الريبو
+# ==============================================================================
+import os
+import sys
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bom_batch import iter_parent_results, prepare_analysis  # noqa: E402
+from bom_db import (ACTIVE_SECONDS, connect, has_run, parent_page, prune_runs, query_page,  # noqa: E402
+                    run_parents, save_run, save_view, touch_run)
+from bom_ingest import normalize_sheet  # noqa: E402
+from bom_results import (build_result_store, filter_store, store_component_view, store_parent_wide,  # noqa: E402
+                         store_summary)
+
+VIEW_PARENTS = ["P3", "P1", "P0", "P5"]
+
+
+def make_store(seed=3):
+    rng = np.random.default_rng(seed)
+    pool = [f"C{i}" for i in range(15)]
+    father_rows, bom_rows = [], []
+    for p in range(6):
+        parent = f"P{p}"
+        children = [f"{parent}-K{k}" for k in range(rng.integers(2, 6))]
+        father_rows += [(parent, child) for child in children]
+        bom_rows += [(parent, comp, 1) for comp in rng.choice(pool, 8, replace=False)]
+        for child in children:
+            bom_rows += [(child, comp, int(q)) for comp, q in
+                         zip(rng.choice(pool, 7, replace=False), rng.integers(0, 4, 7))]
+    bom_df, cols = normalize_sheet(pd.DataFrame(bom_rows, columns=["Code", "Component", "Qty"]), "bom")
+    father_df, father_cols = normalize_sheet(pd.DataFrame(father_rows, columns=["Parent", "Material"]), "father")
+    mrp_df, mrp_cols = normalize_sheet(pd.DataFrame({
+        "Component": pool,
+        "MRP Controller": [f"M{i % 3}" for i in range(15)],
+        "Order Type": ["F" if i % 2 else "E" for i in range(15)],
+        "Description": [f"d{i}" for i in range(15)],
+    }), "mrp")
+    cols = dict(cols, **father_cols, **mrp_cols)
+    context = prepare_analysis(bom_df, father_df, mrp_df, cols)
+    parents = sorted(father_df[cols["parent_col"]].unique())
+    return build_result_store(context["engine"], iter_parent_results(context, parents, workers=1))
+
+
+@pytest.fixture
+def runs(tmp_path):
+    # تشغيل كامل + view متفلتر عليه (Parents بترتيب الاختيار + Order Type)
+    db_path = str(tmp_path / "results.sqlite")
+    store = make_store()
+    view = filter_store(store, VIEW_PARENTS, ["F"])
+    assert save_run("base", store, db_path=db_path)
+    assert save_view("view", "base", view, db_path=db_path)
+    return db_path, {"base": store, "view": view}
+
+
+def expected_components(store):
+    df = store_component_view(store, qty=True)
+    return df.astype({"Parent": str, "Component": str})
+
+
+@pytest.mark.parametrize("run_id", ["base", "view"])
+@pytest.mark.parametrize("sort_by, ascending, filters, search", [
+    (None, True, None, None),
+    ("Deviation", False, None, None),
+    (["Usage_%", "Component"], [True, False], None, None),
+    ("Qty_CV", False, {"Deviation": (">", 0)}, None),
+    ("Deviation", True, {"Order_Type": "F", "Usage_%": ("<", 100)}, ("Component", "C1")),
+])
+def test_query_page_matches_filter_store(runs, run_id, sort_by, ascending, filters, search):
+    db_path, stores = runs
+    expected = expected_components(stores[run_id])
+    for col, cond in (filters or {}).items():
+        op, value = cond if isinstance(cond, tuple) else ("=", cond)
+        expected = expected[{"=": expected[col] == value, ">": expected[col] > value,
+                             "<": expected[col] < value}[op]]
+    if search:
+        expected = expected[expected[search[0]].str.contains(search[1], regex=False)]
+    if sort_by:
+        # SQLite بيحط NULL الأول في ASC والآخر في DESC
+        expected = expected.sort_values(sort_by, ascending=ascending, kind="stable",
+                                        na_position="first" if ascending is True else "last")
+    columns = ["Parent", "Component", "Usage_%", "Deviation", "Num_Children_with_Component", "Order_Type"]
+
+    got, total = query_page(run_id, "components", sort_by, ascending, filters, search, limit=1000, db_path=db_path)
+    assert total == len(expected)
+    pd.testing.assert_frame_equal(got[columns], expected[columns].reset_index(drop=True), check_dtype=False)
+
+    # نفس الترتيب صفحة صفحة
+    page, _ = query_page(run_id, "components", sort_by, ascending, filters, search, limit=4, offset=3,
+                         db_path=db_path)
+    pd.testing.assert_frame_equal(page[columns], expected[columns].iloc[3:7].reset_index(drop=True),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize("run_id", ["base", "view"])
+def test_summary_and_parents_match_filter_store(runs, run_id):
+    db_path, stores = runs
+    store = stores[run_id]
+    got, total = query_page(run_id, "summary", limit=100, db_path=db_path)
+    expected = store_summary(store)
+    assert total == len(expected)
+    pd.testing.assert_frame_equal(got.drop(columns="row_no"), expected, check_dtype=False)
+    assert run_parents(run_id, db_path=db_path) == list(store["index"])
+    if run_id == "view":
+        assert run_parents(run_id, db_path=db_path) == [p for p in VIEW_PARENTS if p in store["index"]]
+
+
+@pytest.mark.parametrize("run_id", ["base", "view"])
+def test_parent_page_matches_store_parent_wide(runs, run_id):
+    db_path, stores = runs
+    store = stores[run_id]
+    for parent in store["index"]:
+        expected = store_parent_wide(store, parent).sort_values("Deviation", ascending=False, kind="stable")
+        expected = expected.reset_index(drop=True)
+        got, total = parent_page(run_id, parent, limit=100, db_path=db_path)
+        assert total == len(expected)
+        columns = ["Component", "Usage_%", "Deviation"] + list(expected.columns[8:])
+        pd.testing.assert_frame_equal(got[columns], expected[columns], check_dtype=False)
+        page, _ = parent_page(run_id, parent, limit=2, offset=1, db_path=db_path)
+        pd.testing.assert_frame_equal(page[columns], expected[columns].iloc[1:3].reset_index(drop=True),
+                                      check_dtype=False)
+
+
+def test_prune_keeps_recently_touched_runs(tmp_path):
+    db_path = str(tmp_path / "results.sqlite")
+    store = make_store()
+    view = filter_store(store, VIEW_PARENTS, ["F"])
+    for i in range(4):
+        assert save_run(f"r{i}", store, db_path=db_path)
+        assert save_view(f"v{i}", f"r{i}", view, db_path=db_path)
+    # كله لسه مفتوح من قريب (ACTIVE_SECONDS)، فمفيش حاجة بتتمسح حتى لو العدد أكبر من keep
+    with closing(connect(db_path)) as conn:
+        prune_runs(conn, keep=1, keep_views=1)
+    assert all(has_run(f"{kind}{i}", db_path=db_path) for kind in "rv" for i in range(4))
+
+    # كله بقى قديم، وبعدين جلسة فتحت v1 (وده بيلمس r1 كمان)
+    with closing(connect(db_path)) as conn, conn:
+        old = time.time() - 2 * ACTIVE_SECONDS
+        conn.executemany("UPDATE runs SET last_access = ? WHERE run_id IN (?, ?)",
+                         [(old - i, f"r{i}", f"v{i}") for i in range(4)])
+    assert touch_run("v1", db_path=db_path)
+    with closing(connect(db_path)) as conn:
+        prune_runs(conn, keep=2, keep_views=0)
+        view_rows = {r[0] for r in conn.execute("SELECT DISTINCT view_id FROM view_rows")}
+        leftover = {r[0] for r in conn.execute("SELECT DISTINCT run_id FROM components")}
+
+    # r1 لسه مفتوح، وr0 أحدث القديم (keep=2)؛ الباقي اتمسح بالـ views بتاعته
+    assert [r for r in ("r0", "r1", "r2", "r3") if has_run(r, db_path=db_path)] == ["r0", "r1"]
+    assert [v for v in ("v0", "v1", "v2", "v3") if has_run(v, db_path=db_path)] == ["v1"]
+    assert view_rows == {"v1"}
+    assert leftover == {"r0", "r1"}
+    assert run_parents("v1", db_path=db_path) == list(view["index"])
+    assert not touch_run("r3", db_path=db_path)
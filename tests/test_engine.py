@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Engine equivalence test
+# - المحرك (analyze_parent_long + parent_wide) لازم يطلع نفس parent_df بتاع الـ loop الأصلي
+#   (Parents x Components x Children) في الكود القديم: نفس الأعمدة والترتيب والقيم والأنواع
+# - على BOM متولّد: بكمية int / float أو من غير كمية، وبفلاتر Order Type / MRP Controller أو من غيرها
+# - التفجير متعدد المستويات (explode_engine): ضرب الكميات، leaves، الدورات، والكمية صفر
+# ==============================================================================
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bom_engine import (analyze_parent_long, bom_levels, build_desc_lookup, build_engine,  # noqa: E402
+                        build_mrp_dict, component_mask, explode_engine, parent_wide)
+
+
+def make_data(qty_kind, seed=7):
+    rng = np.random.default_rng(seed)
+    pool = [f"C{i}" for i in range(15)]
+    father_rows, bom_rows = [], []
+    for p in range(6):
+        parent = f"P{p}"
+        children = [f"{parent}_K{k}" for k in range(rng.integers(2, 6))]
+        father_rows += [(parent, child) for child in children]
+        # الـ Parent الأخير مالوش BOM، وآخر ابن في كل Parent مالوش BOM
+        if p < 5:
+            bom_rows += [(parent, comp) for comp in rng.choice(pool, 6, replace=False)]
+        for child in children[:-1]:
+            bom_rows += [(child, comp) for comp in rng.choice(pool, 7, replace=False)]
+    # مكوّن متكرر جوه نفس الكود: آخر كمية هي اللي بتتحسب
+    bom_rows += bom_rows[:3]
+    bom_df = pd.DataFrame(bom_rows, columns=["Code", "Component"])
+    bom_df["Component Description"] = "desc " + bom_df["Component"]
+    if qty_kind == "int":
+        bom_df["Qty"] = rng.integers(0, 4, len(bom_df))
+    elif qty_kind == "float":
+        bom_df["Qty"] = rng.integers(0, 8, len(bom_df)) / 2
+    father_df = pd.DataFrame(father_rows, columns=["Parent", "Child"])
+    mrp_df = pd.DataFrame({
+        "Material": pool[:12],
+        "MRP Controller": [f"M{i % 3}" for i in range(12)],
+        "Order Type": ["F" if i % 2 else "E" for i in range(12)],
+        "Material Description": [f"mrp C{i}" for i in range(12)],
+    })
+    return bom_df, father_df, mrp_df
+
+
+def old_parent_df(bom_df, father_df, mrp_dict, desc_lookup, parent, qty_col, order_types, controllers):
+    # الـ loop الأصلي زي ما كان في الواجهة قبل المحرك (component_col = "Component")
+    if qty_col:
+        bom_grouped = bom_df.groupby("Code").apply(lambda g: dict(zip(g["Component"], g[qty_col]))).to_dict()
+    else:
+        bom_grouped = bom_df.groupby("Code")["Component"].apply(set).to_dict()
+    children = father_df[father_df["Parent"] == parent]["Child"].dropna().astype(str).unique().tolist()
+    total_children = len(children)
+    usage_rows = []
+    for comp in bom_grouped.get(parent, set()):
+        mrp_info = mrp_dict.get(comp, {})
+        if order_types and str(mrp_info.get("Order Type")) not in set(order_types):
+            continue
+        if controllers and str(mrp_info.get("MRP Controller")) not in set(controllers):
+            continue
+        count = 0
+        child_usage = {}
+        for child in children:
+            child_components = bom_grouped.get(child, {})
+            if qty_col and isinstance(child_components, dict):
+                qty_value = child_components.get(comp, 0)
+            else:
+                qty_value = 1 if comp in child_components else 0
+            child_usage[child] = qty_value
+            if qty_value > 0:
+                count += 1
+        row = {
+            "Component": comp,
+            "Component Description": desc_lookup.get(comp, ""),
+            "Total_Children": total_children,
+            "Num_Children_with_Component": count,
+            "Usage_%": round(count / total_children * 100, 2) if total_children > 0 else 0.0,
+            "MRP_Controller": mrp_info.get("MRP Controller"),
+            "Order_Type": mrp_info.get("Order Type"),
+        }
+        row.update(child_usage)
+        usage_rows.append(row)
+    parent_df = pd.DataFrame(usage_rows)
+    if parent_df.empty:
+        return parent_df, children
+    parent_df["Deviation"] = abs(parent_df["Num_Children_with_Component"] - total_children)
+    first_block = ["Component", "Component Description", "Total_Children", "Num_Children_with_Component",
+                   "Usage_%", "Deviation"]
+    return parent_df.reindex(columns=first_block + ["MRP_Controller", "Order_Type"] + children), children
+
+
+@pytest.mark.parametrize("qty_kind", [None, "int", "float"])
+@pytest.mark.parametrize("order_types, controllers", [([], []), (["F"], []), ([], ["M0", "M2"]), (["E"], ["M1"])])
+def test_parent_wide_matches_old_loop(qty_kind, order_types, controllers):
+    bom_df, father_df, mrp_df = make_data(qty_kind)
+    qty_col = "Qty" if qty_kind else None
+    mrp_dict = build_mrp_dict(mrp_df, "Material")
+    desc_lookup = build_desc_lookup(bom_df, mrp_df, "Material", "Component Description", "Material Description",
+                                    "Component")
+    engine = build_engine(bom_df, "Code", "Component", qty_col, father_df=father_df, child_col="Child",
+                          mrp_dict=mrp_dict, desc_lookup=desc_lookup,
+                          mrp_controller_col="MRP Controller", mrp_order_type_col="Order Type")
+    mask = component_mask(engine, order_types, controllers)
+
+    for parent in father_df["Parent"].unique():
+        expected, children = old_parent_df(bom_df, father_df, mrp_dict, desc_lookup, parent, qty_col,
+                                           order_types, controllers)
+        got = parent_wide(engine, analyze_parent_long(engine, parent, children, mask))
+        if expected.empty:
+            assert got.empty
+            continue
+        if not qty_col:
+            # من غير كمية الأصل كان set، فترتيب المكونات مش ثابت: المقارنة بعد الترتيب بالمكوّن
+            expected = expected.sort_values("Component", ignore_index=True)
+            got = got.sort_values("Component", ignore_index=True)
+        pd.testing.assert_frame_equal(got, expected)
+
+
+def explode(edges, mode="all"):
+    bom_df = pd.DataFrame(edges, columns=["Code", "Component", "Qty"])
+    return explode_engine(build_engine(bom_df, "Code", "Component", "Qty"), mode)
+
+
+def exploded_row(engine, material):
+    # {مكوّن: كمية} لمادة واحدة من المصفوفة المتفجرة
+    row = engine["matrix"][engine["materials"].get_loc(material)]
+    return {engine["materials"][c]: v for c, v in zip(row.indices.tolist(), row.data.tolist())}
+
+
+def test_explode_multiplies_quantities_through_levels():
+    engine = explode([("P", "A", 2), ("A", "B", 3), ("B", "Z", 4), ("P", "W", 1)])
+    assert exploded_row(engine, "P") == {"A": 2, "B": 6, "Z": 24, "W": 1}
+    assert exploded_row(engine, "A") == {"B": 3, "Z": 12}
+    levels = dict(zip(engine["materials"], engine["levels"].tolist()))
+    assert levels == {"P": 3, "A": 2, "B": 1, "Z": 0, "W": 0}
+
+
+def test_explode_sums_quantities_over_paths():
+    # Z جاية من طريقين: 2*3 + 5
+    engine = explode([("P", "A", 2), ("P", "B", 1), ("A", "Z", 3), ("B", "Z", 5)])
+    assert exploded_row(engine, "P") == {"A": 2, "B": 1, "Z": 11}
+
+
+def test_explode_leaves_only():
+    engine = explode([("P", "A", 2), ("A", "B", 3), ("B", "Z", 4), ("P", "W", 1), ("A", "Y", 2)], "leaves")
+    assert exploded_row(engine, "P") == {"Z": 24, "W": 1, "Y": 4}
+    p = engine["materials"].get_loc("P")
+    order = engine["materials"][engine["order_idx"][engine["order_ptr"][p]:engine["order_ptr"][p + 1]]]
+    assert set(order) == {"Z", "W", "Y"}
+
+
+def test_explode_zero_qty_prunes_subtree():
+    engine = explode([("P", "A", 2), ("P", "Q", 0), ("Q", "Y", 5), ("Y", "X", 3)])
+    assert exploded_row(engine, "P") == {"A": 2}
+    assert exploded_row(engine, "Q") == {"Y": 5, "X": 15}
+
+
+def test_explode_unknown_mode():
+    with pytest.raises(ValueError):
+        explode([("P", "A", 1)], "roots")
+
+
+@pytest.mark.parametrize("edges, path", [
+    ([("P", "A", 1), ("A", "B", 1), ("B", "C", 1), ("C", "A", 1)], "A -> B -> C -> A"),
+    ([("P", "A", 1), ("A", "A", 2)], "A -> A"),
+])
+def test_cycle_raises_with_path(edges, path):
+    engine = build_engine(pd.DataFrame(edges, columns=["Code", "Component", "Qty"]), "Code", "Component", "Qty")
+    with pytest.raises(ValueError, match=path):
+        bom_levels(engine)
+    with pytest.raises(ValueError, match=path):
+        explode_engine(engine)
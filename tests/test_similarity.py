@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Near-duplicate children test (MinHash + LSH)
+# - أبناء متطابقين أو شبه متطابقين بيطلعوا أزواج، والأبناء اللي مالهمش مكونات مشتركة لأ
+# - seed ثابت، فالنتيجة ثابتة
+# ==============================================================================
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bom_engine import build_engine  # noqa: E402
+from bom_similarity import child_rows, lsh_pairs, minhash_signatures, near_duplicates  # noqa: E402
+
+# A و B نفس المكونات (B بضعف الكمية)، C = A مع تبديل مكوّن واحد (Jaccard 39/41)، D و E مالهمش حاجة مشتركة
+CHILDREN = {
+    "A": [f"C{i}" for i in range(40)],
+    "B": [f"C{i}" for i in range(40)],
+    "C": [f"C{i}" for i in range(39)] + ["C150"],
+    "D": [f"C{i}" for i in range(60, 100)],
+    "E": [f"C{i}" for i in range(100, 140)],
+}
+SEED = 11
+
+
+def make_engine():
+    rows = [(child, comp, 2 if child == "B" else 1) for child, comps in CHILDREN.items() for comp in comps]
+    return build_engine(pd.DataFrame(rows, columns=["Code", "Component", "Qty"]), "Code", "Component", "Qty")
+
+
+def test_minhash_agreement_follows_jaccard():
+    signatures = minhash_signatures(child_rows(make_engine(), list(CHILDREN)), num_perm=128, seed=SEED)
+    a, b, c, d, e = signatures
+    np.testing.assert_array_equal(a, b)
+    assert 0.8 <= (a == c).mean() < 1.0
+    # مجموعات منفصلة: ولا قيمة بتتساوى (كل hash جاي من مكوّن مختلف)
+    assert (a == d).sum() == 0 and (d == e).sum() == 0
+
+    left, right = lsh_pairs(signatures, bands=16, seed=SEED)
+    assert set(zip(left.tolist(), right.tolist())) == {(0, 1), (0, 2), (1, 2)}
+
+
+def test_near_duplicates_pairs_similar_children_only():
+    engine = make_engine()
+    # ابن مالوش BOM ما بيدخلش المقارنة
+    children = list(CHILDREN) + ["NO_BOM"]
+    parents_of = {child: ["P1"] if child in ("A", "B") else ["P2"] for child in children}
+    result = near_duplicates(engine, children, parents_of=parents_of, seed=SEED)
+
+    pairs = {(a, b): (j, w) for a, b, j, w in result[["Child_A", "Child_B", "Jaccard_%", "Weighted_%"]].values}
+    assert pairs == {("A", "B"): (100.0, 50.0), ("A", "C"): (95.12, 95.12), ("B", "C"): (95.12, 48.15)}
+    assert result.loc[result["Child_A"] == "A", "Shared_Components"].tolist() == [40, 39]
+    # الترتيب بالـ Jaccard ثم Weighted، والـ Parents بتوع كل ابن ظاهرين
+    assert result[["Child_A", "Child_B", "Parents_A", "Parents_B"]].values.tolist()[:2] == \
+        [["A", "B", "P1", "P1"], ["A", "C", "P1", "P2"]]
+
+    strict = near_duplicates(engine, children, threshold=96, seed=SEED)
+    assert strict[["Child_A", "Child_B"]].values.tolist() == [["A", "B"]]
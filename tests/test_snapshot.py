@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MRP BOM Analysis - Snapshot (diff mode) tests
+# - الـ Parent اللي مدخلاته ما اتغيرتش بيرجع من الـ snapshot القديم، والمتغير بس هو اللي بيتحلل
+# - تقرير التغييرات (Change_Report): added / removed / changed بفرق Usage_% و Deviation
+# - التنضيف لكل مفتاح لوحده (KEEP_SNAPSHOTS)
+# - كل الـ snapshots بتتكتب في tmp_path مش في الريبو
+# ==============================================================================
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bom_batch import analyze_parents, iter_snapshot_results, prepare_analysis  # noqa: E402
+from bom_ingest import normalize_sheet  # noqa: E402
+from bom_snapshot import (KEEP_SNAPSHOTS, change_report, latest_snapshot, list_snapshots,  # noqa: E402
+                          load_snapshot, parent_fingerprints, save_snapshot, snapshot_changes, snapshot_key)
+
+PARENTS = [f"P{p}" for p in range(4)]
+COMPONENTS = ["C0", "C1", "C2"]
+
+
+def make_rows():
+    # كل Parent فيه C0..C2، وكل ابن من الأربعة فيه أول (k % 3) + 1 مكونات بكمية 1
+    rows = []
+    for parent in PARENTS:
+        rows += [(parent, comp, 1) for comp in COMPONENTS]
+        for k in range(4):
+            rows += [(f"{parent}-K{k}", comp, 1) for comp in COMPONENTS[:k % 3 + 1]]
+    return rows
+
+
+def make_frames(rows, parents=PARENTS):
+    bom_df, cols = normalize_sheet(pd.DataFrame(rows, columns=["Code", "Component", "Qty"]), "bom")
+    father_df, father_cols = normalize_sheet(pd.DataFrame(
+        [(p, f"{p}-K{k}") for p in parents for k in range(4)], columns=["Parent", "Material"]
+    ), "father")
+    mrp_df, mrp_cols = normalize_sheet(pd.DataFrame({
+        "Component": COMPONENTS + ["C9"],
+        "MRP Controller": ["M1", "M2", "M1", "M2"],
+        "Order Type": ["F", "E", "F", "E"],
+        "Description": ["d0", "d1", "d2", "d9"],
+    }), "mrp")
+    return bom_df, father_df, mrp_df, dict(cols, **father_cols, **mrp_cols)
+
+
+def run(root, rows, parents=PARENTS, keep=KEEP_SNAPSHOTS, key=None):
+    # نفس خطوات run_analysis في وضع الـ snapshot، من غير قراية ملفات
+    bom_df, father_df, mrp_df, cols = make_frames(rows, parents)
+    context = prepare_analysis(bom_df, father_df, mrp_df, cols)
+    fingerprints = parent_fingerprints(context, parents)
+    previous_path = latest_snapshot(root, key=key or snapshot_key())
+    previous = load_snapshot(previous_path) if previous_path else None
+    stats = {}
+    parts = list(iter_snapshot_results(context, parents, previous, fingerprints, workers=1, stats=stats))
+    current = save_snapshot(context["engine"], parts, fingerprints, root, keep=keep, key=key)
+    return context, previous, current, parts, stats
+
+
+def test_unchanged_parents_are_reused(tmp_path):
+    root = str(tmp_path)
+    _, previous, _, _, stats = run(root, make_rows())
+    assert previous is None
+    assert stats == {"parents": 4, "reused": 0, "recomputed": 4}
+
+    context, previous, _, parts, stats = run(root, make_rows())
+    assert previous is not None
+    assert stats == {"parents": 4, "reused": 4, "recomputed": 0}
+    assert all(part.get("reused") for part in parts)
+    # النتيجة المسترجعة هي نفس التحليل من الأول
+    for part, fresh in zip(parts, analyze_parents(context, PARENTS)):
+        assert part["child_names"] == fresh["child_names"]
+        for key in ("components", "counts", "usage", "cell_child", "cell_comp", "cell_qty"):
+            np.testing.assert_array_equal(part[key], fresh[key])
+
+
+def test_changed_parent_is_recomputed_and_reported(tmp_path):
+    root = str(tmp_path)
+    run(root, make_rows())
+
+    rows = make_rows()
+    # P1: الابن K0 ما بقاش فيه C0 (كمية صفر)، وP2: مكوّن جديد C9 في الـ BOM بتاعه، وP3 اتشال
+    rows[rows.index(("P1-K0", "C0", 1))] = ("P1-K0", "C0", 0)
+    rows.append(("P2", "C9", 1))
+    _, previous, current, parts, stats = run(root, rows, PARENTS[:3])
+    assert stats == {"parents": 3, "reused": 1, "recomputed": 2}
+    assert [part["parent"] for part in parts if part.get("reused")] == ["P0"]
+
+    changes = snapshot_changes(previous, current)
+    assert changes == {"added": [], "removed": ["P3"], "changed": ["P1", "P2"], "unchanged": 1}
+
+    report = change_report(previous, current)
+    assert set(report["Parent"]) == {"P1", "P2", "P3"}
+    p1 = report[report["Parent"] == "P1"]
+    assert p1["Component"].tolist() == ["C0"]
+    assert p1.iloc[0][["Change", "Usage_%_Old", "Usage_%_New", "Usage_%_Delta"]].tolist() == \
+        ["changed", 100.0, 75.0, -25.0]
+    assert p1.iloc[0][["Deviation_Old", "Deviation_New", "Deviation_Delta"]].tolist() == [0, 1, 1]
+    p2 = report[report["Parent"] == "P2"]
+    assert p2[["Component", "Change", "Usage_%_New", "Deviation_New"]].values.tolist() == \
+        [["C9", "added", 0.0, 4]]
+    p3 = report[report["Parent"] == "P3"]
+    assert sorted(p3["Component"]) == COMPONENTS
+    assert set(p3["Change"]) == {"removed"}
+
+
+def test_prune_keeps_latest_per_key(tmp_path):
+    root = str(tmp_path)
+    exploded = snapshot_key(explode="all")
+    run(root, make_rows(), key=exploded)
+    for _ in range(4):
+        run(root, make_rows(), keep=2)
+    assert len(list_snapshots(root, key=snapshot_key())) == 2
+    # مفتاح تاني ما بيتمسحش بسبب تشغيل المفتاح الأول كتير
+    assert len(list_snapshots(root, key=exploded)) == 1
+    # وآخر snapshot لكل مفتاح بيتقارن بنفس المفتاح بس
+    _, previous, _, _, stats = run(root, make_rows(), key=exploded)
+    assert previous["meta"]["key"] == exploded
+    assert stats["reused"] == 4
+    assert len(os.listdir(root)) == 4